@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+
+from logging_config import get_logger
+from metrics import counter, histogram, register_gauge
+
+logger = get_logger('creative_api.admission')
+
+# Admission control configuration (limits are per worker process)
+ADMISSION_CONFIG = {
+    'enabled': os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true',
+    # Flask endpoint -> concurrent requests allowed; endpoints not listed are not limited
+    'limits': json.loads(os.getenv('ADMISSION_LIMITS', json.dumps({
+        'crop_image_endpoint': 4,
+        'add_new_creative': 4,
+        'add_creatives_bulk': 1,
+        'generate_ad_gemini': 2,
+        'composite_batch': 2,
+        'render_creative_rendition': 8,
+    }))),
+    # Waiting requests allowed per concurrency slot before new ones get 429
+    'queue_per_slot': int(os.getenv('ADMISSION_QUEUE_PER_SLOT', 4)),
+    # Longest a request may wait for a slot before it gets 503
+    'queue_timeout': float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10)),
+    # Shed new heavy requests with 503 above these budgets (0 disables)
+    'max_rss_mb': float(os.getenv('ADMISSION_MAX_RSS_MB', 0)),
+    'max_load_per_cpu': float(os.getenv('ADMISSION_MAX_LOAD_PER_CPU', 0)),
+    'retry_after': int(os.getenv('ADMISSION_RETRY_AFTER', 2)),
+}
+
+ADMISSION_REJECTED = counter('admission_rejected_total', 'Requests rejected by admission control by endpoint and reason')
+ADMISSION_WAIT_SECONDS = histogram('admission_wait_seconds', 'Time admitted requests spent queued for a slot',
+                                   buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+
+class Rejected(Exception):
+    """Request was not admitted; status is 429 (queue full) or 503 (overloaded)"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteGate:
+    """Concurrency limit with a bounded FIFO-ish wait queue for one endpoint"""
+
+    def __init__(self, endpoint, limit, queue_size):
+        self.endpoint = endpoint
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout):
+        start = time.perf_counter()
+        deadline = start + timeout
+        with self._condition:
+            if self.active < self.limit and self.waiting == 0:
+                self.active += 1
+                return 0.0
+            if self.waiting >= self.queue_size:
+                raise Rejected(429, 'queue_full', ADMISSION_CONFIG['retry_after'])
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise Rejected(503, 'queue_timeout', ADMISSION_CONFIG['retry_after'])
+                    self._condition.wait(remaining)
+                self.active += 1
+            finally:
+                self.waiting -= 1
+        return time.perf_counter() - start
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+def _current_rss_mb():
+    """Resident set size of this process in MB, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+_budget_state = {'checked_at': 0.0, 'reason': None}
+_budget_lock = threading.Lock()
+
+
+def over_budget():
+    """'memory' or 'cpu' when a resource budget is exceeded, else None; re-checked at most once a second"""
+    now = time.monotonic()
+    with _budget_lock:
+        if now - _budget_state['checked_at'] < 1.0:
+            return _budget_state['reason']
+        _budget_state['checked_at'] = now
+        reason = None
+        if ADMISSION_CONFIG['max_rss_mb'] > 0:
+            rss = _current_rss_mb()
+            if rss is not None and rss > ADMISSION_CONFIG['max_rss_mb']:
+                reason = 'memory'
+        if reason is None and ADMISSION_CONFIG['max_load_per_cpu'] > 0 and hasattr(os, 'getloadavg'):
+            if os.getloadavg()[0] / (os.cpu_count() or 1) > ADMISSION_CONFIG['max_load_per_cpu']:
+                reason = 'cpu'
+        if reason != _budget_state['reason']:
+            logger.warning(f"Admission resource budget {'exceeded: ' + reason if reason else 'recovered'}")
+        _budget_state['reason'] = reason
+        return reason
+
+
+GATES = {
+    endpoint: RouteGate(endpoint, int(limit), int(limit) * ADMISSION_CONFIG['queue_per_slot'])
+    for endpoint, limit in ADMISSION_CONFIG['limits'].items()
+}
+
+
+def admit(endpoint):
+    """
+    Admit a request to a limited endpoint; returns the gate to release, or None when unlimited.
+    Raises Rejected when the endpoint's queue is full, the wait deadline passes or the process
+    is over its memory/CPU budget.
+    """
+    gate = GATES.get(endpoint) if ADMISSION_CONFIG['enabled'] else None
+    if gate is None:
+        return None
+    try:
+        reason = over_budget()
+        if reason:
+            raise Rejected(503, reason, ADMISSION_CONFIG['retry_after'])
+        waited = gate.acquire(ADMISSION_CONFIG['queue_timeout'])
+    except Rejected as e:
+        ADMISSION_REJECTED.inc(endpoint=endpoint, reason=e.reason)
+        raise
+    ADMISSION_WAIT_SECONDS.observe(waited, endpoint=endpoint)
+    return gate
+
+
+register_gauge('admission_active', 'Requests currently running per limited endpoint',
+               lambda: [({'endpoint': name}, gate.active) for name, gate in GATES.items()])
+register_gauge('admission_queued', 'Requests waiting for a slot per limited endpoint',
+               lambda: [({'endpoint': name}, gate.waiting) for name, gate in GATES.items()])
@@ -0,0 +1,117 @@
+"""
+Bytes versus encode time for each output format and encoder setting.
+
+Renders each fixture to a platform rendition size with the app's crop path, then encodes it
+with every preset below through image_encoding.encode_image(). Use the table to choose
+RENDITION_FORMAT / PLATFORM_OUTPUT_FORMATS and the JPEG/WebP/AVIF/PNG settings.
+
+Usage:
+    python benchmarks/bench_encoders.py
+    python benchmarks/bench_encoders.py --sizes 2MP --modes RGB RGBA --dimensions 1080x1080 1200x628
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from benchmarks.bench_image_pipeline import SIZES, MODES, RESULTS_DIR, ensure_fixtures, fixture_path, timeit  # noqa: E402
+import focal_point  # noqa: E402
+import image_encoding  # noqa: E402
+
+# (label, format, save() overrides)
+PRESETS = [
+    ('jpeg q85 baseline', 'jpeg', {'progressive': False, 'optimize': False}),
+    ('jpeg q85 progressive+optimize', 'jpeg', {'progressive': True, 'optimize': True}),
+    ('jpeg q85 progressive 4:4:4', 'jpeg', {'progressive': True, 'optimize': True, 'subsampling': '4:4:4'}),
+    ('jpeg q75 progressive', 'jpeg', {'quality': 75, 'progressive': True, 'optimize': True}),
+    ('webp q80 m4', 'webp', {'quality': 80, 'method': 4}),
+    ('webp q80 m6', 'webp', {'quality': 80, 'method': 6}),
+    ('webp lossless', 'webp', {'lossless': True, 'quality': 50, 'method': 4}),
+    ('avif q60 s8', 'avif', {'quality': 60, 'speed': 8}),
+    ('avif q60 s4', 'avif', {'quality': 60, 'speed': 4}),
+    ('png level 1', 'png', {'compress_level': 1, 'optimize': False}),
+    ('png level 6', 'png', {'compress_level': 6, 'optimize': False}),
+    ('png level 9 optimize', 'png', {'compress_level': 9, 'optimize': True}),
+]
+
+
+def render(source, dimension):
+    width, height = map(int, dimension.split('x'))
+    box = focal_point.focal_crop_box(source.width, source.height, width, height)
+    return source.crop(box).resize((width, height), Image.Resampling.LANCZOS)
+
+
+def bench_rendition(rendition, repeat):
+    rows = []
+    for label, fmt, options in PRESETS:
+        actual = image_encoding.normalize_format(fmt)
+        if actual != fmt:
+            rows.append({'preset': label, 'skipped': f"{fmt} encoder not available"})
+            continue
+        try:
+            data, _ = image_encoding.encode_image(rendition, fmt, **options)
+            durations = timeit(lambda: image_encoding.encode_image(rendition, fmt, **options), repeat)
+        except Exception as e:
+            rows.append({'preset': label, 'error': f"{type(e).__name__}: {e}"})
+            continue
+        rows.append({
+            'preset': label,
+            'format': fmt,
+            'bytes': len(data),
+            'encode_ms': round(min(durations) * 1000, 2),
+        })
+    baseline = next((row['bytes'] for row in rows if 'bytes' in row), None)
+    for row in rows:
+        if 'bytes' in row and baseline:
+            row['vs_first'] = f"{row['bytes'] / baseline * 100:.0f}%"
+    return rows
+
+
+def print_table(case, rows):
+    print(f"\n{case}")
+    print(f"  {'preset':<32}{'bytes':>10}{'vs first':>10}{'encode ms':>12}")
+    for row in rows:
+        if 'bytes' not in row:
+            print(f"  {row['preset']:<32}  {row.get('skipped') or row.get('error')}")
+            continue
+        print(f"  {row['preset']:<32}{row['bytes']:>10}{row['vs_first']:>10}{row['encode_ms']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark output formats and encoder settings')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['2MP'])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['RGB', 'RGBA'])
+    parser.add_argument('--dimensions', nargs='+', default=['1080x1080', '1080x1920', '1200x628'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='results JSON path')
+    args = parser.parse_args()
+
+    ensure_fixtures(args.sizes, args.modes)
+    results = []
+    for size_name in args.sizes:
+        for mode in args.modes:
+            source = Image.open(fixture_path(size_name, mode))
+            source.load()
+            for dimension in args.dimensions:
+                rows = bench_rendition(render(source, dimension), args.repeat)
+                case = f"{size_name}/{mode} -> {dimension}"
+                print_table(case, rows)
+                results.append({'size': size_name, 'mode': mode, 'dimension': dimension, 'presets': rows})
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"encoders_{int(time.time())}.json")
+    with open(output, 'w') as f:
+        json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'results': results}, f, indent=2)
+    print(f"\nresults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
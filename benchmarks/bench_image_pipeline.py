@@ -0,0 +1,334 @@
+"""
+Benchmark for the image pipeline hot functions:
+crop_image(), create_simple_overlay(), optimize_image_for_api() and the PNG encode/base64 path.
+
+Runs offline: fixtures are generated deterministically, served from a local HTTP server,
+and S3 uploads are replaced with an in-memory stand-in. Each case runs in a fresh
+process so peak RSS is per case.
+
+Usage:
+    python benchmarks/bench_image_pipeline.py                         # full matrix
+    python benchmarks/bench_image_pipeline.py --quick                 # small sizes, RGB/RGBA only
+    python benchmarks/bench_image_pipeline.py --save-baseline         # write benchmarks/baseline.json
+    python benchmarks/bench_image_pipeline.py --baseline benchmarks/baseline.json
+"""
+import argparse
+import base64
+import functools
+import http.server
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+
+from PIL import Image, ImageDraw
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# Fixture sizes in megapixels (4:3 unless noted)
+SIZES = {
+    '0.3MP': (640, 480),
+    '2MP': (1920, 1080),
+    '12MP': (4000, 3000),
+    '50MP': (8660, 5774),
+}
+MODES = ['RGB', 'RGBA', 'P', 'CMYK']
+PLATFORMS = ['Facebook', 'Instagram', 'Google']
+TEMPLATE_SIZE = (1080, 1080)
+
+
+def fixture_path(size_name, mode):
+    ext = 'png' if mode in ('RGBA', 'P') else 'jpg'
+    return os.path.join(FIXTURE_DIR, f"{size_name}_{mode}.{ext}")
+
+
+def make_fixture(size, mode, seed=1234):
+    """Deterministic synthetic photo-like image: gradient background plus shapes"""
+    rng = random.Random(seed)
+    width, height = size
+    base = Image.merge('RGB', [
+        Image.linear_gradient('L').resize(size),
+        Image.linear_gradient('L').rotate(90).resize(size),
+        Image.radial_gradient('L').resize(size),
+    ])
+    draw = ImageDraw.Draw(base)
+    for _ in range(60):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 4 + 1), y0 + rng.randrange(height // 4 + 1)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+
+    if mode == 'RGBA':
+        alpha = Image.radial_gradient('L').resize(size)
+        image = base.copy()
+        image.putalpha(alpha)
+        return image
+    if mode == 'P':
+        return base.convert('P', palette=Image.Palette.ADAPTIVE, colors=256)
+    if mode == 'CMYK':
+        return base.convert('CMYK')
+    return base
+
+
+def ensure_fixtures(size_names, modes):
+    """Create any fixture files that do not exist yet"""
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    for size_name in size_names:
+        for mode in modes:
+            path = fixture_path(size_name, mode)
+            if os.path.exists(path):
+                continue
+            image = make_fixture(SIZES[size_name], mode)
+            if path.endswith('.png'):
+                image.save(path, format='PNG')
+            else:
+                image.save(path, format='JPEG', quality=90)
+            print(f"created fixture {os.path.relpath(path, REPO_ROOT)}")
+
+
+def start_fixture_server():
+    """Serve the fixture directory over HTTP on a random local port"""
+    handler = functools.partial(QuietHandler, directory=FIXTURE_DIR)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def timeit(fn, repeat):
+    """Run fn repeat times, return list of durations in seconds"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def measure(fn, repeat, megapixels):
+    """Time fn and summarize; a failing benchmark records its error instead of aborting the case"""
+    try:
+        return summarize(timeit(fn, repeat), megapixels)
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}"}
+
+
+def summarize(durations, megapixels):
+    median = statistics.median(durations)
+    return {
+        'median_s': round(median, 6),
+        'min_s': round(min(durations), 6),
+        'ops_per_s': round(1 / median, 3) if median else None,
+        'mp_per_s': round(megapixels / median, 3) if median else None,
+    }
+
+
+def stage_sums():
+    """Snapshot of total seconds per stage from the app's metrics"""
+    import metrics
+    sums = {}
+    for key, series in list(metrics.STAGE_SECONDS.series.items()):
+        sums[dict(key)['stage']] = (series['sum'], series['count'])
+    return sums
+
+
+def run_case(size_name, mode, repeat, port):
+    """Benchmark one fixture in the current (fresh) process"""
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    os.environ.setdefault('PLATFORM_LISTEN', 'false')
+    os.environ.setdefault('BACKFILL_ENABLED', 'false')
+    sys.path.insert(0, REPO_ROOT)
+    import hackaython_creative_sender_api as api
+
+    # Local S3 stand-in: keep bytes in memory
+    uploaded = {}
+
+    def fake_upload(image_data, filename, content_type=None):
+        uploaded[filename] = len(image_data) if isinstance(image_data, (bytes, bytearray)) else 0
+        return f"https://bench-bucket.s3.local/{filename}"
+
+    api.upload_bytes_to_s3 = fake_upload
+
+    path = fixture_path(size_name, mode)
+    url = f"http://127.0.0.1:{port}/{os.path.basename(path)}"
+    width, height = SIZES[size_name]
+    megapixels = width * height / 1e6
+    result = {'size': size_name, 'mode': mode, 'pixels': [width, height], 'file_bytes': os.path.getsize(path)}
+
+    # crop_image: download + decode + all platform renditions + upload stand-in
+    before = stage_sums()
+    crops = {}
+
+    def do_crop():
+        nonlocal crops
+        crops = api.crop_image(url, PLATFORMS)
+
+    durations = timeit(do_crop, repeat)
+    after = stage_sums()
+    result['crop_image'] = summarize(durations, megapixels)
+    result['crop_image']['renditions'] = sum(len(dims) for dims in crops.values())
+    result['crop_image']['stages_ms'] = {
+        stage: round((total - before.get(stage, (0, 0))[0]) / repeat * 1000, 3)
+        for stage, (total, count) in after.items() if stage.startswith('crop.')
+    }
+
+    source = Image.open(path)
+    source.load()
+    template = make_fixture(TEMPLATE_SIZE, 'RGB', seed=99)
+
+    # create_simple_overlay: product fixture onto a 1080x1080 template
+    result['create_simple_overlay'] = measure(lambda: api.create_simple_overlay(source, template), repeat, megapixels)
+
+    # optimize_image_for_api mutates via thumbnail(), so give it a copy each time
+    result['optimize_image_for_api'] = measure(lambda: api.optimize_image_for_api(source.copy()), repeat, megapixels)
+
+    # PNG encode + base64, as done for generated images
+    def encode_png_base64():
+        buffer = io.BytesIO()
+        source.save(buffer, format='PNG')
+        base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+    result['encode_png_base64'] = measure(encode_png_base64, repeat, megapixels)
+
+    result['uploaded_bytes'] = sum(uploaded.values())
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def _case_worker(args, queue):
+    try:
+        queue.put(run_case(*args))
+    except Exception as e:
+        queue.put({'size': args[0], 'mode': args[1], 'error': f"{type(e).__name__}: {e}"})
+
+
+def run_matrix(size_names, modes, repeat):
+    ensure_fixtures(size_names, modes)
+    server = start_fixture_server()
+    port = server.server_address[1]
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    try:
+        for size_name in size_names:
+            for mode in modes:
+                queue = ctx.Queue()
+                process = ctx.Process(target=_case_worker, args=((size_name, mode, repeat, port), queue))
+                process.start()
+                result = queue.get()
+                process.join()
+                results.append(result)
+                print(format_row(result))
+    finally:
+        server.shutdown()
+    return results
+
+
+BENCHMARKS = ['crop_image', 'create_simple_overlay', 'optimize_image_for_api', 'encode_png_base64']
+
+
+def format_row(result):
+    if 'error' in result:
+        return f"{result['size']:>6} {result['mode']:<5} ERROR {result['error']}"
+    cells = [
+        f"{name}={result[name]['median_s'] * 1000:.1f}ms" if 'median_s' in result[name] else f"{name}=ERROR"
+        for name in BENCHMARKS
+    ]
+    return f"{result['size']:>6} {result['mode']:<5} " + ' '.join(cells) + f" rss={result['peak_rss_mb']}MB"
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regressions where median time grew by more than threshold"""
+    base_index = {(r['size'], r['mode']): r for r in baseline.get('results', []) if 'error' not in r}
+    regressions = []
+    for result in results:
+        base = base_index.get((result['size'], result['mode']))
+        if not base or 'error' in result:
+            continue
+        for name in BENCHMARKS:
+            if 'median_s' not in base[name] or 'median_s' not in result[name]:
+                continue
+            old, new = base[name]['median_s'], result[name]['median_s']
+            if old and new > old * (1 + threshold):
+                regressions.append({
+                    'case': f"{result['size']}/{result['mode']}", 'benchmark': name,
+                    'baseline_s': old, 'current_s': new, 'change': f"{(new / old - 1) * 100:+.1f}%"
+                })
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold):
+            regressions.append({
+                'case': f"{result['size']}/{result['mode']}", 'benchmark': 'peak_rss_mb',
+                'baseline_s': base['peak_rss_mb'], 'current_s': result['peak_rss_mb'],
+                'change': f"{(result['peak_rss_mb'] / base['peak_rss_mb'] - 1) * 100:+.1f}%"
+            })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the image pipeline')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='0.3MP and 2MP, RGB and RGBA only')
+    parser.add_argument('--output', default=None, help='results JSON path')
+    parser.add_argument('--baseline', default=None, help='compare against this results file')
+    parser.add_argument('--save-baseline', action='store_true', help=f'also write {DEFAULT_BASELINE}')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown before failing (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    sizes, modes = args.sizes, args.modes
+    if args.quick:
+        sizes, modes = ['0.3MP', '2MP'], ['RGB', 'RGBA']
+
+    results = run_matrix(sizes, modes, args.repeat)
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"image_pipeline_{int(time.time())}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline written to {DEFAULT_BASELINE}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold * 100:.0f}%:")
+            for regression in regressions:
+                print(f"  {regression['case']} {regression['benchmark']}: "
+                      f"{regression['baseline_s']} -> {regression['current_s']} ({regression['change']})")
+            sys.exit(1)
+        print("no regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import image_encoding
+from metrics import timed
+
+# Batch compositing configuration
+COMPOSITE_CONFIG = {
+    # Product width as a fraction of the template width (the overlay fallback uses a quarter)
+    'product_scale': float(os.getenv('COMPOSITE_PRODUCT_SCALE', 0.25)),
+    # Threads for resizing, blending and encoding; Pillow and NumPy release the GIL for the heavy parts
+    'workers': int(os.getenv('COMPOSITE_WORKERS', min(8, os.cpu_count() or 4))),
+    # Largest products x templates grid one request may ask for
+    'max_outputs': int(os.getenv('COMPOSITE_MAX_OUTPUTS', 200)),
+    'format': os.getenv('COMPOSITE_FORMAT', 'jpeg'),
+    # Templates are scaled to fit this box before compositing (0 keeps full resolution)
+    'max_dimension': int(os.getenv('COMPOSITE_MAX_DIMENSION', 640)),
+}
+
+COMPOSITE_POOL = ThreadPoolExecutor(max_workers=COMPOSITE_CONFIG['workers'], thread_name_prefix='composite')
+
+
+def overlay_box(template_size, product_size):
+    """(width, height, x, y) of the product on a template: scaled to a fraction of its width, centred"""
+    template_width, template_height = template_size
+    width = max(1, int(template_width * COMPOSITE_CONFIG['product_scale']))
+    height = max(1, int(width * product_size[1] / product_size[0]))
+    return width, height, (template_width - width) // 2, (template_height - height) // 2
+
+
+def _working_image(image):
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    return image.convert('RGBA' if image_encoding.has_alpha(image) else 'RGB')
+
+
+class ProductLayer:
+    """
+    A product resized to one target size, ready to blend: RGBA premultiplied by alpha and
+    255 - alpha as uint16, or plain pixels when the product is opaque.
+    """
+
+    def __init__(self, product, size):
+        resized = product.resize(size, Image.Resampling.LANCZOS)
+        pixels = np.asarray(resized)
+        if resized.mode == 'RGBA' and pixels[..., 3].min() < 255:
+            alpha = pixels[..., 3:4].astype(np.uint16)
+            self.premultiplied = pixels.astype(np.uint16) * alpha
+            self.inverse_alpha = 255 - alpha
+            self.opaque = None
+        else:
+            self.premultiplied = self.inverse_alpha = None
+            self.opaque = pixels[..., :3]
+
+    def blend_into(self, canvas, x, y):
+        """Alpha-blend onto an RGB/RGBA uint8 array in place, clipped to its bounds (like Image.paste)"""
+        height, width = (self.opaque if self.opaque is not None else self.premultiplied).shape[:2]
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + width, canvas.shape[1]), min(y + height, canvas.shape[0])
+        if right <= left or bottom <= top:
+            return canvas
+        region = canvas[top:bottom, left:right]
+        rows = slice(top - y, bottom - y)
+        columns = slice(left - x, right - x)
+        channels = canvas.shape[2]
+        if self.opaque is not None:
+            region[..., :3] = self.opaque[rows, columns]
+            if channels == 4:
+                region[..., 3] = 255
+            return canvas
+        # src * a + dst * (255 - a), then an exact rounded division by 255 without leaving uint16
+        mixed = self.premultiplied[rows, columns, :channels] + region.astype(np.uint16) * self.inverse_alpha[rows, columns]
+        mixed += 128
+        mixed += mixed >> 8
+        region[...] = mixed >> 8
+        return canvas
+
+
+def composite(product, template, layers=None):
+    """
+    Product centred on a copy of the template. layers caches ProductLayer by size so the
+    resize runs once per distinct template size.
+    """
+    product = _working_image(product)
+    template = _working_image(template)
+    width, height, x, y = overlay_box(template.size, product.size)
+    if layers is not None and (width, height) in layers:
+        layer = layers[(width, height)]
+    else:
+        layer = ProductLayer(product, (width, height))
+        if layers is not None:
+            layers[(width, height)] = layer
+    canvas = np.array(template)
+    return Image.fromarray(layer.blend_into(canvas, x, y), template.mode)
+
+
+def _fit(image, max_dimension):
+    if max_dimension and max(image.size) > max_dimension:
+        image = image.copy()
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    return image
+
+
+def composite_grid(products, templates, fmt=None, max_dimension=None, **encode_options):
+    """
+    Composite every product onto every template and encode the results in parallel.
+    Templates are first scaled to fit max_dimension (default COMPOSITE_MAX_DIMENSION, 0 for
+    full size); each product is resized once per distinct target size and each template
+    decoded to an array once. Returns [{'product_index', 'template_index', 'data', 'format',
+    'size'}] in product-major order.
+    """
+    fmt = image_encoding.normalize_format(fmt or COMPOSITE_CONFIG['format'])
+    if max_dimension is None:
+        max_dimension = COMPOSITE_CONFIG['max_dimension']
+    products = [_working_image(product) for product in products]
+    with timed('composite.fit_templates'):
+        templates = list(COMPOSITE_POOL.map(lambda template: _fit(_working_image(template), max_dimension), templates))
+
+    # Distinct (product, target size) resizes, run in parallel
+    boxes = {
+        (p, t): overlay_box(template.size, product.size)
+        for p, product in enumerate(products) for t, template in enumerate(templates)
+    }
+    sizes = sorted({(p, width, height) for (p, _), (width, height, _, _) in boxes.items()})
+    with timed('composite.resize'):
+        built = COMPOSITE_POOL.map(lambda key: ProductLayer(products[key[0]], key[1:]), sizes)
+        layers = dict(zip(sizes, built))
+
+    with timed('composite.decode_templates'):
+        canvases = [np.asarray(template) for template in templates]
+
+    def render(pair):
+        p, t = pair
+        width, height, x, y = boxes[pair]
+        canvas = layers[(p, width, height)].blend_into(canvases[t].copy(), x, y)
+        data, used = image_encoding.encode_image(Image.fromarray(canvas, templates[t].mode), fmt, **encode_options)
+        return {'product_index': p, 'template_index': t, 'data': data, 'format': used,
+                'size': [canvas.shape[1], canvas.shape[0]]}
+
+    with timed('composite.blend_encode'):
+        return list(COMPOSITE_POOL.map(render, sorted(boxes)))
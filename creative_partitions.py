@@ -0,0 +1,406 @@
+import argparse
+import bisect
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from psycopg import sql
+
+import tag_index
+from logging_config import get_logger
+
+logger = get_logger('creative_api.partitions')
+
+# creative_new partitioning configuration
+PARTITION_CONFIG = {
+    # Schema bootstrap creates creative_new range-partitioned by created_at (one partition per month);
+    # an existing plain table is converted with `python creative_partitions.py migrate`
+    'enabled': os.getenv('CREATIVE_PARTITIONING', 'false').lower() == 'true',
+    # Months of partitions kept ready ahead of the current one
+    'premake_months': int(os.getenv('CREATIVE_PARTITION_PREMAKE_MONTHS', 3)),
+    # How often each worker checks that the future partitions exist
+    'maintenance_seconds': float(os.getenv('CREATIVE_PARTITION_MAINTENANCE_SECONDS', 3600)),
+    # How often the creative_id ranges per partition are re-read for lookups by id
+    'range_refresh_seconds': float(os.getenv('CREATIVE_PARTITION_RANGE_REFRESH_SECONDS', 60)),
+    # Detached partitions are moved here unless they are dropped
+    'archive_schema': os.getenv('CREATIVE_ARCHIVE_SCHEMA', 'creative_archive'),
+    'lock_key': int(os.getenv('CREATIVE_PARTITION_LOCK_KEY', 727002)),
+}
+
+PARENT_TABLE = 'creative_new'
+LEGACY_TABLE = 'creative_new_legacy'
+
+# Column definitions shared by the plain and the partitioned layout
+CREATIVE_TABLE_COLUMNS = """
+    ad_item_id VARCHAR(255) NOT NULL,
+    creative_title VARCHAR(255) NOT NULL,
+    creative_description TEXT,
+    creative_s3_url VARCHAR(500),
+    campaign VARCHAR(255),
+    format_type VARCHAR(100),
+    tags JSONB,
+    dynamic_elements JSONB,
+    image_data JSONB,
+    selected_platforms JSONB,
+    generated_creatives JSONB,
+    focal_point JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+"""
+
+# The key has to include the partition column; lookups by creative_id alone still use its leading column
+PARTITIONED_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS creative_new (
+    creative_id SERIAL,
+    {CREATIVE_TABLE_COLUMNS},
+    PRIMARY KEY (creative_id, created_at)
+) PARTITION BY RANGE (created_at)
+"""
+
+# Newest-first listings read each partition's index from the top instead of sorting
+CREATIVE_INDEX_SQL = [
+    "CREATE INDEX IF NOT EXISTS creative_new_created_at_idx ON creative_new (created_at DESC)",
+]
+
+PARTITIONS_SQL = """
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), i.inhdetachpending, c.reltuples
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'creative_new'::regclass
+ORDER BY c.relname
+"""
+
+BOUND_PATTERN = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def _bound(value):
+    value = value.strip()
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def table_layout(cursor):
+    """'partitioned', 'plain', or None when creative_new does not exist"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('creative_new')")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return 'partitioned' if row[0] == 'p' else 'plain'
+
+
+def list_partitions(cursor):
+    """[{'name', 'lower', 'upper', 'detach_pending', 'estimated_rows'}] with None for an open bound"""
+    cursor.execute(PARTITIONS_SQL)
+    partitions = []
+    for name, bound, detach_pending, estimated_rows in cursor.fetchall():
+        match = BOUND_PATTERN.search(bound or '')
+        if match is None:
+            continue
+        partitions.append({
+            'name': name,
+            'lower': _bound(match.group(1)),
+            'upper': _bound(match.group(2)),
+            'detach_pending': detach_pending,
+            'estimated_rows': max(0, int(estimated_rows)),
+        })
+    partitions.sort(key=lambda p: p['lower'] or datetime.min)
+    return partitions
+
+
+def partition_name(start):
+    return f"creative_new_p{start:%Y%m}"
+
+
+def _add_month(start):
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+
+def _covered(partitions, start):
+    return any((p['lower'] is None or p['lower'] <= start) and (p['upper'] is None or start < p['upper'])
+               for p in partitions)
+
+
+def ensure_creative_indexes(cursor):
+    for statement in CREATIVE_INDEX_SQL:
+        cursor.execute(statement)
+
+
+def ensure_partitions(cursor):
+    """
+    Create the monthly partitions from the current month through premake_months ahead.
+    Serialized across workers with a transaction-level advisory lock; returns the names created.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_CONFIG['lock_key'],))
+    # The database clock decides which month created_at falls in
+    cursor.execute("SELECT date_trunc('month', LOCALTIMESTAMP)")
+    start = cursor.fetchone()[0]
+    partitions = list_partitions(cursor)
+    created = []
+    for _ in range(PARTITION_CONFIG['premake_months'] + 1):
+        end = _add_month(start)
+        if not _covered(partitions, start):
+            name = partition_name(start)
+            cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF creative_new FOR VALUES FROM ({}) TO ({})")
+                           .format(sql.Identifier(name), sql.Literal(start), sql.Literal(end)))
+            created.append(name)
+        start = end
+    if created:
+        logger.info(f"Created creative partitions: {', '.join(created)}")
+    return created
+
+
+def create_partitioned_table(cursor):
+    """Bootstrap creative_new partitioned by created_at, with its indexes and upcoming partitions"""
+    layout = table_layout(cursor)
+    if layout == 'plain':
+        logger.warning("creative_new is a plain table; run `python creative_partitions.py migrate` to partition it")
+        return False
+    cursor.execute(PARTITIONED_TABLE_SQL)
+    ensure_creative_indexes(cursor)
+    ensure_partitions(cursor)
+    return True
+
+
+def migrate_table(conn):
+    """
+    Convert a plain creative_new into a partitioned one without copying rows: the existing table is
+    renamed to creative_new_legacy and attached as the partition for everything before next month,
+    with new monthly partitions after it. Holds an exclusive lock on the table throughout; attaching
+    scans it once to check the bound and builds the (creative_id, created_at) key on it.
+    Indexes and triggers are re-created on the new parent. Returns the legacy partition's upper
+    bound, or None if the table is already partitioned.
+    """
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            if table_layout(cursor) != 'plain':
+                return None
+            cursor.execute("LOCK TABLE creative_new IN ACCESS EXCLUSIVE MODE")
+            cursor.execute("UPDATE creative_new SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+            cursor.execute("ALTER TABLE creative_new ALTER COLUMN created_at SET NOT NULL")
+            cursor.execute("SELECT date_trunc('month', GREATEST(MAX(created_at), LOCALTIMESTAMP)) + interval '1 month' "
+                           "FROM creative_new")
+            boundary = cursor.fetchone()[0]
+
+            # Triggers are re-created on the parent (and from there on every partition)
+            cursor.execute("SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger "
+                           "WHERE tgrelid = 'creative_new'::regclass AND NOT tgisinternal")
+            triggers = cursor.fetchall()
+            for name, _ in triggers:
+                cursor.execute(sql.SQL("DROP TRIGGER {} ON creative_new").format(sql.Identifier(name)))
+
+            # Secondary indexes are re-created on the parent, which adopts the existing ones on attach
+            cursor.execute("SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+                           "WHERE indrelid = 'creative_new'::regclass AND NOT indisprimary")
+            indexes = [definition for (definition,) in cursor.fetchall()]
+
+            # The parent's key replaces the old one; index names move aside so the parent can reuse them
+            cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = 'creative_new'::regclass AND contype = 'p'")
+            for (name,) in cursor.fetchall():
+                cursor.execute(sql.SQL("ALTER TABLE creative_new DROP CONSTRAINT {}").format(sql.Identifier(name)))
+            cursor.execute("SELECT relname FROM pg_class WHERE oid IN "
+                           "(SELECT indexrelid FROM pg_index WHERE indrelid = 'creative_new'::regclass)")
+            for (name,) in cursor.fetchall():
+                cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                    sql.Identifier(name), sql.Identifier(name.replace(PARENT_TABLE, LEGACY_TABLE, 1))))
+
+            # The id sequence outlives the rename and keeps numbering new rows
+            cursor.execute("SELECT pg_get_serial_sequence('creative_new', 'creative_id')")
+            sequence = cursor.fetchone()[0]
+            if sequence:
+                cursor.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY NONE").format(sql.SQL(sequence)))
+            cursor.execute(sql.SQL("ALTER TABLE creative_new RENAME TO {}").format(sql.Identifier(LEGACY_TABLE)))
+            cursor.execute(sql.SQL(
+                "CREATE TABLE creative_new (LIKE {} INCLUDING DEFAULTS, PRIMARY KEY (creative_id, created_at)) "
+                "PARTITION BY RANGE (created_at)").format(sql.Identifier(LEGACY_TABLE)))
+            if sequence:
+                cursor.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY creative_new.creative_id").format(sql.SQL(sequence)))
+            cursor.execute(sql.SQL("ALTER TABLE creative_new ATTACH PARTITION {} FOR VALUES FROM (MINVALUE) TO ({})")
+                           .format(sql.Identifier(LEGACY_TABLE), sql.Literal(boundary)))
+            for definition in indexes + [definition for _, definition in triggers]:
+                cursor.execute(definition)
+            ensure_creative_indexes(cursor)
+            ensure_partitions(cursor)
+    logger.info(f"Partitioned creative_new; rows before {boundary} are in {LEGACY_TABLE}")
+    return boundary
+
+
+def archive_partitions(conn, before, drop=False, dry_run=False):
+    """
+    Detach the partitions whose range ends on or before `before` (never the current month's),
+    then move them to the archive schema or drop them. Uses DETACH ... CONCURRENTLY, so reads and
+    writes on creative_new continue; an interrupted detach is finalized on the next run.
+    Returns the names of the partitions archived.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT date_trunc('month', LOCALTIMESTAMP)")
+        current_month = cursor.fetchone()[0]
+        cutoff = min(before, current_month)
+        cold = [p for p in list_partitions(cursor) if p['upper'] is not None and p['upper'] <= cutoff]
+        if dry_run:
+            return [p['name'] for p in cold]
+        if cold and not drop:
+            cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(PARTITION_CONFIG['archive_schema'])))
+        for partition in cold:
+            name = sql.Identifier(partition['name'])
+            mode = sql.SQL('FINALIZE' if partition['detach_pending'] else 'CONCURRENTLY')
+            cursor.execute(sql.SQL("ALTER TABLE creative_new DETACH PARTITION {} {}").format(name, mode))
+            if drop:
+                cursor.execute(sql.SQL("DROP TABLE {}").format(name))
+            else:
+                cursor.execute(sql.SQL("ALTER TABLE {} SET SCHEMA {}").format(
+                    name, sql.Identifier(PARTITION_CONFIG['archive_schema'])))
+            logger.info(f"{'Dropped' if drop else 'Archived'} creative partition {partition['name']} "
+                        f"(~{partition['estimated_rows']} rows)")
+        if cold:
+            # Archived creatives leave the ad-serving tag index on its next rebuild
+            tag_index.request_rebuild(cursor)
+    return [p['name'] for p in cold]
+
+
+# Per-partition creative_id ranges, for turning a lookup by id into one that prunes by created_at
+_ranges = {'partitioned': None, 'entries': [], 'refreshed_at': 0.0}
+_ranges_lock = threading.Lock()
+
+PARTITION_ID_RANGE_SQL = "SELECT {name}, (SELECT MIN(creative_id) FROM {table}), (SELECT MAX(creative_id) FROM {table})"
+
+
+def _refresh_ranges(conn):
+    now = time.time()
+    with _ranges_lock:
+        if now - _ranges['refreshed_at'] < PARTITION_CONFIG['range_refresh_seconds']:
+            return
+        # Claim the refresh; concurrent lookups keep using the current ranges
+        _ranges['refreshed_at'] = now
+    with conn.cursor() as cursor:
+        partitioned = table_layout(cursor) == 'partitioned'
+        entries = []
+        partitions = list_partitions(cursor) if partitioned else []
+        if partitions:
+            # MIN/MAX come off the leading column of each partition's key
+            query = sql.SQL(' UNION ALL ').join(
+                sql.SQL(PARTITION_ID_RANGE_SQL).format(name=sql.Literal(p['name']), table=sql.Identifier(p['name']))
+                for p in partitions if not p['detach_pending']
+            )
+            cursor.execute(query)
+            bounds = {p['name']: p for p in partitions}
+            for name, min_id, max_id in cursor.fetchall():
+                if min_id is not None:
+                    entries.append((min_id, max_id, bounds[name]['lower'], bounds[name]['upper']))
+    entries.sort(key=lambda entry: entry[0])
+    with _ranges_lock:
+        _ranges['partitioned'] = partitioned
+        _ranges['entries'] = entries
+
+
+def created_at_range(conn, creative_id):
+    """
+    (lower, upper) created_at bounds that contain creative_id's row, or None when the table is not
+    partitioned or the id is in no known range. Bounds may be None (open). Ids above every known
+    range belong to rows inserted since the last refresh, which live in the newest partitions.
+    """
+    try:
+        _refresh_ranges(conn)
+    except Exception as e:
+        logger.warning(f"Could not read creative partition ranges: {e}")
+        conn.rollback()
+    with _ranges_lock:
+        entries = _ranges['entries']
+    if not entries:
+        return None
+    newest = max(entries, key=lambda entry: entry[1])
+    if creative_id > newest[1]:
+        return newest[2], None
+    # Ranges of neighbouring months can overlap by a few ids (transactions straddling midnight)
+    end = bisect.bisect_right([entry[0] for entry in entries], creative_id)
+    matches = [entry for entry in entries[:end] if creative_id <= entry[1]]
+    if not matches:
+        return None
+    lowers = [entry[2] for entry in matches]
+    uppers = [entry[3] for entry in matches]
+    return (None if None in lowers else min(lowers)), (None if None in uppers else max(uppers))
+
+
+def _maintain_forever(connect):
+    while True:
+        conn = connect()
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    if table_layout(cursor) == 'partitioned':
+                        ensure_partitions(cursor)
+                conn.commit()
+            except Exception as e:
+                logger.error(f"Creative partition maintenance failed: {e}")
+            finally:
+                conn.close()
+        time.sleep(PARTITION_CONFIG['maintenance_seconds'])
+
+
+_maintenance_thread = None
+
+
+def init_partitions(connect):
+    """Keep upcoming partitions created while the worker runs (no-op for a plain table)"""
+    global _maintenance_thread
+    if _maintenance_thread is None:
+        _maintenance_thread = threading.Thread(target=_maintain_forever, args=(connect,),
+                                               name='creative-partitions', daemon=True)
+        _maintenance_thread.start()
+
+
+def get_stats():
+    with _ranges_lock:
+        return {
+            'partitioned': _ranges['partitioned'],
+            'partitions_with_rows': len(_ranges['entries']),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the monthly partitions of creative_new')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='List partitions with their bounds and estimated rows')
+    commands.add_parser('ensure', help='Create the current and upcoming monthly partitions')
+    commands.add_parser('migrate', help='Convert a plain creative_new table into a partitioned one')
+    archive = commands.add_parser('archive', help='Detach partitions that end on or before a date')
+    archive.add_argument('--before', required=True, type=datetime.fromisoformat,
+                         help='ISO date; partitions ending on or before it are detached')
+    archive.add_argument('--drop', action='store_true', help='Drop detached partitions instead of archiving them')
+    archive.add_argument('--dry-run', action='store_true', help='Only list the partitions that would be detached')
+    args = parser.parse_args()
+
+    # Same connection settings as the platform sync script
+    from upload_platforms import get_db_connection
+    conn = get_db_connection()
+    if conn is None:
+        raise SystemExit(1)
+    try:
+        if args.command == 'status':
+            with conn.cursor() as cursor:
+                print(f"layout: {table_layout(cursor)}")
+                if table_layout(cursor) == 'partitioned':
+                    for p in list_partitions(cursor):
+                        pending = ' (detach pending)' if p['detach_pending'] else ''
+                        print(f"{p['name']}: {p['lower'] or 'MINVALUE'} .. {p['upper'] or 'MAXVALUE'}, "
+                              f"~{p['estimated_rows']} rows{pending}")
+        elif args.command == 'ensure':
+            with conn.cursor() as cursor:
+                created = ensure_partitions(cursor)
+            conn.commit()
+            print(f"created: {', '.join(created) or 'nothing'}")
+        elif args.command == 'migrate':
+            boundary = migrate_table(conn)
+            print('already partitioned' if boundary is None else f"partitioned; legacy rows end before {boundary}")
+        elif args.command == 'archive':
+            names = archive_partitions(conn, args.before, drop=args.drop, dry_run=args.dry_run)
+            action = 'would detach' if args.dry_run else ('dropped' if args.drop else 'archived')
+            print(f"{action}: {', '.join(names) or 'nothing'}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+import json
+import os
+
+from psycopg.rows import dict_row
+
+import creative_partitions
+
+# Query layer configuration
+QUERY_CONFIG = {
+    # Prepare the creative statements server-side on first use per connection; turn off behind
+    # a transaction-mode PgBouncer, which cannot keep prepared statements
+    'prepare': os.getenv('DB_PREPARE_STATEMENTS', 'true').lower() == 'true',
+    # How /creatives computes pagination.total: window (same statement), count (pipelined COUNT) or none
+    'default_total': os.getenv('CREATIVES_TOTAL_MODE', 'window'),
+    # Rows fetched per round-trip by the export's server-side cursor
+    'export_batch_size': int(os.getenv('EXPORT_BATCH_SIZE', 500)),
+}
+
+TOTAL_MODES = ('window', 'count', 'none')
+
+CREATIVE_COLUMNS = """
+    creative_id,
+    ad_item_id,
+    creative_title,
+    creative_description,
+    creative_s3_url,
+    campaign,
+    format_type,
+    tags,
+    dynamic_elements,
+    image_data,
+    selected_platforms,
+    focal_point,
+    created_at
+"""
+
+# One static filter for the page and the count: a NULL pattern disables its condition, so the
+# statement text never changes and each connection plans it once.
+CREATIVE_FILTER = """
+WHERE (%(platform)s::text IS NULL OR selected_platforms::text ILIKE %(platform)s)
+  AND (%(search)s::text IS NULL OR creative_title ILIKE %(search)s
+       OR creative_description ILIKE %(search)s OR campaign ILIKE %(search)s)
+"""
+
+# With a created_after/created_before bound the created_at range is added (open ends are
+# +/-infinity) so partition pruning works for generic plans too. Without one it is left out:
+# rows with a NULL created_at (allowed on the unpartitioned table) must still be listed.
+CREATIVE_RANGE_FILTER = CREATIVE_FILTER + """\
+  AND created_at >= %(created_after)s::timestamp AND created_at < %(created_before)s::timestamp
+"""
+
+# Statement variants keyed by whether the created_at range applies
+CREATIVE_FILTERS = {False: CREATIVE_FILTER, True: CREATIVE_RANGE_FILTER}
+
+LIST_CREATIVES_SQL = {ranged: f"""
+SELECT {CREATIVE_COLUMNS}
+FROM creative_new
+{creative_filter}
+ORDER BY created_at DESC
+LIMIT %(limit)s OFFSET %(offset)s
+""" for ranged, creative_filter in CREATIVE_FILTERS.items()}
+
+# The total over the whole filtered set rides along on every row of the page
+LIST_CREATIVES_WITH_TOTAL_SQL = {ranged: f"""
+SELECT {CREATIVE_COLUMNS}, COUNT(*) OVER () AS total_count
+FROM creative_new
+{creative_filter}
+ORDER BY created_at DESC
+LIMIT %(limit)s OFFSET %(offset)s
+""" for ranged, creative_filter in CREATIVE_FILTERS.items()}
+
+COUNT_CREATIVES_SQL = {ranged: f"""
+SELECT COUNT(*) AS total
+FROM creative_new
+{creative_filter}
+""" for ranged, creative_filter in CREATIVE_FILTERS.items()}
+
+# Columns stored as JSON text that readers get decoded
+JSON_COLUMNS = ('tags', 'dynamic_elements', 'image_data', 'selected_platforms', 'focal_point')
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+CREATIVE_BY_ID_SQL = f"""
+SELECT {CREATIVE_COLUMNS}
+FROM creative_new
+WHERE creative_id = %s
+"""
+
+# Same lookup confined to the partitions whose id ranges contain the id
+CREATIVE_BY_ID_PRUNED_SQL = f"""
+SELECT {CREATIVE_COLUMNS}
+FROM creative_new
+WHERE creative_id = %s AND created_at >= %s::timestamp AND created_at < %s::timestamp
+"""
+
+CREATIVE_PHASH_SQL = "SELECT phash, creative_s3_url FROM creative_new WHERE creative_id = %s"
+
+SIMILAR_CREATIVES_SQL = """
+SELECT creative_id, ad_item_id, creative_title, creative_s3_url, campaign, created_at
+FROM creative_new
+WHERE creative_id = ANY(%s)
+"""
+
+# Only fills a missing focal point; an explicit or earlier one is never overwritten
+STORE_FOCAL_POINT_SQL = "UPDATE creative_new SET focal_point = %s WHERE creative_id = %s AND focal_point IS NULL"
+
+INSERT_CREATIVE_SQL = """
+INSERT INTO creative_new (
+    creative_title, creative_description, campaign, format_type,
+    tags, dynamic_elements, image_data, creative_s3_url,
+    selected_platforms, ad_item_id, focal_point, phash
+)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+RETURNING creative_id
+"""
+
+
+def prepare_flag():
+    """Value for execute(prepare=...): True prepares now, None leaves it to psycopg's threshold"""
+    return True if QUERY_CONFIG['prepare'] else None
+
+
+def is_ranged(created_after=None, created_before=None):
+    """Whether the created_at range filter applies (some bound was given)"""
+    return bool(created_after or created_before)
+
+
+def filter_params(platform=None, search=None, created_after=None, created_before=None):
+    """ILIKE patterns and created_at bounds for CREATIVE_FILTERS; None disables a condition"""
+    return {
+        'platform': f'%{platform}%' if platform else None,
+        'search': f'%{search}%' if search else None,
+        'created_after': created_after or '-infinity',
+        'created_before': created_before or 'infinity',
+    }
+
+
+def list_creatives(conn, limit, offset, platform=None, search=None, total='window',
+                   created_after=None, created_before=None):
+    """
+    One page of creatives (newest first) and the filtered total.
+    total='window' counts in the same statement, 'count' pipelines a COUNT(*) with the page
+    (one round-trip either way) and 'none' skips counting and returns None for the total.
+    A created_at range limits the scan (and the count) to the partitions it overlaps.
+    """
+    params = dict(filter_params(platform, search, created_after, created_before), limit=limit, offset=offset)
+    ranged = is_ranged(created_after, created_before)
+    prepare = prepare_flag()
+
+    if total == 'count':
+        with conn.pipeline():
+            page = conn.cursor(row_factory=dict_row)
+            count = conn.cursor(row_factory=dict_row)
+            page.execute(LIST_CREATIVES_SQL[ranged], params, prepare=prepare)
+            count.execute(COUNT_CREATIVES_SQL[ranged], params, prepare=prepare)
+        rows = page.fetchall()
+        total_count = count.fetchone()['total']
+        page.close()
+        count.close()
+        return rows, total_count
+
+    if total == 'none':
+        with conn.cursor(row_factory=dict_row) as cursor:
+            cursor.execute(LIST_CREATIVES_SQL[ranged], params, prepare=prepare)
+            return cursor.fetchall(), None
+
+    with conn.cursor(row_factory=dict_row) as cursor:
+        cursor.execute(LIST_CREATIVES_WITH_TOTAL_SQL[ranged], params, prepare=prepare)
+        rows = cursor.fetchall()
+        total_count = rows[0]['total_count'] if rows else None
+        for row in rows:
+            del row['total_count']
+        # An empty page past the end carries no total; only then is a separate count needed
+        if total_count is None:
+            total_count = 0
+            if offset > 0:
+                cursor.execute(COUNT_CREATIVES_SQL[ranged], params, prepare=prepare)
+                total_count = cursor.fetchone()['total']
+    return rows, total_count
+
+
+def export_sql(include_image_data=False, ranged=False):
+    """Full-catalog query in creative_id order; image_data (the rendition blobs) only on request"""
+    columns = [column.strip() for column in CREATIVE_COLUMNS.split(',')]
+    if not include_image_data:
+        columns.remove('image_data')
+    return f"SELECT {', '.join(columns)} FROM creative_new {CREATIVE_FILTERS[ranged]} ORDER BY creative_id"
+
+
+def iter_export_rows(conn, platform=None, search=None, include_image_data=False,
+                     created_after=None, created_before=None):
+    """
+    Yield lists of up to export_batch_size row dicts through a named server-side cursor,
+    so only one batch is ever held in memory. Runs inside its own transaction.
+    """
+    batch_size = QUERY_CONFIG['export_batch_size']
+    with conn.transaction():
+        with conn.cursor(name='creative_export', row_factory=dict_row) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(export_sql(include_image_data, is_ranged(created_after, created_before)),
+                           filter_params(platform, search, created_after, created_before))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+
+def iter_export_csv(conn, platform=None, search=None, include_image_data=False,
+                    created_after=None, created_before=None, chunk_bytes=64 * 1024):
+    """Yield CSV (with header) formatted by Postgres via COPY TO STDOUT, in chunks of about chunk_bytes"""
+    ranged = is_ranged(created_after, created_before)
+    copy_sql = f"COPY ({export_sql(include_image_data, ranged)}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+    buffer = bytearray()
+    with conn.cursor() as cursor:
+        with cursor.copy(copy_sql, filter_params(platform, search, created_after, created_before)) as copy:
+            for data in copy:
+                buffer += data
+                if len(buffer) >= chunk_bytes:
+                    yield bytes(buffer)
+                    buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def get_creative(conn, creative_id):
+    """
+    Full creative row as a dict, or None. On a partitioned table the lookup is first confined to
+    the partitions whose id ranges contain the id; a miss there falls back to all partitions.
+    """
+    bounds = creative_partitions.created_at_range(conn, creative_id)
+    with conn.cursor(row_factory=dict_row) as cursor:
+        if bounds is not None:
+            lower, upper = bounds
+            cursor.execute(CREATIVE_BY_ID_PRUNED_SQL, (creative_id, lower or '-infinity', upper or 'infinity'),
+                           prepare=prepare_flag())
+            row = cursor.fetchone()
+            if row is not None:
+                return row
+        cursor.execute(CREATIVE_BY_ID_SQL, (creative_id,), prepare=prepare_flag())
+        return cursor.fetchone()
+
+
+def insert_creative(cursor, params):
+    """Insert one creative (creative_insert_params order) and return its id"""
+    cursor.execute(INSERT_CREATIVE_SQL, params, prepare=prepare_flag())
+    return cursor.fetchone()[0]
+
+
+def store_focal_point(cursor, creative_id, focal):
+    """Persist a computed (x, y) focal point for a creative that has none"""
+    cursor.execute(STORE_FOCAL_POINT_SQL, (json.dumps({'x': focal[0], 'y': focal[1]}), creative_id),
+                   prepare=prepare_flag())
+    return cursor.rowcount
@@ -0,0 +1,270 @@
+import itertools
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from logging_config import get_logger
+from metrics import counter, register_gauge
+
+logger = get_logger('creative_api.db_router')
+
+# Optional connection pools for the primary and replicas
+try:
+    from psycopg_pool import ConnectionPool
+    POOL_AVAILABLE = True
+except ImportError:
+    ConnectionPool = None
+    POOL_AVAILABLE = False
+
+# Read/write routing configuration
+ROUTER_CONFIG = {
+    # Comma-separated replica DSNs; empty sends every read to the primary
+    'replica_dsns': [dsn.strip() for dsn in os.getenv('DB_REPLICA_DSNS', '').split(',') if dsn.strip()],
+    'pool_min': int(os.getenv('DB_REPLICA_POOL_MIN', 1)),
+    'pool_max': int(os.getenv('DB_REPLICA_POOL_MAX', 10)),
+    # Seconds to wait for a pooled replica connection before falling back to the primary
+    'pool_timeout': float(os.getenv('DB_REPLICA_POOL_TIMEOUT', 1)),
+    # Replicas further behind than this are skipped
+    'max_lag_seconds': float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', 5)),
+    'check_seconds': float(os.getenv('DB_REPLICA_CHECK_SECONDS', 5)),
+    # After a write, the same client reads from the primary for this long
+    'read_your_writes_seconds': float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5)),
+    'sticky_cookie': os.getenv('DB_STICKY_COOKIE', 'db_primary_until'),
+    # Request-scoped primary connections come from a pool so prepared statements survive
+    # between requests; 0 opens a new connection per request
+    'primary_pool_min': int(os.getenv('DB_POOL_MIN', 1)),
+    'primary_pool_max': int(os.getenv('DB_POOL_MAX', 10)),
+    'primary_pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+}
+
+DB_READS = counter('db_reads_total', 'Read-only connections handed out by target and reason')
+
+# Lag is zero when everything received has been replayed, else time since the last replayed commit
+LAG_QUERY = """
+SELECT pg_is_in_recovery(),
+       CASE
+           WHEN NOT pg_is_in_recovery() THEN 0
+           WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+           ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END
+"""
+
+
+_borrowed = threading.local()
+
+
+class PooledConnection:
+    """Connection borrowed from a pool; close() returns it instead of closing it"""
+
+    def __init__(self, pool, conn, replica=False):
+        self._pool = pool
+        self._conn = conn
+        self.is_replica = replica
+        if not hasattr(_borrowed, 'connections'):
+            _borrowed.connections = []
+        _borrowed.connections.append(self)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.putconn(self._conn)
+            self._conn = None
+            try:
+                _borrowed.connections.remove(self)
+            except (AttributeError, ValueError):
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        self.close()
+
+
+class Replica:
+    def __init__(self, index, dsn):
+        parts = urlsplit(dsn) if '://' in dsn else None
+        self.name = f"replica{index}" + (f"@{parts.hostname}" if parts and parts.hostname else '')
+        self.dsn = dsn
+        self.healthy = False
+        self.lag_seconds = None
+        self.checked_at = 0.0
+        self.pool = ConnectionPool(
+            dsn, min_size=ROUTER_CONFIG['pool_min'], max_size=ROUTER_CONFIG['pool_max'],
+            name=self.name, open=False, kwargs={'autocommit': True}
+        )
+
+    def check(self):
+        """Refresh health and lag; a replica that errors or lags too far is taken out of rotation"""
+        try:
+            with self.pool.connection(timeout=ROUTER_CONFIG['pool_timeout']) as conn:
+                in_recovery, lag = conn.execute(LAG_QUERY).fetchone()
+            self.lag_seconds = float(lag)
+            healthy = self.lag_seconds <= ROUTER_CONFIG['max_lag_seconds']
+            if not in_recovery and self.checked_at == 0:
+                logger.warning(f"{self.name} is not in recovery; is it really a replica?")
+        except Exception as e:
+            logger.warning(f"Replica health check failed for {self.name}: {e}")
+            self.lag_seconds = None
+            healthy = False
+        if healthy != self.healthy:
+            logger.info(f"{self.name} {'back in' if healthy else 'out of'} read rotation (lag {self.lag_seconds})")
+        self.healthy = healthy
+        self.checked_at = time.time()
+
+
+_connect_primary = None
+_primary_pool = None
+_replicas = []
+_round_robin = itertools.count()
+_checker_thread = None
+
+
+def _check_forever():
+    while True:
+        for replica in _replicas:
+            replica.check()
+        time.sleep(ROUTER_CONFIG['check_seconds'])
+
+
+def init_router(connect_primary, primary_dsn=None):
+    """
+    Set the primary connection factory, open the primary and replica pools and start health checks.
+    Without primary_dsn (or with DB_POOL_MAX=0) every primary connection comes from connect_primary.
+    """
+    global _connect_primary, _primary_pool, _replicas, _checker_thread
+    _connect_primary = connect_primary
+    if primary_dsn and ROUTER_CONFIG['primary_pool_max'] > 0 and _primary_pool is None:
+        if POOL_AVAILABLE:
+            _primary_pool = ConnectionPool(
+                primary_dsn, min_size=min(ROUTER_CONFIG['primary_pool_min'], ROUTER_CONFIG['primary_pool_max']),
+                max_size=ROUTER_CONFIG['primary_pool_max'], name='primary', open=False,
+                kwargs={'autocommit': True}
+            )
+            _primary_pool.open(wait=False)
+        else:
+            logger.warning("psycopg_pool not installed, opening a primary connection per request")
+    if ROUTER_CONFIG['replica_dsns'] and not _replicas:
+        if not POOL_AVAILABLE:
+            logger.warning("psycopg_pool not installed, reads go to the primary")
+            return
+        _replicas = [Replica(index, dsn) for index, dsn in enumerate(ROUTER_CONFIG['replica_dsns'])]
+        for replica in _replicas:
+            replica.pool.open(wait=False)
+            replica.check()
+        _checker_thread = threading.Thread(target=_check_forever, name='db-replica-health', daemon=True)
+        _checker_thread.start()
+
+
+def _primary():
+    if _primary_pool is None:
+        return _connect_primary()
+    try:
+        conn = _primary_pool.getconn(timeout=ROUTER_CONFIG['primary_pool_timeout'])
+    except Exception as e:
+        logger.error(f"No connection from the primary pool: {e}")
+        return None
+    return PooledConnection(_primary_pool, conn)
+
+
+def get_write_connection():
+    """Connection to the primary (pooled, autocommit: wrap multi-statement writes in conn.transaction())"""
+    return _primary()
+
+
+def get_read_connection(prefer_primary=False):
+    """
+    Connection for a read-only query: a healthy, non-lagging replica in round-robin order,
+    else the primary. prefer_primary forces the primary (read-your-writes, retries).
+    """
+    if prefer_primary or not _replicas:
+        DB_READS.inc(target='primary', reason='sticky' if prefer_primary else 'no_replicas')
+        return _primary()
+    healthy = [replica for replica in _replicas if replica.healthy]
+    if not healthy:
+        DB_READS.inc(target='primary', reason='replicas_unhealthy')
+        return _primary()
+    start = next(_round_robin)
+    for offset in range(len(healthy)):
+        replica = healthy[(start + offset) % len(healthy)]
+        try:
+            conn = replica.pool.getconn(timeout=ROUTER_CONFIG['pool_timeout'])
+        except Exception as e:
+            logger.warning(f"No connection from {replica.name}: {e}")
+            continue
+        DB_READS.inc(target='replica', reason='ok')
+        return PooledConnection(replica.pool, conn, replica=True)
+    DB_READS.inc(target='primary', reason='replicas_busy')
+    return _primary()
+
+
+def is_replica(conn):
+    return isinstance(conn, PooledConnection) and conn.is_replica
+
+
+def detach(conn):
+    """Stop tracking a pooled connection for this thread (e.g. handed to a streaming response); the caller closes it"""
+    try:
+        _borrowed.connections.remove(conn)
+    except (AttributeError, ValueError):
+        pass
+    return conn
+
+
+def release_borrowed():
+    """Return pooled connections this thread never closed (e.g. after an exception); returns how many"""
+    connections = list(getattr(_borrowed, 'connections', ()))
+    for conn in connections:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Error returning pooled connection: {e}")
+    return len(connections)
+
+
+def in_sticky_window(cookies):
+    """True while the client is inside its read-your-writes window"""
+    try:
+        return float(cookies.get(ROUTER_CONFIG['sticky_cookie'], 0)) > time.time()
+    except (TypeError, ValueError):
+        return False
+
+
+def mark_write(response):
+    """Pin the client's reads to the primary for a short window after a write"""
+    window = ROUTER_CONFIG['read_your_writes_seconds']
+    if _replicas and window > 0:
+        response.set_cookie(ROUTER_CONFIG['sticky_cookie'], f"{time.time() + window:.3f}",
+                            max_age=int(window) + 1, httponly=True, samesite='Lax')
+    return response
+
+
+def _pools():
+    """(label, pool) for the primary pool (when enabled) and every replica pool"""
+    pools = [('primary', _primary_pool)] if _primary_pool is not None else []
+    return pools + [(replica.name, replica.pool) for replica in _replicas]
+
+
+def _pool_gauge(value):
+    """Gauge callback: value(stats) per pool from psycopg_pool's get_stats()"""
+    return lambda: [({'pool': name}, value(pool.get_stats())) for name, pool in _pools()]
+
+
+register_gauge('db_replica_healthy', 'Replica in read rotation (1) or not (0)',
+               lambda: [({'replica': replica.name}, int(replica.healthy)) for replica in _replicas])
+register_gauge('db_replica_lag_seconds', 'Replica replay lag from the last health check',
+               lambda: [({'replica': replica.name}, replica.lag_seconds) for replica in _replicas
+                        if replica.lag_seconds is not None])
+register_gauge('db_pool_size', 'Connections currently open in each pool',
+               _pool_gauge(lambda stats: stats.get('pool_size', 0)))
+register_gauge('db_pool_in_use', 'Connections checked out of each pool',
+               _pool_gauge(lambda stats: stats.get('pool_size', 0) - stats.get('pool_available', 0)))
+register_gauge('db_pool_waiting', 'Requests waiting for a connection from each pool',
+               _pool_gauge(lambda stats: stats.get('requests_waiting', 0)))
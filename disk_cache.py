@@ -0,0 +1,185 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+
+class DiskCache:
+    """
+    Byte-budgeted LRU cache of blobs on local disk, with an optional TTL.
+    Files are written atomically (temp file + rename) and tracked in an in-memory index
+    (name -> size, last access) rebuilt from the directory on start, so the cache survives
+    restarts and lookups and eviction never scan the directory.
+    """
+
+    def __init__(self, directory, max_bytes, name='disk_cache', max_age_seconds=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.name = name
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'expired': 0}
+        self._lock = threading.Lock()
+        self._index = {}
+        self._last_sweep = time.time()
+        os.makedirs(directory, exist_ok=True)
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.startswith('.tmp-'):
+                # Left behind by a crash mid-write (recent ones may belong to another worker)
+                if time.time() - stat.st_mtime > 3600:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                continue
+            self._index[entry.name] = [stat.st_size, stat.st_mtime]
+        self._bytes = sum(size for size, _ in self._index.values())
+
+    def path_for(self, key, extension=''):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + extension)
+
+    def _expired(self, accessed, now):
+        return self.max_age_seconds is not None and now - accessed > self.max_age_seconds
+
+    def _read(self, name):
+        """Bytes for a file name, or None; refreshes recency"""
+        path = os.path.join(self.directory, name)
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is not None and self._expired(entry[1], now):
+                self._remove_locked(name)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+        # Files missing from the index may have been written by another worker process
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._remove_locked(name)
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            if name in self._index:
+                self._index[name][1] = now
+            else:
+                self._index[name] = [len(data), now]
+                self._bytes += len(data)
+            self.stats['hits'] += 1
+        return data
+
+    def get(self, key, extension=''):
+        """Cached bytes for key, or None"""
+        return self._read(os.path.basename(self.path_for(key, extension)))
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            previous = self._index.get(name, [0])[0]
+            self._index[name] = [len(data), time.time()]
+            self._bytes += len(data) - previous
+            self.stats['writes'] += 1
+            over_budget = self._bytes > self.max_bytes
+            # With a TTL, sweep expired files now and then even when under budget
+            sweep_due = self.max_age_seconds is not None and time.time() - self._last_sweep > 60
+        if over_budget or sweep_due:
+            self.evict()
+        return path
+
+    def put(self, key, data, extension=''):
+        """Store bytes for key atomically and evict least recently used files over budget"""
+        if len(data) > self.max_bytes:
+            return None
+        return self._write(os.path.basename(self.path_for(key, extension)), data)
+
+    def put_content(self, data, extension='', prefix=''):
+        """
+        Store bytes under a content-hashed name (prefix + sha256 + extension); identical
+        content is stored once. Returns the file path, or None when larger than the budget.
+        """
+        if len(data) > self.max_bytes:
+            return None
+        name = f"{prefix}{hashlib.sha256(data).hexdigest()}{extension}"
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            exists = name in self._index
+        if exists:
+            try:
+                os.utime(path)
+                with self._lock:
+                    self._index[name][1] = time.time()
+                return path
+            except (FileNotFoundError, KeyError):
+                pass
+        return self._write(name, data)
+
+    def lookup(self, name):
+        """Path of a stored file by name if present and not expired, else None"""
+        name = os.path.basename(name)
+        if not name or name.startswith('.'):
+            return None
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            entry = self._index.get(name)
+        if entry is None:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return None
+            entry = [stat.st_size, stat.st_mtime]
+        if self._expired(entry[1], time.time()):
+            return None
+        return path
+
+    def _remove_locked(self, name):
+        entry = self._index.pop(name, None)
+        if entry is None:
+            return
+        self._bytes -= entry[0]
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def evict(self, target_fraction=0.9):
+        """Delete expired files, then least recently used files until under target_fraction of the budget"""
+        now = time.time()
+        with self._lock:
+            self._last_sweep = now
+            for name, (_, accessed) in list(self._index.items()):
+                if self._expired(accessed, now):
+                    self._remove_locked(name)
+                    self.stats['expired'] += 1
+            target = self.max_bytes * target_fraction
+            if self._bytes > target:
+                for name, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+                    if self._bytes <= target:
+                        break
+                    self._remove_locked(name)
+                    self.stats['evictions'] += 1
+
+    def size_bytes(self):
+        with self._lock:
+            return self._bytes
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, bytes=self._bytes, max_bytes=self.max_bytes, files=len(self._index))
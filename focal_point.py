@@ -0,0 +1,146 @@
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Focal point configuration
+FOCAL_CONFIG = {
+    # Longest side of the thumbnail the saliency map is computed on
+    'analysis_size': int(os.getenv('FOCAL_ANALYSIS_SIZE', 128)),
+    # Source hashes remembered in memory
+    'cache_size': int(os.getenv('FOCAL_CACHE_SIZE', 10000)),
+    # Strength of the pull towards the image centre (0 disables)
+    'center_bias': float(os.getenv('FOCAL_CENTER_BIAS', 0.3)),
+}
+
+CENTER = (0.5, 0.5)
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def _normalize(values):
+    low, high = values.min(), values.max()
+    if high - low < 1e-6:
+        return np.zeros_like(values)
+    return (values - low) / (high - low)
+
+
+def compute_focal_point(image):
+    """
+    Estimate the most salient point of an image, as (x, y) fractions of width and height.
+    Saliency combines edge energy with colour contrast against the blurred image mean,
+    computed on a small thumbnail so cost is independent of source resolution.
+    """
+    size = FOCAL_CONFIG['analysis_size']
+    scale = size / max(image.width, image.height)
+    thumb_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    thumb = image.resize(thumb_size, Image.Resampling.BOX, reducing_gap=3.0) if scale < 1 else image.copy()
+    if thumb.mode in ('RGBA', 'LA') or (thumb.mode == 'P' and 'transparency' in thumb.info):
+        # Transparent areas are background, not subject
+        thumb = thumb.convert('RGBA')
+        background = Image.new('RGBA', thumb.size, (255, 255, 255, 255))
+        thumb = Image.alpha_composite(background, thumb)
+    thumb = thumb.convert('RGB').filter(ImageFilter.GaussianBlur(1))
+
+    pixels = np.asarray(thumb, dtype=np.float32) / 255.0
+    if pixels.shape[0] < 3 or pixels.shape[1] < 3:
+        return CENTER
+
+    # Edge energy from first differences of luminance
+    luminance = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    edges = np.zeros_like(luminance)
+    edges[:, 1:] += np.abs(np.diff(luminance, axis=1))
+    edges[1:, :] += np.abs(np.diff(luminance, axis=0))
+
+    # Colour contrast against the mean colour (frequency-tuned saliency)
+    contrast = np.sqrt(((pixels - pixels.reshape(-1, 3).mean(axis=0)) ** 2).sum(axis=2))
+
+    saliency = _normalize(edges) + _normalize(contrast)
+
+    # Weak centre prior so flat images resolve to the centre
+    bias = FOCAL_CONFIG['center_bias']
+    if bias > 0:
+        height, width = saliency.shape
+        ys = (np.arange(height, dtype=np.float32) + 0.5) / height - 0.5
+        xs = (np.arange(width, dtype=np.float32) + 0.5) / width - 0.5
+        distance = ys[:, None] ** 2 + xs[None, :] ** 2
+        saliency = saliency * (1.0 - bias * distance / 0.5)
+
+    # Keep only the most salient fifth and take its weighted centroid
+    threshold = np.quantile(saliency, 0.8)
+    weights = np.where(saliency >= threshold, saliency, 0.0) ** 2
+    total = weights.sum()
+    if total <= 0:
+        return CENTER
+    height, width = weights.shape
+    x = float((weights.sum(axis=0) * (np.arange(width) + 0.5)).sum() / total / width)
+    y = float((weights.sum(axis=1) * (np.arange(height) + 0.5)).sum() / total / height)
+    return (round(min(max(x, 0.0), 1.0), 4), round(min(max(y, 0.0), 1.0), 4))
+
+
+def get_focal_point(source_bytes, image):
+    """Focal point for a source image, computed once per distinct source (by content hash)"""
+    key = hashlib.sha1(source_bytes).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _cache_stats['hits'] += 1
+            return _cache[key]
+        _cache_stats['misses'] += 1
+    focal = compute_focal_point(image)
+    with _cache_lock:
+        _cache[key] = focal
+        while len(_cache) > FOCAL_CONFIG['cache_size']:
+            _cache.popitem(last=False)
+    return focal
+
+
+def parse_focal_point(value):
+    """
+    Parse an API focal point override: {"x": 0.3, "y": 0.6} or [0.3, 0.6], fractions of width/height
+    Returns (x, y), None when absent, raises ValueError when malformed
+    """
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        x, y = value.get('x'), value.get('y')
+    elif isinstance(value, (list, tuple)) and len(value) == 2:
+        x, y = value
+    else:
+        raise ValueError('focal point must be {"x": 0-1, "y": 0-1}')
+    if isinstance(x, bool) or isinstance(y, bool) or not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+        raise ValueError('focal point x and y must be numbers')
+    if not (0 <= x <= 1 and 0 <= y <= 1):
+        raise ValueError('focal point x and y must be between 0 and 1')
+    return (float(x), float(y))
+
+
+def focal_crop_box(source_width, source_height, target_width, target_height, focal=CENTER):
+    """
+    Largest box with the target aspect ratio, centred on the focal point as far as the
+    image bounds allow. With the default centre this is the plain centre crop.
+    """
+    target_ratio = target_width / target_height
+    if source_width / source_height > target_ratio:
+        # Source is wider, crop width
+        crop_width, crop_height = int(source_height * target_ratio), source_height
+    else:
+        # Source is taller, crop height
+        crop_width, crop_height = source_width, int(source_width / target_ratio)
+
+    left = math.floor(focal[0] * source_width - crop_width / 2)
+    top = math.floor(focal[1] * source_height - crop_height / 2)
+    left = min(max(left, 0), source_width - crop_width)
+    top = min(max(top, 0), source_height - crop_height)
+    return (left, top, left + crop_width, top + crop_height)
+
+
+def get_cache_stats():
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_cache))
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import image_encoding
+from logging_config import get_logger
+from metrics import counter, histogram
+
+logger = get_logger('creative_api.generation_inputs')
+
+# Generation input preparation configuration
+GENERATION_INPUT_CONFIG = {
+    # Off: PIL images go to the SDK as-is (it re-encodes them as full-resolution PNG on every call)
+    'enabled': os.getenv('GENERATION_INPUT_OPTIMIZE', 'true').lower() == 'true',
+    # Per-model limits by input role; "default" covers models not listed.
+    # Templates keep their resolution: the prompt addresses template pixel coordinates.
+    'limits': json.loads(os.getenv('GENERATION_INPUT_LIMITS', json.dumps({
+        'default': {
+            'product': {'max_dimension': 1024, 'format': 'jpeg', 'quality': 85},
+            'template': {'max_dimension': 0, 'format': 'jpeg', 'quality': 90},
+        },
+    }))),
+    # Prepared bytes kept in memory, keyed by source-bytes hash and limits
+    'cache_bytes': int(os.getenv('GENERATION_INPUT_CACHE_BYTES', 64 * 1024 * 1024)),
+    # Share of preparations that also encode the unprepared PNG the SDK would send, to measure savings.
+    # The encode runs on a background thread; samples arriving while one is in flight are skipped.
+    'baseline_sample_rate': float(os.getenv('GENERATION_INPUT_BASELINE_SAMPLE_RATE', 0.1)),
+}
+
+LOSSY_FORMATS = ('jpeg', 'webp', 'avif')
+
+GENERATION_INPUT_BYTES = counter('generation_input_bytes_total', 'Image bytes sent to generation models by model and role')
+GENERATION_INPUT_SAVED = counter('generation_input_bytes_saved_total',
+                                 'Bytes saved versus the unprepared PNG, on sampled preparations, by role')
+GENERATION_INPUT_CACHE = counter('generation_input_cache_total', 'Prepared-input cache lookups by result')
+GENERATION_INPUT_RATIO = histogram('generation_input_size_ratio',
+                                   'Prepared size as a fraction of the unprepared PNG, on sampled preparations',
+                                   buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0))
+GENERATION_CALL_SECONDS = histogram('generation_call_seconds',
+                                    'Generation model round-trip by model and whether inputs were prepared',
+                                    buckets=(0.5, 1.0, 2.5, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 120.0))
+
+
+class PreparedInput:
+    """Encoded model input: bytes, mimetype, format and pixel size"""
+
+    def __init__(self, data, fmt, size):
+        self.data = data
+        self.format = fmt
+        self.mime_type = image_encoding.mimetype(fmt)
+        self.size = size
+
+    def summary(self):
+        return {'bytes': len(self.data), 'format': self.format, 'size': list(self.size)}
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_state = {'bytes': 0}
+
+BASELINE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='generation-baseline')
+_baseline_slot = threading.Semaphore(1)
+
+
+def limits_for(model, role):
+    models = GENERATION_INPUT_CONFIG['limits']
+    return (models.get(model) or models['default']).get(role) or models['default'][role]
+
+
+def content_key(source, limits):
+    """
+    Hash of the downloaded source bytes plus the limits they are prepared for. The encoded
+    file carries the palette and EXIF orientation, so sources that render differently never share a key.
+    """
+    digest = hashlib.sha1(f"{json.dumps(limits, sort_keys=True)}|".encode('utf-8'))
+    digest.update(source)
+    return digest.hexdigest()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        prepared = _cache.get(key)
+        if prepared is not None:
+            _cache.move_to_end(key)
+        return prepared
+
+
+def _cache_put(key, prepared):
+    with _cache_lock:
+        if key in _cache:
+            return
+        _cache[key] = prepared
+        _cache_state['bytes'] += len(prepared.data)
+        while _cache_state['bytes'] > GENERATION_INPUT_CONFIG['cache_bytes'] and _cache:
+            _, evicted = _cache.popitem(last=False)
+            _cache_state['bytes'] -= len(evicted.data)
+
+
+def _baseline_bytes(image):
+    """Size of what the SDK sends for a bare PIL image (PNG of the original)"""
+    return len(image_encoding.encode_image(image, 'png', optimize=False)[0])
+
+
+def _observe_baseline(image, prepared_bytes, role):
+    try:
+        baseline = _baseline_bytes(image)
+        GENERATION_INPUT_SAVED.inc(max(0, baseline - prepared_bytes), role=role)
+        GENERATION_INPUT_RATIO.observe(prepared_bytes / max(1, baseline), role=role)
+    except Exception as e:
+        logger.warning(f"Baseline encode failed for {role} input: {e}")
+    finally:
+        _baseline_slot.release()
+
+
+def prepare(image, source, model, role):
+    """
+    Downscale, normalize and encode one generation input within the model's limits for its role.
+    source is the downloaded file the image was decoded from; identical sources are prepared
+    once and served from the cache afterwards.
+    """
+    limits = limits_for(model, role)
+    key = content_key(source, limits)
+    prepared = _cache_get(key)
+    if prepared is not None:
+        GENERATION_INPUT_CACHE.inc(result='hit')
+        GENERATION_INPUT_BYTES.inc(len(prepared.data), model=model, role=role)
+        return prepared
+    GENERATION_INPUT_CACHE.inc(result='miss')
+
+    working = image_encoding.normalize_source(image)
+    max_dimension = limits.get('max_dimension') or 0
+    if max_dimension and max(working.size) > max_dimension:
+        scale = max_dimension / max(working.size)
+        working = working.resize((max(1, round(working.width * scale)), max(1, round(working.height * scale))),
+                                 Image.Resampling.LANCZOS)
+    # Transparency survives only in a format that carries it
+    fmt = image_encoding.normalize_format(limits.get('format', 'jpeg'))
+    if image_encoding.has_alpha(working) and fmt == 'jpeg':
+        fmt = 'png'
+    options = {'quality': limits['quality']} if fmt in LOSSY_FORMATS and 'quality' in limits else {}
+    data, fmt = image_encoding.encode_image(working, fmt, **options)
+    prepared = PreparedInput(data, fmt, working.size)
+    _cache_put(key, prepared)
+    GENERATION_INPUT_BYTES.inc(len(data), model=model, role=role)
+
+    if (random.random() < GENERATION_INPUT_CONFIG['baseline_sample_rate']
+            and _baseline_slot.acquire(blocking=False)):
+        BASELINE_POOL.submit(_observe_baseline, image, len(data), role)
+    return prepared
+
+
+def observe_call(model, prepared, started):
+    """Record one model round-trip for comparing prepared and unprepared inputs"""
+    GENERATION_CALL_SECONDS.observe(time.perf_counter() - started, model=model,
+                                    inputs='prepared' if prepared else 'original')
+
+
+def get_cache_stats():
+    with _cache_lock:
+        return {'entries': len(_cache), 'bytes': _cache_state['bytes']}
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, send_file
 import psycopg
 from psycopg.rows import dict_row
 import os
@@ -18,13 +18,34 @@ from google.genai import types
 import PIL.Image
 
 import logging
-logging.basicConfig(level=logging.DEBUG)
-import boto3
 import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from logging_config import get_logger, log_event, get_dropped_count
+from metrics import timed, REQUEST_SECONDS, register_gauge, render_prometheus, server_timing_header
+import profiling
+import admission
+import platform_registry
+import db_router
+import creative_queries
+import creative_partitions
+import tag_index
+import focal_point
+import perceptual_hash
+import compositor
+import generation_inputs
+import rendition_backfill
+import response_pipeline
+import image_encoding
+import single_flight
+import hashlib
+from disk_cache import DiskCache
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = get_logger('creative_api')
+
 app = Flask(__name__)
 # cors
 @app.after_request
@@ -34,69 +55,108 @@ def add_cors_headers(response):
     response.headers['Access-Control-Allow-Methods'] = 'GET,POST,PUT,DELETE,OPTIONS'
     return response
 
+# request timing
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if profiling.should_profile(request.headers, request.endpoint):
+        g.profiler = profiling.start_profile()
+
+# admission control for CPU-heavy endpoints
+@app.before_request
+def admit_request():
+    try:
+        g.admission_gate = admission.admit(request.endpoint)
+    except admission.Rejected as e:
+        log_event(logger, logging.WARNING, 'admission.rejected', endpoint=request.endpoint,
+                  reason=e.reason, status=e.status, sample_rate=0.1)
+        response = jsonify({'error': 'Server busy, retry later', 'reason': e.reason})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status
+
+@app.teardown_request
+def release_admission(error=None):
+    gate = g.pop('admission_gate', None)
+    if gate is not None:
+        gate.release()
+
+@app.teardown_request
+def release_db_connections(error=None):
+    leaked = db_router.release_borrowed()
+    if leaked:
+        logger.warning(f"Returned {leaked} unclosed pooled connection(s) after {request.endpoint}")
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.endpoint or 'unknown',
+                                method=request.method, status=response.status_code)
+    timing = server_timing_header()
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+# negotiated compression (runs before the metrics hook so its cost is in the request time)
+@app.after_request
+def compress_response(response):
+    return response_pipeline.compress_response(response, request.headers.get('Accept-Encoding'))
+
+@app.teardown_request
+def finish_request_profile(error=None):
+    sampler = g.pop('profiler', None)
+    if sampler is not None:
+        try:
+            duration = time.perf_counter() - g.get('request_start', time.perf_counter())
+            path = profiling.finish_profile(sampler, request.endpoint, duration)
+            if path:
+                logger.info(f"Wrote request profile: {path}")
+        except Exception as e:
+            logger.error(f"Error writing request profile: {e}")
+
+def create_genai_client():
+    """Create a GenAI client; GEMINI_BASE_URL points it at another endpoint (e.g. a local stub)"""
+    base_url = os.getenv('GEMINI_BASE_URL')
+    if base_url:
+        return genai.Client(api_key=os.getenv('GEMINI_API_KEY'), http_options={'base_url': base_url})
+    return genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
+
 # Initialize Google GenAI client
 GENAI_ENABLED = False
 try:
     # Test client creation
-    test_client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
+    test_client = create_genai_client()
     GENAI_ENABLED = True
-    print("Google GenAI client initialized successfully")
+    logger.info("Google GenAI client initialized successfully")
 except Exception as e:
-    print(f"Google GenAI client initialization failed: {e}")
+    logger.warning(f"Google GenAI client initialization failed: {e}")
     GENAI_ENABLED = False
 
 def create_simple_overlay(product_image, template_image):
     """Create a simple overlay of product on template as fallback"""
-    print("going for overlayyyyy")
+    logger.debug("Creating simple overlay")
     try:
-        # Resize product image to fit on template
-        template_width, template_height = template_image.size
-        
-        # Make product image smaller (25% of template width)
-        product_width = template_width // 4
-        product_ratio = product_image.size[1] / product_image.size[0]
-        product_height = int(product_width * product_ratio)
-        
-        # Resize product image
-        product_resized = product_image.resize((product_width, product_height), Image.Resampling.LANCZOS)
-        
-        # Create a copy of template
-        result_image = template_image.copy()
-        
-        # Calculate position (center of template)
-        x = (template_width - product_width) // 2
-        y = (template_height - product_height) // 2
-        
-        # Paste product onto template (handle transparency if needed)
-        if product_resized.mode == 'RGBA':
-            result_image.paste(product_resized, (x, y), product_resized)
-        else:
-            result_image.paste(product_resized, (x, y))
-        
-        return result_image
+        # Product at 25% of the template width, centred, alpha-blended
+        with timed('overlay.composite'):
+            return compositor.composite(product_image, template_image)
     except Exception as e:
-        print(f"Error creating overlay: {e}")
+        logger.error(f"Error creating overlay: {e}")
         return None
 
 def optimize_image_for_api(image, max_size=(1024, 1024), quality=85):
     """Optimize image for API calls - resize and compress"""
     try:
-        # Convert to RGB if necessary
-        if image.mode in ('RGBA', 'P'):
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode == 'P':
-                image = image.convert('RGBA')
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-            image = background
+        # Upright sRGB RGB, alpha flattened onto white
+        image = image_encoding.normalize_source(image, keep_alpha=False)
         
         # Resize if too large
         if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
             image.thumbnail(max_size, Image.Resampling.LANCZOS)
-            print(f"Resized image to {image.size}")
+            logger.debug(f"Resized image to {image.size}")
         
         return image
     except Exception as e:
-        print(f"Error optimizing image: {e}")
+        logger.error(f"Error optimizing image: {e}")
         return image
 
 # Configure AWS S3 (Optional)
@@ -105,12 +165,13 @@ try:
         's3',
         aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
         aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION', 'us-east-1')
+        region_name=os.getenv('AWS_REGION', 'us-east-1'),
+        endpoint_url=os.getenv('S3_ENDPOINT_URL') or None
     )
     S3_BUCKET = os.getenv('S3_BUCKET', 'hackathon-ads')
     S3_ENABLED = True
 except Exception as e:
-    print(f"S3 not configured: {e}")
+    logger.warning(f"S3 not configured: {e}")
     s3_client = None
     S3_BUCKET = None
     S3_ENABLED = False
@@ -128,152 +189,190 @@ DB_CONFIG = {
 # S3 configuration
 S3_CONFIG = {
     'bucket_name': os.getenv('S3_BUCKET_NAME', 'your-bucket-name'),
-    'region': os.getenv('AWS_REGION', 'us-east-1')
+    'region': os.getenv('AWS_REGION', 'us-east-1'),
+    # S3-compatible endpoint (MinIO, moto) instead of AWS
+    'endpoint_url': os.getenv('S3_ENDPOINT_URL') or None
 }
 
-def upload_image_to_s3(image_data, filename):
-    """Upload image data to S3 and return the URL"""
+def s3_object_url(bucket, key):
+    """Public URL of an S3 object, honouring a custom S3 endpoint"""
+    if S3_CONFIG['endpoint_url']:
+        return f"{S3_CONFIG['endpoint_url'].rstrip('/')}/{bucket}/{key}"
+    return f"https://{bucket}.s3.{S3_CONFIG['region']}.amazonaws.com/{key}"
+
+def upload_bytes_to_s3(image_data, filename, content_type='image/jpeg'):
+    """Upload encoded image bytes to S3 and return the URL"""
     try:
         # Check if AWS credentials are available
         aws_access_key = os.getenv('AWS_ACCESS_KEY_ID')
         aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
         bucket_name = S3_CONFIG['bucket_name']
         
-        print(f"Checking S3 configuration:")
-        print(f"  AWS_ACCESS_KEY_ID: {'Set' if aws_access_key else 'Not set'}")
-        print(f"  AWS_SECRET_ACCESS_KEY: {'Set' if aws_secret_key else 'Not set'}")
-        print(f"  S3_BUCKET_NAME: {bucket_name}")
-        print(f"  AWS_REGION: {S3_CONFIG['region']}")
-        
         if not aws_access_key or not aws_secret_key:
-            print("ERROR: AWS credentials not found in environment variables")
-            print("Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
+            logger.error("AWS credentials not found in environment variables; set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
             return None
         
         if bucket_name == 'your-bucket-name':
-            print("ERROR: S3_BUCKET_NAME not set")
-            print("Please set S3_BUCKET_NAME environment variable")
+            logger.error("S3_BUCKET_NAME not set")
             return None
         
-        print(f"Attempting to upload to S3 bucket: {bucket_name}")
         
         s3_client = boto3.client(
             's3',
             aws_access_key_id=aws_access_key,
             aws_secret_access_key=aws_secret_key,
-            region_name=S3_CONFIG['region']
+            region_name=S3_CONFIG['region'],
+            endpoint_url=S3_CONFIG['endpoint_url']
         )
         
         # Test S3 connection
         try:
-            s3_client.head_bucket(Bucket=bucket_name)
-            print(f"Successfully connected to S3 bucket: {bucket_name}")
+            with timed('s3.head_bucket'):
+                s3_client.head_bucket(Bucket=bucket_name)
         except Exception as bucket_error:
-            print(f"ERROR: Cannot access S3 bucket '{bucket_name}': {bucket_error}")
+            logger.error(f"Cannot access S3 bucket '{bucket_name}': {bucket_error}")
             return None
         
         # Upload to S3
-        print(f"Uploading file: {filename}")
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=f"cropped-images/{filename}",
-            Body=image_data,
-            ContentType='image/jpeg'
-            # Removed ACL='public-read' as bucket doesn't support ACLs
-        )
+        with timed('s3.put_object'):
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=f"cropped-images/{filename}",
+                Body=image_data,
+                ContentType=content_type
+                # Removed ACL='public-read' as bucket doesn't support ACLs
+            )
         
-        s3_url = f"https://{bucket_name}.s3.{S3_CONFIG['region']}.amazonaws.com/cropped-images/{filename}"
-        print(f"Successfully uploaded to S3: {s3_url}")
+        s3_url = s3_object_url(bucket_name, f"cropped-images/{filename}")
+        log_event(logger, logging.DEBUG, 's3.uploaded', s3_url=s3_url)
         return s3_url
         
     except Exception as e:
-        print(f"ERROR uploading to S3: {e}")
-        print(f"Error type: {type(e).__name__}")
+        logger.error(f"Error uploading to S3: {e}", extra={'error_type': type(e).__name__})
         return None
 
 
 
+def db_conninfo():
+    """Connection string for psycopg3"""
+    return f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}?sslmode={DB_CONFIG['sslmode']}"
+
 def get_db_connection():
-    """Create and return a database connection"""
+    """Create and return a dedicated database connection (listeners, schema setup)"""
     try:
-        # Build connection string for psycopg3
-        conn_string = f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}?sslmode={DB_CONFIG['sslmode']}"
-        conn = psycopg.connect(conn_string)
+        with timed('db.connect'):
+            conn = psycopg.connect(db_conninfo())
         return conn
     except psycopg.Error as e:
-        print(f"Database connection error: {e}")
+        logger.error(f"Database connection error: {e}")
         return None
 
+def get_read_connection():
+    """Connection for read-only routes: a healthy replica when configured, else the primary"""
+    return db_router.get_read_connection(prefer_primary=db_router.in_sticky_window(request.cookies))
+
 def download_image_from_local(file_path):
-    """Load image from local file path and return PIL Image"""
+    """Read an image file from a local path and return its bytes"""
     try:
         if os.path.exists(file_path):
-            return Image.open(file_path)
+            with open(file_path, 'rb') as f:
+                return f.read()
         else:
-            print(f"Local file not found: {file_path}")
+            logger.warning(f"Local file not found: {file_path}")
             return None
     except Exception as e:
-        print(f"Error loading local image {file_path}: {e}")
+        logger.error(f"Error loading local image {file_path}: {e}")
         return None
 
-def save_image_locally(image, filename):
-    """Save PIL Image to local directory and return file path"""
+# Local image store configuration
+LOCAL_STORE_CONFIG = {
+    'directory': os.getenv('LOCAL_IMAGE_DIR', './generated_images'),
+    'max_bytes': int(os.getenv('LOCAL_IMAGE_MAX_BYTES', 512 * 1024 * 1024)),
+    # Files not read or rewritten for this long are removed (0 disables)
+    'max_age_seconds': int(os.getenv('LOCAL_IMAGE_TTL_SECONDS', 7 * 24 * 3600)),
+}
+
+local_image_store = DiskCache(
+    LOCAL_STORE_CONFIG['directory'], LOCAL_STORE_CONFIG['max_bytes'], name='local_images',
+    max_age_seconds=LOCAL_STORE_CONFIG['max_age_seconds'] or None
+)
+
+def save_image_locally(image, prefix):
+    """
+    Save PIL Image to the bounded local store as <prefix>_<sha256>.png and return the file path
+    Identical images share one file; old files are evicted by byte budget and TTL
+    """
     try:
-        # Create local directory if it doesn't exist
-        local_dir = os.getenv('LOCAL_IMAGE_DIR', './generated_images')
-        os.makedirs(local_dir, exist_ok=True)
-        
-        file_path = os.path.join(local_dir, filename)
-        image.save(file_path, 'PNG')
-        return file_path
+        with timed('encode.local'):
+            image_bytes, _ = image_encoding.encode_image(image, 'png')
+        with timed('local_store.write'):
+            return local_image_store.put_content(image_bytes, extension='.png', prefix=f"{prefix}_")
     except Exception as e:
-        print(f"Error saving image locally: {e}")
+        logger.error(f"Error saving image locally: {e}")
         return None
 
 def download_image_from_s3(bucket, s3_key):
-    """Download image from S3 and return PIL Image"""
+    """Download image from S3 and return its bytes"""
     if not S3_ENABLED:
-        print("S3 not enabled, skipping S3 download")
+        logger.debug("S3 not enabled, skipping S3 download")
         return None
     try:
-        print(f"Downloading from S3: bucket={bucket}, key={s3_key}")
-        response = s3_client.get_object(Bucket=bucket, Key=s3_key)
-        image_data = response['Body'].read()
-        print(f"Successfully downloaded {len(image_data)} bytes from S3")
-        return Image.open(io.BytesIO(image_data))
+        with timed('s3.get_object'):
+            response = s3_client.get_object(Bucket=bucket, Key=s3_key)
+            image_data = response['Body'].read()
+        log_event(logger, logging.DEBUG, 's3.downloaded', bucket=bucket, key=s3_key, bytes=len(image_data))
+        return image_data
     except ClientError as e:
-        print(f"Error downloading image from S3 {bucket}/{s3_key}: {e}")
+        logger.error(f"Error downloading image from S3 {bucket}/{s3_key}: {e}")
         return None
     except Exception as e:
-        print(f"Error processing S3 image {bucket}/{s3_key}: {e}")
+        logger.error(f"Error processing S3 image {bucket}/{s3_key}: {e}")
         return None
 
 def upload_image_to_s3(image, s3_key):
     """Upload PIL Image to S3 and return URL"""
     if not S3_ENABLED:
-        print("S3 not enabled, skipping S3 upload")
+        logger.debug("S3 not enabled, skipping S3 upload")
         return None
     try:
-        buffer = io.BytesIO()
-        image.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=s3_key,
-            Body=buffer,
-            ContentType='image/png'
-        )
+        with timed('encode.generated'):
+            image_bytes, fmt = image_encoding.encode_image(image, image_encoding.ENCODE_CONFIG['generated_format'])
+        
+        with timed('s3.put_object'):
+            s3_client.put_object(
+                Bucket=S3_BUCKET,
+                Key=s3_key,
+                Body=image_bytes,
+                ContentType=image_encoding.mimetype(fmt)
+            )
         
         return f"https://{S3_BUCKET}.s3.amazonaws.com/{s3_key}"
     except Exception as e:
-        print(f"Error uploading to S3: {e}")
+        logger.error(f"Error uploading to S3: {e}")
         return None
 
 def download_image_from_url(url):
     """Download image from URL, local path, or S3 and return PIL Image"""
+    return decode_image(download_image_bytes(url), url)
+
+def decode_image(image_bytes, url):
+    """Open downloaded image bytes as a PIL Image; None when missing or undecodable"""
+    if image_bytes is None:
+        return None
+    try:
+        return Image.open(io.BytesIO(image_bytes))
+    except Exception as e:
+        logger.error(f"Error decoding image {url}: {e}")
+        return None
+
+def download_image_bytes(url):
+    """Download image from URL, local path, or S3 and return the raw bytes"""
+    with timed('download_image_from_url'):
+        return _download_image_bytes(url)
+
+def _download_image_bytes(url):
     try:
-        print(f"Processing URL: {url}")
+        log_event(logger, logging.DEBUG, 'image.download', url=url)
         
         # Check if it's a local file path
         if url.startswith('./') or url.startswith('/') or (len(url) > 1 and url[1] == ':'):
@@ -299,14 +398,156 @@ def download_image_from_url(url):
         
         # Regular URL download
         else:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            return Image.open(io.BytesIO(response.content))
+            with timed('http.get'):
+                response = requests.get(url, timeout=30)
+                response.raise_for_status()
+            return response.content
             
     except Exception as e:
-        print(f"Error downloading: {e}")
+        logger.error(f"Error downloading {url}: {e}")
         return None
 
+def generate_ad_with_gemini(product_url, template_url, text_input, start_time):
+    """Download the inputs and run the Gemini generation; returns (payload, status)"""
+    # Raw bytes are kept: prepared inputs are cached by source content
+    sources = {'product': download_image_bytes(product_url)}
+    product_image = decode_image(sources['product'], product_url)
+    if not product_image:
+        return {'error': 'Failed to download product image'}, 400
+    
+    sources['template'] = download_image_bytes(template_url)
+    template_image = decode_image(sources['template'], template_url)
+    if not template_image:
+        return {'error': 'Failed to download template image'}, 400
+    
+    try:
+        logger.debug("Calling Gemini with working pattern")
+        
+        # Use the exact working pattern
+        client = create_genai_client()
+        model = "gemini-2.5-flash-preview-image-generation"
+        
+        # Send compact, size-capped encodings instead of letting the SDK PNG-encode the originals
+        prepared_inputs = {}
+        image_inputs = [template_image, product_image]
+        if generation_inputs.GENERATION_INPUT_CONFIG['enabled']:
+            with timed('gemini.prepare_inputs'):
+                prepared_inputs = {
+                    role: generation_inputs.prepare(image, sources[role], model, role)
+                    for role, image in (('template', template_image), ('product', product_image))
+                }
+            image_inputs = [
+                types.Part.from_bytes(data=prepared_inputs[role].data, mime_type=prepared_inputs[role].mime_type)
+                for role in ('template', 'product')
+            ]
+        
+        with timed('gemini.generate_content'):
+            call_started = time.perf_counter()
+            response = client.models.generate_content(
+                model=model,
+                contents=[text_input] + image_inputs,
+                config=types.GenerateContentConfig(
+                    response_modalities=['TEXT', 'IMAGE']
+                )
+            )
+            generation_inputs.observe_call(model, bool(prepared_inputs), call_started)
+        
+        logger.debug("Received response from Gemini")
+        
+        # Process response using the exact working pattern
+        generated_image = None
+        response_text = ""
+        
+        for part in response.candidates[0].content.parts:
+            if part.text is not None:
+                response_text += part.text
+                log_event(logger, logging.DEBUG, 'gemini.text', text=part.text)
+            elif part.inline_data is not None:
+                generated_image = Image.open(io.BytesIO(part.inline_data.data))
+                log_event(logger, logging.DEBUG, 'gemini.image', size=list(generated_image.size))
+                break
+        
+        if generated_image:
+            # Save the generated image
+            local_path = save_image_locally(generated_image, 'gemini_generated')
+            filename = os.path.basename(local_path) if local_path else f"gemini_generated_{uuid.uuid4().hex}.png"
+            
+            # Convert to base64
+            with timed('encode.generated'):
+                image_bytes, image_format = image_encoding.encode_image(
+                    generated_image, image_encoding.ENCODE_CONFIG['generated_format'])
+            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+            
+            # Try S3 upload
+            s3_url = None
+            if S3_ENABLED:
+                try:
+                    s3_key = f"generated/{os.path.splitext(filename)[0]}.{image_encoding.extension(image_format)}"
+                    s3_url = upload_image_to_s3(generated_image, s3_key)
+                except Exception as e:
+                    logger.error(f"S3 upload failed: {e}")
+            
+            processing_time = time.time() - start_time
+            
+            return {
+                'status': 'success',
+                'method': 'gemini_2.0_flash_image_generation',
+                'generated_image_path': local_path,
+                'generated_image_base64': image_base64,
+                'generated_image_format': image_format,
+                's3_url': s3_url,
+                'processing_time': f"{processing_time:.2f}s",
+                'gemini_response_text': response_text,
+                'generated_image_size': list(generated_image.size),
+                'input_images': {
+                    'product_url': product_url,
+                    'template_url': template_url,
+                    'product_size': list(product_image.size),
+                    'template_size': list(template_image.size),
+                    'prepared': {role: prepared.summary() for role, prepared in prepared_inputs.items()}
+                }
+            }, 200
+        
+        else:
+            # No image generated, fall back to overlay
+            logger.info("No image generated by Gemini, creating overlay fallback")
+            fallback_image = create_simple_overlay(product_image, template_image)
+            
+            if fallback_image:
+                local_path = save_image_locally(fallback_image, 'fallback_overlay')
+                
+                with timed('encode.generated'):
+                    image_bytes, image_format = image_encoding.encode_image(
+                        fallback_image, image_encoding.ENCODE_CONFIG['generated_format'])
+                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+                
+                processing_time = time.time() - start_time
+                
+                return {
+                    'status': 'success',
+                    'method': 'fallback_overlay',
+                    'generated_image_path': local_path,
+                    'generated_image_base64': image_base64,
+                    'generated_image_format': image_format,
+                    'processing_time': f"{processing_time:.2f}s",
+                    'gemini_response_text': response_text,
+                    'note': 'Gemini did not generate image, used fallback overlay'
+                }, 200
+            else:
+                return {
+                    'error': 'No image generated and fallback failed',
+                    'gemini_response': response_text,
+                    'processing_time': f"{(time.time() - start_time):.2f}s"
+                }, 500
+            
+    except Exception as e:
+        logger.error(f"Gemini generation error: {e}")
+        return {
+            'error': 'Gemini image generation failed',
+            'details': str(e),
+            'processing_time': f"{(time.time() - start_time):.2f}s"
+        }, 500
+
 @app.route('/generate-ad-gemini', methods=['POST'])
 def generate_ad_gemini():
     """Generate ad using the exact working Gemini pattern"""
@@ -334,16 +575,6 @@ def generate_ad_gemini():
         if not product_url or not template_url:
             return jsonify({'error': 'Both product_image_url and template_image_url required'}), 400
         
-        print(f"Downloading product: {product_url}")
-        product_image = download_image_from_url(product_url)
-        if not product_image:
-            return jsonify({'error': 'Failed to download product image'}), 400
-        
-        print(f"Downloading template: {template_url}")
-        template_image = download_image_from_url(template_url)
-        if not template_image:
-            return jsonify({'error': 'Failed to download template image'}), 400
-        
         # Use the exact working prompt pattern
         if custom_prompt:
             text_input = custom_prompt
@@ -361,112 +592,15 @@ Input: Use the uploaded template as the base and the product image.
 Output: A single PNG image with the product embedded exactly into the placeholder slot.
 Use the product that I am uploading, to be embedded in the template."""
         
-        try:
-            print("Calling Gemini with working pattern...")
-            
-            # Use the exact working pattern
-            client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
-            
-            response = client.models.generate_content(
-                model="gemini-2.5-flash-preview-image-generation",
-                contents=[text_input, template_image, product_image],
-                config=types.GenerateContentConfig(
-                    response_modalities=['TEXT', 'IMAGE']
-                )
-            )
-            
-            print("Received response from Gemini")
-            
-            # Process response using the exact working pattern
-            generated_image = None
-            response_text = ""
-            
-            for part in response.candidates[0].content.parts:
-                if part.text is not None:
-                    response_text += part.text
-                    print(f"Gemini response text: {part.text}")
-                elif part.inline_data is not None:
-                    generated_image = Image.open(io.BytesIO(part.inline_data.data))
-                    print(f"Generated image received: {generated_image.size}")
-                    break
-            
-            if generated_image:
-                # Save the generated image
-                filename = f"gemini_generated_{int(time.time())}.png"
-                local_path = save_image_locally(generated_image, filename)
-                
-                # Convert to base64
-                buffer = io.BytesIO()
-                generated_image.save(buffer, format='PNG')
-                image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                
-                # Try S3 upload
-                s3_url = None
-                if S3_ENABLED:
-                    try:
-                        s3_key = f"generated/{filename}"
-                        s3_url = upload_image_to_s3(generated_image, s3_key)
-                        print(f"Saved to S3: {s3_url}")
-                    except Exception as e:
-                        print(f"S3 upload failed: {e}")
-                
-                processing_time = time.time() - start_time
-                
-                return jsonify({
-                    'status': 'success',
-                    'method': 'gemini_2.0_flash_image_generation',
-                    'generated_image_path': local_path,
-                    'generated_image_base64': image_base64,
-                    's3_url': s3_url,
-                    'processing_time': f"{processing_time:.2f}s",
-                    'gemini_response_text': response_text,
-                    'generated_image_size': list(generated_image.size),
-                    'input_images': {
-                        'product_url': product_url,
-                        'template_url': template_url,
-                        'product_size': list(product_image.size),
-                        'template_size': list(template_image.size)
-                    }
-                }), 200
-            
-            else:
-                # No image generated, fall back to overlay
-                print("No image generated by Gemini, creating overlay fallback")
-                fallback_image = create_simple_overlay(product_image, template_image)
-                
-                if fallback_image:
-                    filename = f"fallback_overlay_{int(time.time())}.png"
-                    local_path = save_image_locally(fallback_image, filename)
-                    
-                    buffer = io.BytesIO()
-                    fallback_image.save(buffer, format='PNG')
-                    image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                    
-                    processing_time = time.time() - start_time
-                    
-                    return jsonify({
-                        'status': 'success',
-                        'method': 'fallback_overlay',
-                        'generated_image_path': local_path,
-                        'generated_image_base64': image_base64,
-                        'processing_time': f"{processing_time:.2f}s",
-                        'gemini_response_text': response_text,
-                        'note': 'Gemini did not generate image, used fallback overlay'
-                    }), 200
-                else:
-                    return jsonify({
-                        'error': 'No image generated and fallback failed',
-                        'gemini_response': response_text,
-                        'processing_time': f"{(time.time() - start_time):.2f}s"
-                    }), 500
-                
-        except Exception as e:
-            print(f"Gemini generation error: {e}")
-            return jsonify({
-                'error': 'Gemini image generation failed',
-                'details': str(e),
-                'processing_time': f"{(time.time() - start_time):.2f}s"
-            }), 500
+        # Identical concurrent requests share one download and model call
+        key = single_flight.request_key('generate_ad_gemini', {
+            'product_image_url': product_url, 'template_image_url': template_url, 'prompt': text_input
+        })
+        (payload, status), shared = single_flight.do(
+            key, lambda: generate_ad_with_gemini(product_url, template_url, text_input, start_time))
+        response = jsonify(payload)
+        response.headers['X-Single-Flight'] = 'shared' if shared else 'leader'
+        return response, status
         
     except Exception as e:
         processing_time = time.time() - start_time
@@ -475,6 +609,78 @@ Use the product that I am uploading, to be embedded in the template."""
             'processing_time': f"{processing_time:.2f}s"
         }), 500
 
+def url_list(data, plural, singular):
+    """A list of URLs from either data[plural] (list) or data[singular] (string)"""
+    value = data.get(plural, data.get(singular))
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not value or not all(isinstance(url, str) and url for url in value):
+        return None
+    return value
+
+@app.route('/composite-batch', methods=['POST'])
+def composite_batch():
+    """
+    Preview grid: composite every product onto every template without calling Gemini
+    Expected JSON payload:
+    {
+        "product_image_urls": ["https://..."],   (or "product_image_url")
+        "template_image_urls": ["https://..."],  (or "template_image_url")
+        "format": "jpeg"                         (optional: jpeg, webp, avif, png)
+    }
+    Returns: One local image URL per product x template pair
+    """
+    start_time = time.time()
+    try:
+        data = request.get_json(silent=True) or {}
+        product_urls = url_list(data, 'product_image_urls', 'product_image_url')
+        template_urls = url_list(data, 'template_image_urls', 'template_image_url')
+        if not product_urls or not template_urls:
+            return jsonify({'error': 'product_image_urls and template_image_urls must be non-empty lists of URLs'}), 400
+        outputs = len(product_urls) * len(template_urls)
+        if outputs > compositor.COMPOSITE_CONFIG['max_outputs']:
+            return jsonify({'error': f"Grid of {outputs} exceeds the limit of {compositor.COMPOSITE_CONFIG['max_outputs']} outputs"}), 400
+        
+        # Each distinct URL is downloaded and normalized once, in parallel
+        unique_urls = list(dict.fromkeys(product_urls + template_urls))
+        with timed('composite.download'):
+            images = dict(zip(unique_urls, compositor.COMPOSITE_POOL.map(download_image_from_url, unique_urls)))
+        missing = [url for url, image in images.items() if image is None]
+        if missing:
+            return jsonify({'error': 'Failed to download images', 'urls': missing}), 400
+        with timed('composite.normalize'):
+            images = {url: image_encoding.normalize_source(image) for url, image in images.items()}
+        
+        results = compositor.composite_grid(
+            [images[url] for url in product_urls], [images[url] for url in template_urls], fmt=data.get('format'))
+        
+        composites = []
+        with timed('local_store.write'):
+            for result in results:
+                path = local_image_store.put_content(
+                    result['data'], extension=f".{image_encoding.extension(result['format'])}", prefix='composite_')
+                composites.append({
+                    'product_index': result['product_index'],
+                    'template_index': result['template_index'],
+                    'url': f"/generated-images/{os.path.basename(path)}" if path else None,
+                    'format': result['format'],
+                    'size': result['size'],
+                    'bytes': len(result['data']),
+                })
+        
+        return jsonify({
+            'status': 'success',
+            'method': 'batch_overlay',
+            'product_image_urls': product_urls,
+            'template_image_urls': template_urls,
+            'composites': composites,
+            'processing_time': f"{(time.time() - start_time):.2f}s"
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error compositing batch: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/test-working-pattern', methods=['POST'])
 def test_working_pattern():
     """Test the exact working pattern from your example"""
@@ -485,18 +691,17 @@ def test_working_pattern():
         data = request.get_json()
         test_prompt = data.get('prompt', 'Create a professional product advertisement')
         
-        print("Testing exact working pattern...")
-        
         # Use exact pattern
-        client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
+        client = create_genai_client()
         
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-preview-image-generation",
-            contents=[test_prompt],
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE']
+        with timed('gemini.generate_content'):
+            response = client.models.generate_content(
+                model="gemini-2.0-flash-preview-image-generation",
+                contents=[test_prompt],
+                config=types.GenerateContentConfig(
+                    response_modalities=['TEXT', 'IMAGE']
+                )
             )
-        )
         
         generated_image = None
         response_text = ""
@@ -508,13 +713,14 @@ def test_working_pattern():
                 generated_image = Image.open(io.BytesIO(part.inline_data.data))
                 
                 # Convert to base64
-                buffer = io.BytesIO()
-                generated_image.save(buffer, format='PNG')
-                image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                image_bytes, image_format = image_encoding.encode_image(
+                    generated_image, image_encoding.ENCODE_CONFIG['generated_format'])
+                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
                 
                 return jsonify({
                     'status': 'success',
                     'generated_image_base64': image_base64,
+                    'generated_image_format': image_format,
                     'generated_image_size': list(generated_image.size),
                     'response_text': response_text
                 }), 200
@@ -544,40 +750,50 @@ def health_check():
 def get_creative():
     """
     Get creative data based on adTag
-    Expected input: {"adTag": "my ad tag"}
+    Expected input: {"adTag": "my ad tag"} or {"adTags": ["tag1", "tag2"]} (creatives carrying all tags)
     Returns: {"creative": {"id": 1, "versions": [{"id": "", "url": ""}, ...]}}
     """
     try:
         # Parse request
         data = request.get_json()
-        if not data or 'adTag' not in data:
+        if not data or ('adTag' not in data and 'adTags' not in data):
             return jsonify({'error': 'Missing adTag in request'}), 400
         
-        ad_tag = data['adTag']
-        
-        # Connect to database
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
-        
-        cursor = conn.cursor(row_factory=dict_row)
-        print(ad_tag)
-        
-        # Query to get creatives based on adTag (matching against creative_title for demo)
-        # In a real scenario, you might have an ad_tags table or similar
-        query = f"""
-        SELECT creative_id, creative_title, creative_description, creative_s3_url, ad_item_id
-        FROM creative_new
-        WHERE tags::text LIKE %s
-        LIMIT 10
-        """
-        print(query)
-        
-        cursor.execute(query, (f'%{ad_tag}%',))
-        results = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        ad_tags = data['adTags'] if 'adTags' in data else [data['adTag']]
+        if not isinstance(ad_tags, list) or not ad_tags or not all(isinstance(tag, str) for tag in ad_tags):
+            return jsonify({'error': 'adTags must be a non-empty list of strings'}), 400
+        
+        # Snapshot mode: exact tag match from the in-memory index, no database round-trip
+        index = tag_index.get_index() if tag_index.TAG_INDEX_CONFIG['enabled'] else None
+        if index is not None:
+            with timed('tag_index.lookup'):
+                results = [
+                    {'creative_id': creative_id, 'creative_s3_url': url}
+                    for creative_id, url in index.lookup(ad_tags, limit=10)
+                ]
+        else:
+            # Connect to database
+            conn = get_read_connection()
+            if not conn:
+                return jsonify({'error': 'Database connection failed'}), 500
+            
+            cursor = conn.cursor(row_factory=dict_row)
+            
+            # Query to get creatives based on adTag (matching against creative_title for demo)
+            # In a real scenario, you might have an ad_tags table or similar
+            query = f"""
+            SELECT creative_id, creative_title, creative_description, creative_s3_url, ad_item_id
+            FROM creative_new
+            WHERE {' AND '.join(['tags::text LIKE %s'] * len(ad_tags))}
+            LIMIT 10
+            """
+            
+            with timed('db.query.creative_by_tag'):
+                cursor.execute(query, [f'%{tag}%' for tag in ad_tags])
+                results = cursor.fetchall()
+            
+            cursor.close()
+            conn.close()
         
         if not results:
             return jsonify({'error': 'No creatives found for the given adTag'}), 404
@@ -604,110 +820,307 @@ def get_creative():
         return jsonify(response), 200
         
     except Exception as e:
-        print(f"Error processing request: {e}")
+        logger.error(f"Error processing request: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
-def crop_image(image_url, selected_platforms):
+def validate_selected_platforms(selected_platforms):
+    """Return an error message if the platform list is malformed or names unknown platforms"""
+    if not isinstance(selected_platforms, list):
+        return 'selectedPlatforms must be a list'
+    unknown = platform_registry.get_registry().unknown(selected_platforms)
+    if unknown:
+        return f"Unknown platforms: {', '.join(str(name) for name in unknown)}"
+    return None
+
+
+def render_rendition(original_image, width, height, focal=focal_point.CENTER):
+    """Crop to the target aspect ratio around the focal point and resize to width x height"""
+    with timed('crop.crop'):
+        box = focal_point.focal_crop_box(original_image.width, original_image.height, width, height, focal)
+        cropped = original_image.crop(box)
+    # Resize to target dimensions
+    with timed('crop.resize'):
+        return cropped.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def encode_rendition(resized, platform, dimension, output_format):
+    """Encode one rendition in the platform's output format and upload it; returns the image_data entry"""
+    width, height = resized.size
+    # Convert to base64 first, in the platform's output format
+    with timed('crop.encode'):
+        image_bytes, fmt = image_encoding.encode_image(resized, output_format)
+        img_base64 = base64.b64encode(image_bytes).decode('utf-8')
+    mimetype = image_encoding.mimetype(fmt)
+    
+    # Create image object with base64 data
+    image_object = {
+        "base64": f"data:{mimetype};base64,{img_base64}",
+        "width": width,
+        "height": height,
+        "format": image_encoding.OUTPUT_FORMATS[fmt][0],
+        "bytes": len(image_bytes)
+    }
+    quality = image_encoding.save_options(fmt).get('quality')
+    if quality is not None:
+        image_object["quality"] = quality
+    
+    # Generate unique filename
+    filename = f"{uuid.uuid4()}_{platform}_{dimension}.{image_encoding.extension(fmt)}"
+    
+    # Upload base64 image object to S3
+    with timed('crop.upload'):
+        s3_url = upload_bytes_to_s3(image_bytes, filename, content_type=mimetype)
+    if s3_url:
+        # Add S3 URL to the image object
+        image_object["s3_url"] = s3_url
+    else:
+        log_event(logger, logging.WARNING, 'crop.s3_upload_failed', platform=platform, dimension=dimension)
+    return image_object
+
+
+def crop_image(image_url, selected_platforms, focal=None, source_info=None, reuse_duplicates=False):
     """
     Crop the image to the desired dimensions for each platform
+    focal: optional (x, y) override in 0-1 fractions; otherwise computed once per source
+    source_info: optional dict that receives per-source facts (focal_point, phash, duplicate_of) for storage
+    reuse_duplicates: copy renditions from a stored near-duplicate of the source instead of re-rendering
     Returns a JSON with all cropped images
     """
     try:
-        print(f"Starting crop process for S3 URL: {image_url}")
-        print(f"Selected platforms: {selected_platforms}")
-        
         # Download the image from S3 URL
-        response = requests.get(image_url, timeout=30)
-        response.raise_for_status()
-        print(f"Image downloaded successfully from S3, size: {len(response.content)} bytes")
+        with timed('crop.download'):
+            response = requests.get(image_url, timeout=30)
+            response.raise_for_status()
         
         # Open the image
-        original_image = Image.open(io.BytesIO(response.content))
-        print(f"Original image size: {original_image.size}")
-        
-        # Platform dimensions mapping
-        platform_dimensions = {
-            "Facebook": ["1080x1080", "1080x1920", "1200x628"],
-            "Instagram": ["1080x1080", "1080x1920"],
-            "Google": ["125x125"],
-            "facebook": ["1080x1080", "1080x1920", "1200x628"],
-            "instagram": ["1080x1080", "1080x1920"],
-            "google": ["125x125"],
-            "snapchat": ["1080x1920", "1080x1080"]
-        }
+        with timed('crop.decode'):
+            original_image = Image.open(io.BytesIO(response.content))
+            original_image.load()
+        log_event(logger, logging.DEBUG, 'crop.start', image_url=image_url, platforms=selected_platforms,
+                  bytes=len(response.content), size=list(original_image.size), mode=original_image.mode)
+        
+        # Normalize once (orientation, colour profile, working mode); every rendition reuses this buffer.
+        # Alpha is only kept when some platform's output format can carry it.
+        keep_alpha = any(image_encoding.platform_format(platform) != 'jpeg' for platform in selected_platforms)
+        with timed('crop.normalize'):
+            original_image = image_encoding.normalize_source(original_image, keep_alpha=keep_alpha)
+        
+        # Perceptual hash of the upright source, for near-duplicate detection
+        phash = None
+        if perceptual_hash.PHASH_CONFIG['enabled']:
+            with timed('crop.phash'):
+                phash = perceptual_hash.phash(original_image)
+            if source_info is not None:
+                source_info['phash'] = phash
+        
+        # A near-duplicate already stored lends its focal point and renditions
+        existing_renditions = {}
+        if reuse_duplicates and phash is not None and perceptual_hash.PHASH_CONFIG['reuse_renditions']:
+            with timed('crop.find_duplicate'):
+                duplicate = find_duplicate_creative(phash, focal)
+            if duplicate:
+                focal = duplicate['focal']
+                existing_renditions = duplicate['image_data']
+                if source_info is not None:
+                    source_info['duplicate_of'] = {'creative_id': duplicate['creative_id'], 'distance': duplicate['distance']}
+        
+        # Focal point: explicit override, else computed once per source and reused for every ratio
+        if focal is None:
+            with timed('crop.focal_point'):
+                focal = focal_point.get_focal_point(response.content, original_image)
+        if source_info is not None:
+            source_info['focal_point'] = {'x': focal[0], 'y': focal[1]}
+        
+        # Platform dimensions come from the in-memory registry (no DB round-trip)
+        registry = platform_registry.get_registry()
         
         cropped_images = {}
         
-        print(f"Processing platforms: {selected_platforms}")
         for platform in selected_platforms:
-            print(f"Processing platform: {platform}")
-            if platform in platform_dimensions:
+            platform_dimensions = registry.dimensions(platform)
+            if platform_dimensions:
                 platform_crops = {}
+                output_format = image_encoding.platform_format(platform)
                 
-                for dimension in platform_dimensions[platform]:
-                    print(f"    Processing dimension: {dimension}")
+                for dimension in platform_dimensions:
                     width, height = map(int, dimension.split('x'))
                     
-                    # Calculate aspect ratios
-                    original_ratio = original_image.width / original_image.height
-                    target_ratio = width / height
+                    # Same visual already rendered and uploaded in this format: keep its rendition
+                    reused = existing_renditions.get(platform, {}).get(dimension)
+                    if (isinstance(reused, dict) and reused.get('s3_url')
+                            and reused.get('format') == image_encoding.OUTPUT_FORMATS[output_format][0]):
+                        platform_crops[dimension] = reused
+                        if source_info is not None:
+                            source_info['reused_renditions'] = source_info.get('reused_renditions', 0) + 1
+                        continue
                     
-                    # Crop strategy: center crop to maintain aspect ratio
-                    if original_ratio > target_ratio:
-                        # Original is wider, crop width
-                        new_width = int(original_image.height * target_ratio)
-                        left = (original_image.width - new_width) // 2
-                        cropped = original_image.crop((left, 0, left + new_width, original_image.height))
-                    else:
-                        # Original is taller, crop height
-                        new_height = int(original_image.width / target_ratio)
-                        top = (original_image.height - new_height) // 2
-                        cropped = original_image.crop((0, top, original_image.width, top + new_height))
-                    # Resize to target dimensions
-                    resized = cropped.resize((width, height), Image.Resampling.LANCZOS)
+                    # Crop strategy: keep the focal point in frame at the target aspect ratio
+                    resized = render_rendition(original_image, width, height, focal)
                     
-                    # Convert to base64 first
-                    buffer = io.BytesIO()
-                    resized.save(buffer, format='JPEG', quality=85)
-                    image_bytes = buffer.getvalue()
-                    img_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                    
-                    # Create image object with base64 data
-                    image_object = {
-                        "base64": f"data:image/jpeg;base64,{img_base64}",
-                        "width": width,
-                        "height": height,
-                        "format": "JPEG",
-                        "quality": 85
-                    }
-                    
-                    # Generate unique filename
-                    filename = f"{uuid.uuid4()}_{platform}_{dimension}.jpg"
-                    
-                    # Upload base64 image object to S3
-                    s3_url = upload_image_to_s3(image_bytes, filename)
-                    if s3_url:
-                        # Add S3 URL to the image object
-                        image_object["s3_url"] = s3_url
-                        platform_crops[dimension] = image_object
-                        print(f"    Uploaded {dimension} to S3: {s3_url}")
-                    else:
-                        print(f"    Failed to upload {dimension} to S3, keeping base64 only")
-                        platform_crops[dimension] = image_object
+                    platform_crops[dimension] = encode_rendition(resized, platform, dimension, output_format)
                 
                 cropped_images[platform] = platform_crops
         
         return cropped_images
         
     except requests.exceptions.RequestException as e:
-        print(f"Error downloading image from S3: {e}")
+        logger.error(f"Error downloading image from S3: {e}")
         return {}
     except Exception as e:
-        print(f"Error cropping image: {e}")
+        logger.error(f"Error cropping image: {e}")
         return {}
 
 
+
+
+def find_duplicate_creative(phash, focal=None):
+    """
+    Closest stored creative within PHASH_REUSE_MAX_DISTANCE whose renditions can be reused:
+    {'creative_id', 'distance', 'focal', 'image_data'}, or None. An explicit focal point only
+    matches a creative cropped around the same point.
+    """
+    matches = perceptual_hash.find_similar(phash, perceptual_hash.PHASH_CONFIG['reuse_max_distance'], limit=5)
+    if not matches:
+        return None
+    conn = db_router.get_read_connection()
+    if not conn:
+        return None
+    try:
+        for distance, creative_id in matches:
+            row = creative_queries.get_creative(conn, creative_id)
+            if not row or not isinstance(row.get('image_data'), dict) or not row['image_data']:
+                continue
+            stored = row.get('focal_point')
+            stored = (stored['x'], stored['y']) if isinstance(stored, dict) and 'x' in stored else None
+            if focal is not None and (stored is None or max(abs(focal[0] - stored[0]), abs(focal[1] - stored[1])) > 1e-3):
+                continue
+            return {'creative_id': creative_id, 'distance': distance, 'focal': stored or focal,
+                    'image_data': row['image_data']}
+    except Exception as e:
+        logger.warning(f"Duplicate lookup failed: {e}")
+    finally:
+        conn.close()
+    return None
+
+
+def backfill_renditions(creative, missing):
+    """
+    Render step for rendition_backfill: download creative_s3_url once and render the missing
+    {platform: [dimension]} around the stored focal point (computed when none was stored).
+    Returns {platform: {dimension: image_object}} with only the renditions that reached S3.
+    """
+    with timed('backfill.download'):
+        response = requests.get(creative['creative_s3_url'], timeout=30)
+        response.raise_for_status()
+    with timed('backfill.decode'):
+        original_image = Image.open(io.BytesIO(response.content))
+        original_image.load()
+    keep_alpha = any(image_encoding.platform_format(platform) != 'jpeg' for platform in missing)
+    original_image = image_encoding.normalize_source(original_image, keep_alpha=keep_alpha)
+    
+    stored = creative.get('focal_point')
+    if isinstance(stored, dict) and 'x' in stored and 'y' in stored:
+        focal = (stored['x'], stored['y'])
+    else:
+        focal = focal_point.get_focal_point(response.content, original_image)
+    
+    renditions = {}
+    for platform, dimensions in missing.items():
+        output_format = image_encoding.platform_format(platform)
+        for dimension in dimensions:
+            width, height = map(int, dimension.split('x'))
+            image_object = encode_rendition(render_rendition(original_image, width, height, focal),
+                                            platform, dimension, output_format)
+            if image_object.get('s3_url'):
+                renditions.setdefault(platform, {})[dimension] = image_object
+    log_event(logger, logging.DEBUG, 'backfill.rendered', creative_id=creative['creative_id'],
+              renditions={platform: list(dimensions) for platform, dimensions in renditions.items()})
+    return renditions
+
+
+def parse_creative_payload(data):
+    """
+    Validate one add-new-creative payload
+    Returns (creative, None) with normalized fields, or (None, error_message)
+    """
+    if not data:
+        return None, 'No JSON data received'
+    if not isinstance(data, dict):
+        return None, 'Creative must be a JSON object'
+    
+    if 'title' not in data or 'description' not in data or 'add_item_id' not in data:
+        missing_fields = []
+        if 'title' not in data:
+            missing_fields.append('title')
+        if 'description' not in data:
+            missing_fields.append('description')
+        if 'add_item_id' not in data:
+            missing_fields.append('add_item_id')
+        return None, f'Missing required fields: {", ".join(missing_fields)}'
+    
+    # Handle both 'image' and 'imageUrl' fields
+    image = data.get('imageUrl') or data.get('image', '')
+    if isinstance(image, dict) and not image:
+        image = data.get('imageUrl', '')  # Use imageUrl if image is empty dict
+    
+    selected_platforms = data.get('selectedPlatforms', [])
+    platform_error = validate_selected_platforms(selected_platforms)
+    if platform_error:
+        return None, platform_error
+    
+    # Validate S3 image URL
+    if not image or not isinstance(image, str):
+        logger.warning(f"Invalid image field - {type(image).__name__}")
+        return None, 'Invalid S3 image URL - must be a non-empty string'
+    
+    # Basic S3 URL validation (should start with https:// and contain s3)
+    if not (image.startswith('https://') and ('s3' in image.lower() or 'amazonaws.com' in image.lower())):
+        logger.debug(f"Image URL may not be a valid S3 URL: {image}")
+        # Don't return error, just log warning and continue
+    
+    try:
+        focal = focal_point.parse_focal_point(data.get('focalPoint'))
+    except ValueError as e:
+        return None, str(e)
+    
+    return {
+        'title': data['title'],
+        'description': data['description'],
+        'campaign': data.get('campaign', ''),
+        'format_type': data.get('formatType', ''),
+        'tags': data.get('tags', []),
+        'dynamic_elements': data.get('dynamicElements', {}),
+        'image': image,
+        'selected_platforms': selected_platforms,
+        'add_item_id': data['add_item_id'],
+        'focal_point': focal
+    }, None
+
+
+def render_creative(creative):
+    """Run the rendition pipeline for a parsed creative; returns (crop, source_info)"""
+    source_info = {}
+    # With prerendering off only the focal point is computed; renditions come from /render on demand
+    platforms = creative['selected_platforms'] if RENDER_CONFIG['prerender_on_ingest'] else []
+    crop = crop_image(creative['image'], platforms,
+                      focal=creative['focal_point'], source_info=source_info, reuse_duplicates=True)
+    if crop is None:
+        crop = {}  # Set empty dict if cropping fails
+    return crop, source_info
+
+
+def creative_insert_params(creative, crop, source_info):
+    """Parameters for creative_queries.INSERT_CREATIVE_SQL; complex objects are stored as JSON strings"""
+    focal = source_info.get('focal_point')
+    return (
+        creative['title'], creative['description'], creative['campaign'], creative['format_type'],
+        json.dumps(creative['tags']), json.dumps(creative['dynamic_elements']), json.dumps(crop),
+        creative['image'], json.dumps(creative['selected_platforms']), creative['add_item_id'],
+        json.dumps(focal) if focal else None, perceptual_hash.to_signed(source_info.get('phash'))
+    )
+
+
 @app.route('/creative/add-new-creative', methods=['POST'])
 def add_new_creative():
     """
@@ -727,120 +1140,178 @@ def add_new_creative():
         "image": "https://s3.amazonaws.com/bucket/image.jpg",
         "imageUrl": "https://s3.amazonaws.com/bucket/image.jpg",  // Alternative field name
         "selectedPlatforms": ["platform1", "platform2"],
-        "add_item_id": "uuid"
+        "add_item_id": "uuid",
+        "focalPoint": {"x": 0.3, "y": 0.6}  // Optional, fractions of width/height; computed when omitted
     }
     Returns: {"message": "Creative added successfully", "creative_id": id, "s3_url": "s3_url"}
     """
     try:
         data = request.get_json()
-        print(f"Received request data: {data}")
-        
-        if not data:
-            return jsonify({'error': 'No JSON data received'}), 400
-        
-        if 'title' not in data or 'description' not in data or 'add_item_id' not in data:
-            missing_fields = []
-            if 'title' not in data:
-                missing_fields.append('title')
-            if 'description' not in data:
-                missing_fields.append('description')
-            if 'add_item_id' not in data:
-                missing_fields.append('add_item_id')
-            return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
-        
-        # Extract data from request
-        title = data['title']
-        description = data['description']
-        campaign = data.get('campaign', '')
-        format_type = data.get('formatType', '')
-        tags = data.get('tags', [])
-        dynamic_elements = data.get('dynamicElements', {})
-        
-        # Handle both 'image' and 'imageUrl' fields
-        image = data.get('imageUrl') or data.get('image', '')
-        if isinstance(image, dict) and not image:
-            image = data.get('imageUrl', '')  # Use imageUrl if image is empty dict
-        
-        selected_platforms = data.get('selectedPlatforms', [])
-        add_item_id = data['add_item_id']
-        
-        # Convert complex objects to JSON strings for storage
-        tags_json = json.dumps(tags)
-        dynamic_elements_json = json.dumps(dynamic_elements)
-        selected_platforms_json = json.dumps(selected_platforms)
-        
-        # Validate S3 image URL
-        if not image or not isinstance(image, str):
-            print(f"Error: Invalid image field - {type(image)}: {image}")
-            return jsonify({'error': 'Invalid S3 image URL - must be a non-empty string'}), 400
-        
-        # Basic S3 URL validation (should start with https:// and contain s3)
-        if not (image.startswith('https://') and ('s3' in image.lower() or 'amazonaws.com' in image.lower())):
-            print(f"Warning: Image URL may not be a valid S3 URL: {image}")
-            # Don't return error, just log warning and continue
+        
+        creative, error = parse_creative_payload(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Crop the image from S3
-        crop = crop_image(image, selected_platforms)
-        if crop is None:
-            crop = {}  # Set empty dict if cropping fails
-        image_json = json.dumps(crop)  # Store cropped images in image_data
-        # Connect to databaseƒ
-        conn = get_db_connection()
+        with timed('ingest.crop_image'):
+            crop, source_info = render_creative(creative)
+        # Connect to database
+        conn = db_router.get_write_connection()
         if not conn:
             return jsonify({'error': 'Database connection failed'}), 500
         
         cursor = conn.cursor()
         
         # Insert new creative into database
-        query = """
-        INSERT INTO creative_new (
-            creative_title, creative_description, campaign, format_type, 
-            tags, dynamic_elements, image_data, creative_s3_url, 
-            selected_platforms, ad_item_id
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING creative_id
-        """
-        
-        cursor.execute(query, (
-            title, description, campaign, format_type, 
-            tags_json, dynamic_elements_json, image_json, image,
-            selected_platforms_json, add_item_id
-        ))
-        new_creative_id = cursor.fetchone()[0]
-        
-        conn.commit()
+        with timed('db.query.insert_creative'):
+            new_creative_id = creative_queries.insert_creative(cursor, creative_insert_params(creative, crop, source_info))
+            
+            conn.commit()
         cursor.close()
         conn.close()
         
-        # Print all cropped images for debugging
-        print("=" * 50)
-        print("CROPPED IMAGES WITH BASE64 AND S3 URL:")
-        print("=" * 50)
-        if crop:
-            for platform, dimensions in crop.items():
-                print(f"\n{platform.upper()}:")
-                for dimension, image_obj in dimensions.items():
-                    if isinstance(image_obj, dict):
-                        print(f"  {dimension}:")
-                        print(f"    Width: {image_obj.get('width')}px")
-                        print(f"    Height: {image_obj.get('height')}px")
-                        print(f"    Format: {image_obj.get('format')}")
-                        print(f"    Base64: {image_obj.get('base64')[:50]}... (truncated)")
-                        if image_obj.get('s3_url'):
-                            print(f"    S3 URL: {image_obj.get('s3_url')}")
-                        else:
-                            print(f"    S3 URL: Failed to upload")
-                    else:
-                        print(f"  {dimension}: {image_obj}")
-        else:
-            print("No cropped images generated")
-        print("=" * 50)
+        # Summarize the renditions (no base64 payloads in the log)
+        if logger.isEnabledFor(logging.DEBUG):
+            renditions = {
+                platform: {dimension: bool(image_obj.get('s3_url'))
+                           for dimension, image_obj in dimensions.items() if isinstance(image_obj, dict)}
+                for platform, dimensions in crop.items()
+            }
+            log_event(logger, logging.DEBUG, 'creative.added', creative_id=new_creative_id, renditions=renditions)
+        
+        perceptual_hash.add(new_creative_id, source_info.get('phash'))
         
-        return jsonify({'message': 'Creative added successfully', 'creative_id': new_creative_id}), 201
+        response = {'message': 'Creative added successfully', 'creative_id': new_creative_id}
+        if source_info.get('duplicate_of'):
+            response['duplicate_of'] = source_info['duplicate_of']
+        return db_router.mark_write(jsonify(response)), 201
         
     except Exception as e:
-        print(f"Error adding creative: {e}")
+        logger.error(f"Error adding creative: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Bulk ingest configuration
+BULK_CONFIG = {
+    'max_items': int(os.getenv('BULK_MAX_ITEMS', 5000)),
+    # Creatives rendered and inserted per transaction
+    'chunk_size': int(os.getenv('BULK_CHUNK_SIZE', 100)),
+    'workers': int(os.getenv('RENDITION_WORKERS', os.cpu_count() or 4))
+}
+
+# Shared pool for rendition work (crop/encode/upload) across requests
+RENDITION_POOL = ThreadPoolExecutor(max_workers=BULK_CONFIG['workers'], thread_name_prefix='rendition')
+
+
+def read_bulk_items():
+    """Read the bulk request body: a JSON array, {"creatives": [...]}, or NDJSON"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonlines'):
+        items = []
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                items.append(json.loads(line))
+                # One past the limit is enough for the 413; don't buffer the rest of an oversized import
+                if len(items) > BULK_CONFIG['max_items']:
+                    break
+        return items
+    data = request.get_json(silent=True)
+    if data is None:
+        raise ValueError('expected a JSON array, {"creatives": [...]} or NDJSON')
+    if isinstance(data, dict):
+        data = data.get('creatives')
+    return data
+
+
+@app.route('/creatives/bulk', methods=['POST'])
+def add_creatives_bulk():
+    """
+    Add many creatives in one call
+    Expected input: a JSON array of add-new-creative payloads, {"creatives": [...]},
+    or NDJSON (Content-Type: application/x-ndjson) with one payload per line
+    All items are validated first; valid items are rendered on the shared worker pool
+    and inserted in chunked transactions.
+    Returns: {"results": [{"index": 0, "creative_id": 1}, {"index": 1, "error": "..."}], "inserted": n, "failed": m}
+    """
+    try:
+        try:
+            items = read_bulk_items()
+        except ValueError as e:
+            return jsonify({'error': f'Invalid request body: {e}'}), 400
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Expected a non-empty list of creatives'}), 400
+        if len(items) > BULK_CONFIG['max_items']:
+            return jsonify({'error': f"Too many creatives (max {BULK_CONFIG['max_items']})"}), 413
+        
+        # Validate everything up front
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            creative, error = parse_creative_payload(item)
+            if error:
+                results[index] = {'index': index, 'error': error}
+            else:
+                valid.append((index, creative))
+        
+        if valid:
+            conn = db_router.get_write_connection()
+            if not conn:
+                return jsonify({'error': 'Database connection failed'}), 500
+            
+            try:
+                chunk_size = max(1, BULK_CONFIG['chunk_size'])
+                for start in range(0, len(valid), chunk_size):
+                    chunk = valid[start:start + chunk_size]
+                    
+                    # Render the chunk in parallel; a failed crop stores {} like the single endpoint
+                    with timed('bulk.crop_chunk'):
+                        futures = [RENDITION_POOL.submit(render_creative, creative) for _, creative in chunk]
+                        rendered = [future.result() for future in futures]
+                    
+                    params = [
+                        creative_insert_params(creative, crop, source_info)
+                        for (_, creative), (crop, source_info) in zip(chunk, rendered)
+                    ]
+                    source_infos = [source_info for _, source_info in rendered]
+                    del rendered
+                    
+                    try:
+                        with timed('db.query.insert_creatives_bulk'):
+                            with conn.transaction():
+                                with conn.cursor() as cursor:
+                                    cursor.executemany(creative_queries.INSERT_CREATIVE_SQL, params, returning=True)
+                                    creative_ids = []
+                                    while True:
+                                        creative_ids.append(cursor.fetchone()[0])
+                                        if not cursor.nextset():
+                                            break
+                        for (index, _), creative_id, source_info in zip(chunk, creative_ids, source_infos):
+                            perceptual_hash.add(creative_id, source_info.get('phash'))
+                            results[index] = {'index': index, 'creative_id': creative_id}
+                            if source_info.get('duplicate_of'):
+                                results[index]['duplicate_of'] = source_info['duplicate_of']
+                    except psycopg.Error as e:
+                        logger.error(f"Bulk insert chunk failed: {e}")
+                        for index, _ in chunk:
+                            results[index] = {'index': index, 'error': 'Database insert failed'}
+            finally:
+                conn.close()
+        
+        inserted = sum(1 for result in results if 'creative_id' in result)
+        failed = len(results) - inserted
+        log_event(logger, logging.INFO, 'creatives.bulk', items=len(items), inserted=inserted, failed=failed)
+        
+        response = jsonify({
+            'results': results,
+            'inserted': inserted,
+            'failed': failed
+        })
+        if inserted:
+            db_router.mark_write(response)
+        return response, 201 if failed == 0 else 207
+        
+    except Exception as e:
+        logger.error(f"Error in bulk creative ingest: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/creative/<int:creative_id>', methods=['GET'])
@@ -851,37 +1322,22 @@ def get_creative_by_id(creative_id):
     """
     try:
         # Connect to database
-        conn = get_db_connection()
+        conn = get_read_connection()
         if not conn:
             return jsonify({'error': 'Database connection failed'}), 500
         
-        cursor = conn.cursor(row_factory=dict_row)
-        
-        # Query to get creative by ID
-        query = """
-        SELECT 
-            creative_id,
-            ad_item_id,
-            creative_title,
-            creative_description,
-            creative_s3_url,
-            campaign,
-            format_type,
-            tags,
-            dynamic_elements,
-            image_data,
-            selected_platforms,
-            created_at
-        FROM creative_new 
-        WHERE creative_id = %s
-        """
-        
-        cursor.execute(query, (creative_id,))
-        result = cursor.fetchone()
+        with timed('db.query.creative_by_id'):
+            result = creative_queries.get_creative(conn, creative_id)
         
-        cursor.close()
         conn.close()
         
+        # A creative written moments ago may not have reached the replica yet
+        if not result and db_router.is_replica(conn):
+            conn = db_router.get_read_connection(prefer_primary=True)
+            if conn:
+                result = creative_queries.get_creative(conn, creative_id)
+                conn.close()
+        
         if not result:
             return jsonify({'error': 'Creative not found'}), 404
         
@@ -901,7 +1357,7 @@ def get_creative_by_id(creative_id):
         return jsonify(creative_data), 200
         
     except Exception as e:
-        print(f"Error getting creative: {e}")
+        logger.error(f"Error getting creative: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/creatives', methods=['GET'])
@@ -913,6 +1369,9 @@ def get_all_creatives():
     - offset: number of creatives to skip (default: 0)
     - platform: filter by platform (e.g., 'facebook', 'instagram')
     - search_query: search in title, description, and campaign (case-insensitive)
+    - total: how pagination.total is computed: window (default), count, or none (total is null)
+    - created_after, created_before: ISO date/datetime bounds on created_at; on a partitioned
+      table only the overlapping partitions are read, which keeps recent-creative queries fast
     Returns: List of all creatives
     """
     try:
@@ -921,97 +1380,41 @@ def get_all_creatives():
         offset = request.args.get('offset', 0, type=int)
         platform_filter = request.args.get('platform', None)
         search_query = request.args.get('search_query', None)
+        total_mode = request.args.get('total', creative_queries.QUERY_CONFIG['default_total'])
+        created_after, created_before, range_error = parse_created_range()
+        if range_error:
+            return jsonify({'error': range_error}), 400
         
         # Validate parameters
         if limit > 100:
             limit = 100  # Max limit to prevent performance issues
         if limit < 1:
             limit = 1
+        if offset < 0:
+            offset = 0
+        if total_mode not in creative_queries.TOTAL_MODES:
+            return jsonify({'error': f"total must be one of {', '.join(creative_queries.TOTAL_MODES)}"}), 400
         
         # Connect to database
-        conn = get_db_connection()
+        conn = get_read_connection()
         if not conn:
             return jsonify({'error': 'Database connection failed'}), 500
         
-        cursor = conn.cursor(row_factory=dict_row)
-        
-        # Build query based on filters
-        base_query = """
-        SELECT 
-            creative_id,
-            ad_item_id,
-            creative_title,
-            creative_description,
-            creative_s3_url,
-            campaign,
-            format_type,
-            tags,
-            dynamic_elements,
-            image_data,
-            selected_platforms,
-            created_at
-        FROM creative_new 
-        """
-        
-        where_conditions = []
-        query_params = []
-        
-        # Add platform filter
-        if platform_filter:
-            where_conditions.append("selected_platforms::text ILIKE %s")
-            query_params.append(f'%{platform_filter}%')
+        # Page and total in one round-trip; without a total, one extra row tells whether more exist
+        with timed('db.query.list_creatives'):
+            results, total_count = creative_queries.list_creatives(
+                conn, limit + 1 if total_mode == 'none' else limit, offset,
+                platform=platform_filter, search=search_query, total=total_mode,
+                created_after=created_after, created_before=created_before
+            )
         
-        # Add search query filter
-        if search_query:
-            where_conditions.append("""
-                (creative_title ILIKE %s OR 
-                 creative_description ILIKE %s OR 
-                 campaign ILIKE %s)
-            """)
-            search_pattern = f'%{search_query}%'
-            query_params.extend([search_pattern, search_pattern, search_pattern])
+        conn.close()
         
-        # Build final query
-        if where_conditions:
-            query = base_query + " WHERE " + " AND ".join(where_conditions)
+        if total_count is None:
+            has_more = len(results) > limit
+            results = results[:limit]
         else:
-            query = base_query
-        
-        query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-        query_params.extend([limit, offset])
-        
-        cursor.execute(query, query_params)
-        
-        results = cursor.fetchall()
-        
-        # Get total count for pagination
-        count_query = "SELECT COUNT(*) as total FROM creative_new"
-        count_params = []
-        
-        if platform_filter or search_query:
-            count_conditions = []
-            
-            if platform_filter:
-                count_conditions.append("selected_platforms::text ILIKE %s")
-                count_params.append(f'%{platform_filter}%')
-            
-            if search_query:
-                count_conditions.append("""
-                    (creative_title ILIKE %s OR 
-                     creative_description ILIKE %s OR 
-                     campaign ILIKE %s)
-                """)
-                search_pattern = f'%{search_query}%'
-                count_params.extend([search_pattern, search_pattern, search_pattern])
-            
-            count_query += " WHERE " + " AND ".join(count_conditions)
-        
-        cursor.execute(count_query, count_params)
-        
-        total_count = cursor.fetchone()['total']
-        
-        cursor.close()
-        conn.close()
+            has_more = (offset + limit) < total_count
         
         # Process results
         creatives = []
@@ -1032,12 +1435,11 @@ def get_all_creatives():
         
         # Prepare response
         response = {
-            'creatives': creatives,
             'pagination': {
                 'total': total_count,
                 'limit': limit,
                 'offset': offset,
-                'has_more': (offset + limit) < total_count
+                'has_more': has_more
             }
         }
         
@@ -1047,26 +1449,207 @@ def get_all_creatives():
             filters['platform'] = platform_filter
         if search_query:
             filters['search_query'] = search_query
+        if created_after:
+            filters['created_after'] = created_after.isoformat()
+        if created_before:
+            filters['created_before'] = created_before.isoformat()
         
         if filters:
             response['filters'] = filters
         
-        return jsonify(response), 200
+        # Stream the page one creative at a time; pagination goes first, the large crops follow
+        body = response_pipeline.json_stream(response, 'creatives', creatives, app.json.dumps)
+        return Response(body, mimetype='application/json'), 200
         
     except Exception as e:
-        print(f"Error getting all creatives: {e}")
+        logger.error(f"Error getting all creatives: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def parse_created_range():
+    """created_after / created_before query parameters -> (after, before, error message)"""
+    bounds = []
+    for name in ('created_after', 'created_before'):
+        value = request.args.get(name)
+        try:
+            bounds.append(datetime.fromisoformat(value) if value else None)
+        except ValueError:
+            return None, None, f'{name} must be an ISO date or datetime'
+    after, before = bounds
+    if after and before and (after.tzinfo is None) == (before.tzinfo is None) and after >= before:
+        return None, None, 'created_after must be earlier than created_before'
+    return after, before, None
+
+def export_ndjson(conn, **filters):
+    """One JSON object per line, written a cursor batch at a time"""
+    for rows in creative_queries.iter_export_rows(conn, **filters):
+        lines = []
+        for row in rows:
+            for column in creative_queries.JSON_COLUMNS:
+                if isinstance(row.get(column), str):
+                    try:
+                        row[column] = json.loads(row[column])
+                    except ValueError:
+                        pass
+            lines.append(json.dumps(row, default=str))
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+@app.route('/creatives/export', methods=['GET'])
+def export_creatives():
+    """
+    Stream the whole creative catalog
+    Optional query parameters:
+    - format: ndjson (default) or csv
+    - platform, search_query, created_after, created_before: same filters as /creatives
+    - include_image_data: include the rendition blobs (default: false)
+    - gzip: true forces gzip, false sends it uncompressed (default: negotiated from Accept-Encoding)
+    Returns: NDJSON or CSV in creative_id order, streamed with constant memory
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in creative_queries.EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(creative_queries.EXPORT_FORMATS)}"}), 400
+    created_after, created_before, range_error = parse_created_range()
+    if range_error:
+        return jsonify({'error': range_error}), 400
+    filters = {
+        'platform': request.args.get('platform', None),
+        'search': request.args.get('search_query', None),
+        'include_image_data': request.args.get('include_image_data', 'false').lower() == 'true',
+        'created_after': created_after,
+        'created_before': created_before,
+    }
+    gzip_param = request.args.get('gzip', '').lower()
+    use_gzip = gzip_param == 'true'
+    
+    conn = get_read_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    # The stream outlives the request context; the generator or the response's close returns the connection
+    conn = db_router.detach(conn)
+    
+    def generate():
+        start = time.perf_counter()
+        if export_format == 'csv':
+            chunks = creative_queries.iter_export_csv(conn, **filters)
+        else:
+            chunks = export_ndjson(conn, **filters)
+        try:
+            yield from response_pipeline.compress_stream(chunks, 'gzip') if use_gzip else chunks
+            log_event(logger, logging.INFO, 'creatives.exported', format=export_format, gzip=use_gzip,
+                      seconds=round(time.perf_counter() - start, 3))
+        except GeneratorExit:
+            logger.info("Creative export cancelled by the client")
+            raise
+        except Exception as e:
+            # Headers are already sent; all that is left is to cut the stream short
+            logger.error(f"Error exporting creatives: {e}")
+        finally:
+            # Unwind the cursor and its transaction before the connection goes back to the pool
+            try:
+                chunks.close()
+            except Exception:
+                pass
+            conn.close()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype)
+    # A body that is never iterated (HEAD, a client gone before the first chunk) never runs the
+    # generator's finally; closing the response returns the connection either way
+    response.call_on_close(conn.close)
+    response.headers['Content-Disposition'] = f'attachment; filename="creatives.{export_format}"'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    elif gzip_param == 'false':
+        response_pipeline.exempt(response)
+    return response
 
 
 
+
+@app.route('/creatives/similar', methods=['GET'])
+def get_similar_creatives():
+    """
+    Find near-duplicate creatives by perceptual hash
+    Query parameters (one of):
+    - creative_id: compare against a stored creative
+    - image_url: compare against any image
+    Optional:
+    - max_distance: differing bits out of 64 (default: PHASH_MAX_DISTANCE)
+    - limit: number of matches to return (default: 10, max: 100)
+    Returns: Matching creatives, closest first, with their Hamming distance
+    """
+    try:
+        creative_id = request.args.get('creative_id', None, type=int)
+        image_url = request.args.get('image_url', None)
+        max_distance = request.args.get('max_distance', perceptual_hash.PHASH_CONFIG['max_distance'], type=int)
+        limit = request.args.get('limit', 10, type=int)
+        max_distance = min(max(max_distance, 0), 32)
+        limit = min(max(limit, 1), 100)
+        if creative_id is None and not image_url:
+            return jsonify({'error': 'creative_id or image_url is required'}), 400
+        
+        phash = None
+        if creative_id is not None:
+            conn = get_read_connection()
+            if not conn:
+                return jsonify({'error': 'Database connection failed'}), 500
+            with conn.cursor() as cursor:
+                cursor.execute(creative_queries.CREATIVE_PHASH_SQL, (creative_id,), prepare=creative_queries.prepare_flag())
+                row = cursor.fetchone()
+            conn.close()
+            if not row:
+                return jsonify({'error': 'Creative not found'}), 404
+            phash = perceptual_hash.to_unsigned(row[0])
+            if phash is None:
+                # Ingested before hashing existed: hash its source now
+                image_url = row[1]
+        
+        if phash is None:
+            image = download_image_from_url(image_url) if image_url else None
+            if image is None:
+                return jsonify({'error': 'Failed to download image'}), 400
+            with timed('phash.compute'):
+                phash = perceptual_hash.phash(image_encoding.normalize_source(image))
+        
+        with timed('phash.search'):
+            matches = [
+                (distance, match_id)
+                for distance, match_id in perceptual_hash.find_similar(phash, max_distance, limit + 1)
+                if match_id != creative_id
+            ][:limit]
+        
+        similar = []
+        if matches:
+            conn = get_read_connection()
+            if not conn:
+                return jsonify({'error': 'Database connection failed'}), 500
+            with conn.cursor(row_factory=dict_row) as cursor:
+                cursor.execute(creative_queries.SIMILAR_CREATIVES_SQL, ([match_id for _, match_id in matches],),
+                               prepare=creative_queries.prepare_flag())
+                rows = {row['creative_id']: row for row in cursor.fetchall()}
+            conn.close()
+            # Creatives deleted since the index was built simply drop out
+            similar = [dict(rows[match_id], distance=distance) for distance, match_id in matches if match_id in rows]
+        
+        return jsonify({
+            'phash': f"{phash:016x}",
+            'max_distance': max_distance,
+            'similar': similar
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error finding similar creatives: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 @app.route('/crop-image', methods=['POST'])
 def crop_image_endpoint():
     """
     Crop image to different platform dimensions
     Expected input: {
         "image_url": "https://s3.amazonaws.com/bucket/image.jpg",
-        "selected_platforms": ["Facebook", "Instagram"]
+        "selected_platforms": ["Facebook", "Instagram"],
+        "focal_point": {"x": 0.3, "y": 0.6}  // Optional; computed from the image when omitted
     }
     Returns: {"cropped_images": {"Facebook": {"1080x1080": {"base64": "...", "s3_url": "...", "width": 1080, "height": 1080}, ...}, ...}}
     """
@@ -1078,16 +1661,187 @@ def crop_image_endpoint():
         image_url = data['image_url']
         selected_platforms = data['selected_platforms']
         
-        # Crop the image
-        cropped_images = crop_image(image_url, selected_platforms)
+        platform_error = validate_selected_platforms(selected_platforms)
+        if platform_error:
+            return jsonify({'error': platform_error}), 400
+        
+        try:
+            focal = focal_point.parse_focal_point(data.get('focal_point'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        def run_crop():
+            source_info = {}
+            cropped_images = crop_image(image_url, selected_platforms, focal=focal, source_info=source_info)
+            return {'cropped_images': cropped_images, 'focal_point': source_info.get('focal_point')}
+        
+        # Identical concurrent requests (double submits, shared previews) share one crop
+        key = single_flight.request_key('crop_image', {
+            'image_url': image_url, 'platforms': sorted(set(selected_platforms)), 'focal_point': focal
+        })
+        payload, shared = single_flight.do(key, run_crop)
+        response = jsonify(payload)
+        response.headers['X-Single-Flight'] = 'shared' if shared else 'leader'
+        return response, 200
+        
+    except Exception as e:
+        logger.error(f"Error in crop endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+# On-the-fly rendition configuration
+RENDER_CONFIG = {
+    'cache_dir': os.getenv('RENDER_CACHE_DIR', './render_cache'),
+    'cache_bytes': int(os.getenv('RENDER_CACHE_BYTES', 1024 * 1024 * 1024)),
+    'max_dimension': int(os.getenv('RENDER_MAX_DIMENSION', 4096)),
+    # Only registered platform dimensions unless this is enabled
+    'allow_any_size': os.getenv('RENDER_ALLOW_ANY_SIZE', 'false').lower() == 'true',
+    'max_age': int(os.getenv('RENDER_MAX_AGE', 31536000)),
+    # Pre-render every platform rendition at ingest (off: ingest only stores the source and focal point)
+    'prerender_on_ingest': os.getenv('PRERENDER_ON_INGEST', 'true').lower() == 'true',
+    # Bump when rendering output changes so ETags and cache keys change with it
+    'version': 3
+}
+
+# URL extension -> output format
+RENDER_FORMATS = {'jpg': 'jpeg', 'jpeg': 'jpeg', 'png': 'png', 'webp': 'webp', 'avif': 'avif'}
+
+render_cache = DiskCache(RENDER_CONFIG['cache_dir'], RENDER_CONFIG['cache_bytes'], name='render')
+
+
+def store_focal_point(creative_id, focal):
+    """Persist a focal point computed on demand; failures only cost a recompute later"""
+    conn = db_router.get_write_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cursor:
+            with timed('db.query.store_focal_point'):
+                creative_queries.store_focal_point(cursor, creative_id, focal)
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"Failed to store focal point for creative {creative_id}: {e}")
+    finally:
+        conn.close()
+
+
+@app.route('/render/<int:creative_id>/<int:width>x<int:height>.<fmt>', methods=['GET'])
+def render_creative_rendition(creative_id, width, height, fmt):
+    """
+    Render a creative at WxH in the given format (jpg, png, webp, avif), on demand
+    Results are kept in a disk LRU cache and served with a strong ETag and
+    Cache-Control: immutable so a CDN can front this endpoint; supports If-None-Match (304)
+    """
+    try:
+        fmt = fmt.lower()
+        if fmt not in RENDER_FORMATS:
+            return jsonify({'error': f"Unsupported format: {fmt}"}), 400
+        if not (0 < width <= RENDER_CONFIG['max_dimension'] and 0 < height <= RENDER_CONFIG['max_dimension']):
+            return jsonify({'error': f"Dimensions must be between 1 and {RENDER_CONFIG['max_dimension']}"}), 400
+        dimension = f"{width}x{height}"
+        if not RENDER_CONFIG['allow_any_size'] and dimension not in platform_registry.get_registry().all_dimensions():
+            return jsonify({'error': f"Dimension {dimension} is not a registered platform dimension"}), 400
+        image_format = image_encoding.normalize_format(RENDER_FORMATS[fmt])
+        
+        conn = get_read_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+        try:
+            with timed('db.query.render_source'):
+                creative = creative_queries.get_creative(conn, creative_id)
+        finally:
+            conn.close()
+        
+        if not creative or not creative['creative_s3_url']:
+            return jsonify({'error': 'Creative not found'}), 404
+        
+        focal = creative['focal_point']
+        if isinstance(focal, str):
+            focal = json.loads(focal)
+        focal = (focal['x'], focal['y']) if focal else None
         
-        return jsonify({'cropped_images': cropped_images}), 200
+        def load_source():
+            """(source bytes, normalized image), or None when the download fails"""
+            try:
+                with timed('render.download'):
+                    response = requests.get(creative['creative_s3_url'], timeout=30)
+                    response.raise_for_status()
+            except requests.RequestException as e:
+                logger.warning(f"Failed to download source for creative {creative_id}: {e}")
+                return None
+            with timed('crop.decode'):
+                image = Image.open(io.BytesIO(response.content))
+                image.load()
+            with timed('crop.normalize'):
+                image = image_encoding.normalize_source(image, keep_alpha=image_format != 'jpeg')
+            return response.content, image
+        
+        loaded = None
+        if focal is None:
+            # Settle the focal point before keying: computed once per source and stored, so this
+            # response and every later one share the same cache entry and ETag
+            loaded = load_source()
+            if loaded is None:
+                return jsonify({'error': 'Failed to download source image'}), 502
+            with timed('crop.focal_point'):
+                focal = focal_point.get_focal_point(*loaded)
+            store_focal_point(creative_id, focal)
+        
+        # The ETag identifies the output before any rendering, so revalidation is cheap
+        cache_key = f"{RENDER_CONFIG['version']}|{creative['creative_s3_url']}|{focal}|{dimension}|{image_format}"
+        etag = hashlib.sha1(cache_key.encode('utf-8')).hexdigest()
+        headers = {
+            'Cache-Control': f"public, max-age={RENDER_CONFIG['max_age']}, immutable",
+            'ETag': f'"{etag}"'
+        }
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        
+        extension = '.' + image_encoding.extension(image_format)
+        data = render_cache.get(cache_key, extension)
+        if data is None:
+            loaded = loaded or load_source()
+            if loaded is None:
+                return jsonify({'error': 'Failed to download source image'}), 502
+            rendition = render_rendition(loaded[1], width, height, focal)
+            with timed('render.encode'):
+                data, _ = image_encoding.encode_image(rendition, image_format)
+            render_cache.put(cache_key, data, extension)
+            headers['X-Render-Cache'] = 'miss'
+        else:
+            headers['X-Render-Cache'] = 'hit'
+        
+        return Response(data, mimetype=image_encoding.mimetype(image_format), headers=headers)
         
     except Exception as e:
-        print(f"Error in crop endpoint: {e}")
+        logger.error(f"Error rendering creative {creative_id}: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@app.route('/generated-images/<name>', methods=['GET'])
+def get_generated_image(name):
+    """Serve a generated image from the local store by file name"""
+    path = local_image_store.lookup(name)
+    if not path:
+        return jsonify({'error': 'Image not found'}), 404
+    fmt = RENDER_FORMATS.get(os.path.splitext(path)[1].lstrip('.').lower(), 'png')
+    return send_file(path, mimetype=image_encoding.mimetype(fmt), max_age=RENDER_CONFIG['max_age'])
+
+
+@app.route('/platforms', methods=['GET'])
+def get_platforms():
+    """
+    List the registered platforms and their dimensions
+    Returns: {"platforms": {"Facebook": ["1080x1080", ...], ...}, "version": 3, "source": "database"}
+    """
+    registry = platform_registry.get_registry()
+    return jsonify({
+        'platforms': registry.to_dict(),
+        'version': registry.version,
+        'source': registry.source
+    }), 200
+
+
 @app.route('/s3-test', methods=['GET'])
 def test_s3_config():
     """Test S3 configuration"""
@@ -1112,7 +1866,8 @@ def test_s3_config():
                     's3',
                     aws_access_key_id=aws_access_key,
                     aws_secret_access_key=aws_secret_key,
-                    region_name=region
+                    region_name=region,
+                    endpoint_url=S3_CONFIG['endpoint_url']
                 )
                 s3_client.head_bucket(Bucket=bucket_name)
                 config_status['s3_connection'] = 'Success'
@@ -1129,6 +1884,147 @@ def test_s3_config():
     except Exception as e:
         return jsonify({'error': f'S3 test failed: {e}'}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics in text exposition format"""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+# Admin endpoint configuration
+ADMIN_CONFIG = {
+    # X-Admin-Token for /admin/backfill (closed when unset); /admin/profiling keeps PROFILE_TOKEN
+    'token': os.getenv('ADMIN_TOKEN', ''),
+}
+
+
+def admin_authorized(token):
+    """X-Admin-Token matches the endpoint's token (the endpoint is closed when the token is unset)"""
+    return bool(token) and request.headers.get('X-Admin-Token') == token
+
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling_admin():
+    """
+    Show or change the request profiler toggle
+    Expected input (POST): {"enabled": true, "sample_rate": 0.01, "endpoints": ["crop_image_endpoint"]}
+    Requires the X-Admin-Token header to match PROFILE_TOKEN
+    """
+    if not admin_authorized(profiling.PROFILE_CONFIG['token']):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        if 'enabled' in data:
+            profiling.PROFILE_STATE['enabled'] = bool(data['enabled'])
+        if 'sample_rate' in data:
+            profiling.PROFILE_STATE['sample_rate'] = min(max(float(data['sample_rate']), 0.0), 1.0)
+        if 'endpoints' in data:
+            profiling.PROFILE_STATE['endpoints'] = data['endpoints'] or None
+    
+    return jsonify({
+        'state': profiling.PROFILE_STATE,
+        'max_fraction': profiling.PROFILE_CONFIG['max_fraction'],
+        'stats': profiling.get_profile_stats(),
+        'profiles': profiling.list_profiles()[:20]
+    }), 200
+
+
+@app.route('/admin/backfill', methods=['GET', 'POST'])
+def backfill_admin():
+    """
+    Show rendition backfill jobs, queue one or cancel one
+    Expected input (POST): {"platforms": ["Facebook"]} to queue a job (all platforms when omitted),
+    or {"cancel": job_id}
+    Jobs fill in registered (platform, dimension) renditions that stored creatives are missing,
+    resuming from their checkpoint after a restart
+    Requires the X-Admin-Token header to match ADMIN_TOKEN
+    """
+    if not admin_authorized(ADMIN_CONFIG['token']):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        status = 200
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            if 'cancel' in data:
+                if not rendition_backfill.cancel_job(conn, data['cancel']):
+                    return jsonify({'error': 'No pending or running job with that id'}), 404
+            else:
+                platforms = data.get('platforms')
+                if platforms is not None:
+                    if not isinstance(platforms, list) or not platforms:
+                        return jsonify({'error': 'platforms must be a non-empty list'}), 400
+                    platform_error = validate_selected_platforms(platforms)
+                    if platform_error:
+                        return jsonify({'error': platform_error}), 400
+                # Only a full job stands in for the automatic one for this registry version
+                version = platform_registry.get_registry().version if platforms is None else None
+                rendition_backfill.queue_job(conn, platforms=platforms, registry_version=version)
+                status = 202
+        jobs = rendition_backfill.list_jobs(conn)
+    except psycopg.Error as e:
+        logger.error(f"Backfill admin query failed: {e}")
+        return jsonify({'error': 'Database query failed'}), 500
+    finally:
+        conn.close()
+    
+    return jsonify({
+        'config': rendition_backfill.BACKFILL_CONFIG,
+        'stats': rendition_backfill.get_stats(),
+        'jobs': jobs
+    }), status
+
+
+register_gauge('genai_enabled', 'Whether the Gemini client is available', lambda: int(GENAI_ENABLED))
+register_gauge('s3_enabled', 'Whether S3 is configured', lambda: int(S3_ENABLED))
+register_gauge('platform_registry_version', 'Version of the loaded platform registry',
+               lambda: platform_registry.get_registry().version)
+register_gauge('platform_registry_dimensions', 'Platform/dimension pairs in the registry',
+               lambda: len(platform_registry.get_registry()))
+register_gauge('focal_point_cache', 'Focal point cache hits, misses and size',
+               lambda: [({'stat': key}, value) for key, value in focal_point.get_cache_stats().items()])
+register_gauge('render_cache', 'Render disk cache hits, misses, evictions and bytes',
+               lambda: [({'stat': key}, value) for key, value in render_cache.get_stats().items()])
+register_gauge('single_flight_in_flight', 'Distinct single-flight keys currently running in this process',
+               single_flight.in_flight)
+register_gauge('local_image_store', 'Local generated-image store hits, misses, evictions and bytes',
+               lambda: [({'stat': key}, value) for key, value in local_image_store.get_stats().items()])
+register_gauge('tag_index', 'Ad-serving tag index size: creatives, tags, postings and memory_bytes',
+               lambda: [({'stat': key}, tag_index.get_stats().get(key, 0))
+                        for key in ('creatives', 'tags', 'postings', 'memory_bytes')])
+register_gauge('phash_index_hashes', 'Perceptual hashes in the near-duplicate index',
+               lambda: perceptual_hash.get_stats()['hashes'])
+register_gauge('generation_input_cache', 'Prepared generation-input cache entries and bytes',
+               lambda: [({'stat': key}, value) for key, value in generation_inputs.get_cache_stats().items()])
+register_gauge('creative_partitions', 'creative_new partitions holding rows, as seen by id lookups',
+               lambda: creative_partitions.get_stats()['partitions_with_rows'])
+register_gauge('backfill_running_job', 'Rendition backfill job running in this worker (0 when idle)',
+               lambda: rendition_backfill.get_stats()['running_job_id'] or 0)
+register_gauge('log_records_dropped', 'Log records dropped because the log queue was full', get_dropped_count)
+
+# Load platforms once per worker and follow changes via LISTEN/NOTIFY
+platform_registry.init_registry(get_db_connection)
+db_router.init_router(get_db_connection, primary_dsn=db_conninfo())
+perceptual_hash.init_phash_index(db_router.get_read_connection)
+tag_index.init_tag_index(get_db_connection)
+
+
+def start_partition_maintenance():
+    """Keep next months' creative_new partitions created (no-op on an unpartitioned table)"""
+    creative_partitions.init_partitions(get_db_connection)
+
+
+def start_backfill():
+    """
+    Start the rendition backfill loop in this process. Called by the serving entry point rather
+    than at import, so scripts, benchmarks and tests that import the app never start it.
+    """
+    rendition_backfill.init_backfill(get_db_connection, backfill_renditions,
+                                     auto_queue=RENDER_CONFIG['prerender_on_ingest'])
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
@@ -1152,33 +2048,38 @@ if __name__ == '__main__':
                     dimension VARCHAR(100)
                 )
             """)
+            platform_registry.ensure_platform_schema(cursor)
             
-            # Create creative table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS creative_new (
-                    creative_id SERIAL PRIMARY KEY,
-                    ad_item_id VARCHAR(255) NOT NULL,
-                    creative_title VARCHAR(255) NOT NULL,
-                    creative_description TEXT,
-                    creative_s3_url VARCHAR(500),
-                    campaign VARCHAR(255),
-                    format_type VARCHAR(100),
-                    tags JSONB,
-                    dynamic_elements JSONB,
-                    image_data JSONB,
-                    selected_platforms JSONB,
-                    generated_creatives JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    
-                )
-            """)
+            # Create creative table (range-partitioned by created_at with CREATIVE_PARTITIONING=true)
+            if creative_partitions.PARTITION_CONFIG['enabled']:
+                creative_partitions.create_partitioned_table(cursor)
+            else:
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS creative_new (
+                        creative_id SERIAL PRIMARY KEY,
+                        {creative_partitions.CREATIVE_TABLE_COLUMNS}
+                    )
+                """)
+            cursor.execute("ALTER TABLE creative_new ADD COLUMN IF NOT EXISTS focal_point JSONB")
+            creative_partitions.ensure_creative_indexes(cursor)
+            tag_index.ensure_tag_index_schema(cursor)
+            perceptual_hash.ensure_phash_schema(cursor)
+            rendition_backfill.ensure_backfill_schema(cursor)
             
             conn.commit()
             cursor.close()
             conn.close()
-            print("Database tables created successfully")
+            logger.info("Database tables created successfully")
     except Exception as e:
-        print(f"Error creating tables: {e}")
+        logger.error(f"Error creating tables: {e}")
+    
+    # Pick up the platform table now that it exists
+    platform_registry.reload_registry()
+    
+    # Background writers run only in the server process, never on import
+    start_partition_maintenance()
+    # Fill in renditions for platform dimensions added after creatives were stored
+    start_backfill()
     
     # Use PORT environment variable for production
     port = int(os.environ.get('PORT', 5001))
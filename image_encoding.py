@@ -0,0 +1,193 @@
+import io
+import json
+import os
+
+from PIL import Image, ImageOps, features
+
+try:
+    from PIL import ImageCms
+    SRGB_PROFILE = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+except ImportError:
+    ImageCms = None
+    SRGB_PROFILE = None
+
+# Encoder settings
+ENCODE_CONFIG = {
+    'jpeg_quality': int(os.getenv('JPEG_QUALITY', 85)),
+    'jpeg_progressive': os.getenv('JPEG_PROGRESSIVE', 'true').lower() == 'true',
+    # Huffman table optimization: smaller files for a little encode time
+    'jpeg_optimize': os.getenv('JPEG_OPTIMIZE', 'true').lower() == 'true',
+    # '4:4:4', '4:2:2' or '4:2:0'
+    'jpeg_subsampling': os.getenv('JPEG_SUBSAMPLING', '4:2:0'),
+    'webp_quality': int(os.getenv('WEBP_QUALITY', 80)),
+    # 0 (fast) - 6 (small)
+    'webp_method': int(os.getenv('WEBP_METHOD', 4)),
+    'avif_quality': int(os.getenv('AVIF_QUALITY', 60)),
+    # 0 (slow) - 10 (fast)
+    'avif_speed': int(os.getenv('AVIF_SPEED', 8)),
+    # 0 (none) - 9 (smallest); 6 is zlib's default trade-off
+    'png_compress_level': int(os.getenv('PNG_COMPRESS_LEVEL', 6)),
+    'png_optimize': os.getenv('PNG_OPTIMIZE', 'false').lower() == 'true',
+    # Format for platform renditions unless the platform has its own entry below
+    'rendition_format': os.getenv('RENDITION_FORMAT', 'jpeg').lower(),
+    # Per-platform overrides, e.g. {"Google": "webp", "Snapchat": "avif"}; only for placements that accept them
+    'platform_formats': {
+        name.strip().lower(): fmt.lower()
+        for name, fmt in json.loads(os.getenv('PLATFORM_OUTPUT_FORMATS', '{}')).items()
+    },
+    # Format for generated images returned by the Gemini endpoints
+    'generated_format': os.getenv('GENERATED_IMAGE_FORMAT', 'png').lower(),
+}
+
+# Source normalization settings
+NORMALIZE_CONFIG = {
+    # Convert embedded ICC profiles (Adobe RGB, Display P3, CMYK) to sRGB before processing
+    'convert_icc': os.getenv('NORMALIZE_CONVERT_ICC', 'true').lower() == 'true',
+    # Colour behind transparent pixels when alpha is flattened
+    'background': tuple(int(value) for value in os.getenv('NORMALIZE_BACKGROUND', '255,255,255').split(',')),
+}
+
+# format -> (Pillow format, mimetype, file extension)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'png': ('PNG', 'image/png', 'png'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'avif': ('AVIF', 'image/avif', 'avif'),
+}
+
+FORMAT_ALIASES = {'jpg': 'jpeg'}
+
+
+def normalize_format(fmt):
+    """Canonical format name; AVIF falls back to WebP when Pillow was built without it"""
+    fmt = FORMAT_ALIASES.get(fmt.lower(), fmt.lower())
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    if fmt == 'avif' and not features.check('avif'):
+        return 'webp'
+    if fmt == 'webp' and not features.check('webp'):
+        return 'jpeg'
+    return fmt
+
+
+def platform_format(platform_name):
+    """Output format for a platform's renditions"""
+    fmt = ENCODE_CONFIG['platform_formats'].get(platform_name.strip().lower(), ENCODE_CONFIG['rendition_format'])
+    return normalize_format(fmt)
+
+
+def save_options(fmt):
+    """Pillow save() keyword arguments for a format"""
+    if fmt == 'jpeg':
+        return {
+            'quality': ENCODE_CONFIG['jpeg_quality'],
+            'progressive': ENCODE_CONFIG['jpeg_progressive'],
+            'optimize': ENCODE_CONFIG['jpeg_optimize'],
+            'subsampling': ENCODE_CONFIG['jpeg_subsampling'],
+        }
+    if fmt == 'webp':
+        return {'quality': ENCODE_CONFIG['webp_quality'], 'method': ENCODE_CONFIG['webp_method']}
+    if fmt == 'avif':
+        return {'quality': ENCODE_CONFIG['avif_quality'], 'speed': ENCODE_CONFIG['avif_speed']}
+    return {'compress_level': ENCODE_CONFIG['png_compress_level'], 'optimize': ENCODE_CONFIG['png_optimize']}
+
+
+def _prepare(image, fmt):
+    """Convert to a mode the encoder accepts; flattens alpha onto white for JPEG"""
+    if fmt == 'jpeg':
+        if image.mode in ('RGB', 'L'):
+            return image
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            return background
+        return image.convert('RGB')
+    if image.mode == 'CMYK' or (fmt != 'png' and image.mode not in ('RGB', 'RGBA')):
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        return image.convert('RGBA' if has_alpha else 'RGB')
+    return image
+
+
+def encode_image(image, fmt, **options):
+    """
+    Encode a PIL image; returns (bytes, format) where format may differ from the request
+    when the encoder is unavailable. Keyword options override the configured settings.
+    """
+    fmt = normalize_format(fmt)
+    buffer = io.BytesIO()
+    _prepare(image, fmt).save(buffer, format=OUTPUT_FORMATS[fmt][0], **dict(save_options(fmt), **options))
+    return buffer.getvalue(), fmt
+
+
+def mimetype(fmt):
+    return OUTPUT_FORMATS[normalize_format(fmt)][1]
+
+
+def extension(fmt):
+    return OUTPUT_FORMATS[normalize_format(fmt)][2]
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _flatten(image):
+    """Composite an image with alpha onto NORMALIZE_CONFIG['background'] as RGB"""
+    rgba = image.convert('RGBA')
+    background = Image.new('RGB', rgba.size, NORMALIZE_CONFIG['background'])
+    background.paste(rgba, mask=rgba.getchannel('A'))
+    return background
+
+
+def _to_srgb(image, icc_profile, output_mode):
+    """Convert through the embedded ICC profile to sRGB; None when not possible or not needed"""
+    if not icc_profile or ImageCms is None or not NORMALIZE_CONFIG['convert_icc']:
+        return None
+    try:
+        source_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        if image.mode != 'CMYK' and 'srgb' in ImageCms.getProfileDescription(source_profile).lower():
+            return None
+        if output_mode == 'RGB' and has_alpha(image):
+            # The transform would drop alpha as-is; flatten first so transparent pixels get the background
+            image = _flatten(image)
+        elif image.mode not in ('RGB', 'RGBA', 'CMYK', 'L'):
+            image = image.convert('RGBA' if output_mode == 'RGBA' else 'RGB')
+        return ImageCms.profileToProfile(image, source_profile, SRGB_PROFILE, outputMode=output_mode)
+    except Exception:
+        # Broken or unsupported profile: fall back to a plain mode conversion
+        return None
+
+
+def normalize_source(image, keep_alpha=True):
+    """
+    One-time normalization of a decoded source before any rendition is made:
+    applies EXIF orientation, converts ICC-tagged images to sRGB, converts to the working
+    mode (RGB, or RGBA when the source has alpha and keep_alpha is set; otherwise alpha is
+    flattened onto NORMALIZE_CONFIG['background']) and strips metadata.
+    May return the input image itself when nothing needs converting; the input is never modified.
+    """
+    source = image
+    orientation = image.getexif().get(0x0112, 1)
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+
+    alpha = keep_alpha and has_alpha(image)
+    output_mode = 'RGBA' if alpha else 'RGB'
+    icc_profile = image.info.get('icc_profile')
+
+    converted = _to_srgb(image, icc_profile, output_mode)
+    if converted is not None:
+        image = converted
+    elif image.mode != output_mode:
+        if not alpha and has_alpha(image):
+            image = _flatten(image)
+        else:
+            image = image.convert(output_mode)
+
+    # Renditions carry no EXIF/XMP/ICC; pixels are already upright sRGB
+    if image.info:
+        if image is source:
+            image = image.copy()
+        image.info = {}
+    return image
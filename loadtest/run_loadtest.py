@@ -0,0 +1,328 @@
+"""
+End-to-end load test for the creative API, runnable offline.
+
+Boots the app against local Postgres (DB_* environment variables), a fake S3 (moto, or any
+S3-compatible endpoint via --s3-endpoint) and a stub Gemini server, then replays a traffic
+mix from a JSONL file and reports throughput and p50/p95/p99 latency per endpoint.
+
+Each traffic line is a request template:
+    {"name": "creative_lookup", "weight": 80, "method": "POST", "path": "/creative", "json": {"adTag": "{tag}"}}
+Placeholders: {tag}, {uuid}, {creative_id}, {fixture_url}, {template_url}, {run_tag}.
+Use {run_tag} as the campaign of creatives the traffic adds: rows with it are deleted after the run.
+With --sequential the lines are replayed in file order (a recorded trace) instead of by weight.
+
+Usage:
+    python loadtest/run_loadtest.py --seed 1000 --concurrency 1 4 16 --duration 20
+    python loadtest/run_loadtest.py --traffic loadtest/traffic/ingest_only.jsonl --concurrency 1 2 4 8
+    python loadtest/run_loadtest.py --app-url http://localhost:5001   # target a running server
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(LOADTEST_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_image_pipeline import ensure_fixtures, start_fixture_server, fixture_path  # noqa: E402
+from loadtest.stubs import start_gemini_stub, start_fake_s3  # noqa: E402
+
+APP_PATH = os.path.join(REPO_ROOT, 'hackaython_creative_sender_api.py')
+DEFAULT_TRAFFIC = os.path.join(LOADTEST_DIR, 'traffic', 'default.jsonl')
+TAGS = [f"tag{i}" for i in range(50)]
+BUCKET = 'loadtest-bucket'
+
+
+def load_traffic(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def fill(value, context):
+    """Substitute {placeholders} in strings, recursively"""
+    if isinstance(value, str):
+        for key, replacement in context.items():
+            token = '{' + key + '}'
+            if token in value:
+                value = value.replace(token, str(replacement() if callable(replacement) else replacement))
+        return value
+    if isinstance(value, list):
+        return [fill(item, context) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, context) for key, item in value.items()}
+    return value
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def seed_creatives(count, run_tag):
+    """
+    Insert count creatives straight into creative_new with plain SQL; returns their ids.
+    Rows are tagged with run_tag in the campaign column so remove_seeded() can delete them.
+    """
+    from upload_platforms import get_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Cannot connect to Postgres; check the DB_* environment variables")
+    rows = [
+        (f"seed-{i}", f"seed creative {i}", "seeded for load test", run_tag, "image",
+         json.dumps([random.choice(TAGS)]), json.dumps({}), json.dumps({}),
+         f"https://example.invalid/seed-{i}.jpg", json.dumps(["Facebook"]))
+        for i in range(count)
+    ]
+    try:
+        with conn.cursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO creative_new (
+                    ad_item_id, creative_title, creative_description, campaign, format_type,
+                    tags, dynamic_elements, image_data, creative_s3_url, selected_platforms
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                rows
+            )
+            cursor.execute("SELECT creative_id FROM creative_new WHERE campaign = %s ORDER BY creative_id", (run_tag,))
+            ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+    finally:
+        conn.close()
+    return ids
+
+
+def existing_creative_ids(limit=1000):
+    """Ids of up to limit stored creatives (newest first), for {creative_id} without --seed"""
+    from upload_platforms import get_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Cannot connect to Postgres; check the DB_* environment variables")
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT creative_id FROM creative_new ORDER BY creative_id DESC LIMIT %s", (limit,))
+            return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def remove_seeded(run_tag):
+    """Delete the creatives this run inserted: seeded rows and those added by the traffic ({run_tag} campaign)"""
+    from upload_platforms import get_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        print(f"warning: could not connect to remove load-test creatives (campaign = {run_tag!r})")
+        return
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM creative_new WHERE campaign = %s", (run_tag,))
+            removed = cursor.rowcount
+        conn.commit()
+        print(f"removed {removed} load-test creatives")
+    finally:
+        conn.close()
+
+
+def boot_app(port, env):
+    """Start the app in a subprocess and wait for /health"""
+    process = subprocess.Popen([sys.executable, APP_PATH], cwd=REPO_ROOT, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited with code {process.returncode}")
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("app did not become healthy within 60s")
+
+
+def run_level(app_url, traffic, context, concurrency, duration, max_requests, sequential, timeout):
+    """Drive traffic at a fixed concurrency; returns per-endpoint samples"""
+    weights = [item.get('weight', 1) for item in traffic]
+    sequence = itertools.cycle(traffic)
+    sequence_lock = threading.Lock()
+    samples = []
+    samples_lock = threading.Lock()
+    issued = itertools.count()
+    stop_at = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < stop_at:
+            if max_requests and next(issued) >= max_requests:
+                break
+            if sequential:
+                with sequence_lock:
+                    template = next(sequence)
+            else:
+                template = random.choices(traffic, weights)[0]
+            item = fill(template, context)
+            name = item.get('name') or f"{item.get('method', 'GET')} {item['path']}"
+            start = time.perf_counter()
+            try:
+                response = session.request(
+                    item.get('method', 'GET'), app_url + item['path'],
+                    json=item.get('json'), headers=item.get('headers'), timeout=timeout
+                )
+                status = response.status_code
+            except requests.RequestException:
+                status = 'error'
+            local.append((name, time.perf_counter() - start, status))
+        with samples_lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    by_name = {}
+    for name, latency, status in samples:
+        by_name.setdefault(name, []).append((latency, status))
+    report = {}
+    for name, entries in sorted(by_name.items()):
+        latencies = sorted(latency for latency, _ in entries)
+        failures = sum(1 for _, status in entries if status == 'error' or status >= 500)
+        report[name] = {
+            'requests': len(entries),
+            'rps': round(len(entries) / elapsed, 2),
+            'errors': failures,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        }
+    report['_total'] = {'requests': len(samples), 'rps': round(len(samples) / elapsed, 2), 'seconds': round(elapsed, 2)}
+    return report
+
+
+def print_report(concurrency, report):
+    print(f"\nconcurrency={concurrency}  total={report['_total']['requests']} "
+          f"rps={report['_total']['rps']} over {report['_total']['seconds']}s")
+    print(f"  {'endpoint':<22}{'reqs':>8}{'rps':>10}{'errors':>8}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}")
+    for name, row in report.items():
+        if name.startswith('_'):
+            continue
+        print(f"  {name:<22}{row['requests']:>8}{row['rps']:>10}{row['errors']:>8}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the creative API with local stand-ins')
+    parser.add_argument('--traffic', default=DEFAULT_TRAFFIC, help='JSONL traffic mix')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                        help='one or more concurrency levels, run in order to find saturation')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per concurrency level')
+    parser.add_argument('--requests', type=int, default=0, help='stop each level after this many requests')
+    parser.add_argument('--sequential', action='store_true', help='replay traffic lines in order')
+    parser.add_argument('--seed', type=int, default=0, help='insert this many creatives before the run')
+    parser.add_argument('--fixture-size', default='2MP', help='fixture used for {fixture_url}')
+    parser.add_argument('--gemini-latency-ms', type=float, default=500, help='stub model latency')
+    parser.add_argument('--s3-endpoint', default=None, help='use this S3-compatible endpoint instead of moto')
+    parser.add_argument('--app-url', default=None, help='target an already running server instead of booting one')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', default=None, help='write the report as JSON')
+    args = parser.parse_args()
+
+    traffic = load_traffic(args.traffic)
+    needs_creative_ids = any('{creative_id}' in json.dumps(template) for template in traffic)
+    ensure_fixtures([args.fixture_size, '0.3MP'], ['RGB'])
+    fixture_server = start_fixture_server()
+    fixture_base = f"http://127.0.0.1:{fixture_server.server_address[1]}"
+
+    servers = [fixture_server]
+    process = None
+    # Seeded and traffic-added rows carry this campaign so they can be removed afterwards
+    run_tag = f"loadtest-{uuid.uuid4()}"
+    try:
+        app_url = args.app_url
+        if not app_url:
+            gemini_server, gemini_url = start_gemini_stub(args.gemini_latency_ms)
+            servers.append(gemini_server)
+            s3_endpoint = args.s3_endpoint
+            if not s3_endpoint:
+                s3_server, s3_endpoint = start_fake_s3(BUCKET)
+                servers.append(s3_server)
+            env = dict(os.environ)
+            env.update({
+                'PORT': str(args.port),
+                'GEMINI_API_KEY': env.get('GEMINI_API_KEY', 'loadtest'),
+                'GEMINI_BASE_URL': gemini_url,
+                'S3_ENDPOINT_URL': s3_endpoint,
+                'S3_BUCKET_NAME': BUCKET,
+                'S3_BUCKET': BUCKET,
+                'AWS_ACCESS_KEY_ID': env.get('AWS_ACCESS_KEY_ID', 'loadtest'),
+                'AWS_SECRET_ACCESS_KEY': env.get('AWS_SECRET_ACCESS_KEY', 'loadtest'),
+                'LOG_LEVEL': env.get('LOG_LEVEL', 'WARNING'),
+                # Keep background rendition work out of the measurements
+                'BACKFILL_ENABLED': env.get('BACKFILL_ENABLED', 'false'),
+            })
+            process, app_url = boot_app(args.port, env)
+
+        if args.seed:
+            creative_ids = seed_creatives(args.seed, run_tag)
+        else:
+            creative_ids = existing_creative_ids() if needs_creative_ids else []
+            if needs_creative_ids and not creative_ids:
+                raise SystemExit("The traffic uses {creative_id} but creative_new is empty; pass --seed N")
+        context = {
+            'run_tag': run_tag,
+            'tag': lambda: random.choice(TAGS),
+            'uuid': lambda: uuid.uuid4(),
+            'creative_id': lambda: random.choice(creative_ids),
+            'fixture_url': f"{fixture_base}/{os.path.basename(fixture_path(args.fixture_size, 'RGB'))}",
+            'template_url': f"{fixture_base}/{os.path.basename(fixture_path('0.3MP', 'RGB'))}",
+        }
+
+        results = []
+        for concurrency in args.concurrency:
+            samples, elapsed = run_level(app_url, traffic, context, concurrency, args.duration,
+                                         args.requests, args.sequential, args.timeout)
+            report = summarize(samples, elapsed)
+            print_report(concurrency, report)
+            results.append({'concurrency': concurrency, 'report': report})
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'traffic': args.traffic, 'duration': args.duration, 'levels': results}, f, indent=2)
+            print(f"\nreport written to {args.output}")
+    finally:
+        remove_seeded(run_tag)
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        for server in servers:
+            if hasattr(server, 'shutdown'):
+                server.shutdown()
+            else:
+                server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Local stand-ins for the load-test harness: Gemini stub, fake S3, fixture image server"""
+import base64
+import http.server
+import io
+import json
+import threading
+import time
+
+from PIL import Image
+
+
+class GeminiStubHandler(http.server.BaseHTTPRequestHandler):
+    """Answers generateContent calls with a fixed PNG after a configurable delay"""
+
+    image_base64 = None
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if ':generateContent' not in self.path:
+            self.send_error(404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps({
+            'candidates': [{
+                'content': {
+                    'role': 'model',
+                    'parts': [
+                        {'text': 'stub generated image'},
+                        {'inlineData': {'mimeType': 'image/png', 'data': self.image_base64}},
+                    ],
+                },
+                'finishReason': 'STOP',
+            }]
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_gemini_stub(latency_ms=0, image_size=(1024, 1024)):
+    """Start the Gemini stub on a random local port; returns (server, base_url)"""
+    buffer = io.BytesIO()
+    Image.new('RGB', image_size, (200, 120, 40)).save(buffer, format='PNG')
+    handler = type('Handler', (GeminiStubHandler,), {
+        'image_base64': base64.b64encode(buffer.getvalue()).decode('utf-8'),
+        'latency': latency_ms / 1000,
+    })
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def start_fake_s3(bucket, port=0):
+    """Start a moto S3 server and create the bucket; returns (server, endpoint_url)"""
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise RuntimeError("moto is not installed; pip install -r loadtest/requirements.txt or pass --s3-endpoint")
+    import boto3
+
+    if not port:
+        # moto needs a concrete port, borrow a free one from the OS
+        with http.server.HTTPServer(('127.0.0.1', 0), http.server.BaseHTTPRequestHandler) as probe:
+            port = probe.server_address[1]
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    endpoint_url = f"http://127.0.0.1:{port}"
+    boto3.client(
+        's3', endpoint_url=endpoint_url, region_name='us-east-1',
+        aws_access_key_id='loadtest', aws_secret_access_key='loadtest'
+    ).create_bucket(Bucket=bucket)
+    return server, endpoint_url
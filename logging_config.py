@@ -0,0 +1,168 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# Third-party loggers that flood the output at DEBUG (one line per wire event)
+NOISY_LOGGERS = {
+    'boto3': 'WARNING',
+    'botocore': 'WARNING',
+    's3transfer': 'WARNING',
+    'urllib3': 'WARNING',
+    'PIL': 'WARNING',
+    'google_genai': 'WARNING',
+    'httpx': 'WARNING',
+    'httpcore': 'WARNING',
+}
+
+# Logging configuration
+LOG_CONFIG = {
+    'level': os.getenv('LOG_LEVEL', 'INFO').upper(),
+    # Per-module overrides, e.g. "creative_api=DEBUG,botocore=INFO"
+    'module_levels': os.getenv('LOG_LEVELS', ''),
+    # 'json' for structured output, 'text' for local development
+    'format': os.getenv('LOG_FORMAT', 'json').lower(),
+    # Max records buffered for the writer thread before new ones are dropped
+    'queue_size': int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+}
+
+_listener = None
+_dropped_records = 0
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a log record as a single JSON line"""
+
+    def format(self, record):
+        payload = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records that carry a sample_rate attribute"""
+
+    def filter(self, record):
+        rate = getattr(record, 'sample_rate', None)
+        if rate is None or rate >= 1:
+            return True
+        return random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller; drops records when the queue is full"""
+
+    def prepare(self, record):
+        # Resolve the message now but leave formatting to the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped_records += 1
+
+
+def parse_module_levels(spec):
+    """Parse "name=LEVEL,name2=LEVEL" into a dict"""
+    levels = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item or '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Install the queue-based root handler and per-module levels (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if LOG_CONFIG['format'] == 'text':
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+    else:
+        formatter = JsonFormatter()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=LOG_CONFIG['queue_size'])
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_CONFIG['level'])
+
+    levels = dict(NOISY_LOGGERS)
+    levels.update(parse_module_levels(LOG_CONFIG['module_levels']))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name):
+    """Return a logger, configuring logging on first use"""
+    configure_logging()
+    return logging.getLogger(name)
+
+
+def log_event(logger, level, event, sample_rate=None, **fields):
+    """
+    Log a structured event with extra fields.
+    sample_rate (0-1) keeps only that fraction of records, for high-volume events.
+    Nothing is built when the level is disabled for the logger.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample_rate is not None:
+        fields['sample_rate'] = sample_rate
+    logger.log(level, event, extra=fields)
+
+
+def get_dropped_count():
+    """Number of records dropped because the log queue was full"""
+    return _dropped_records
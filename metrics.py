@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+# Metrics configuration
+METRICS_CONFIG = {
+    'prefix': os.getenv('METRICS_PREFIX', 'creative_api'),
+    # Attach per-stage timings to responses as a Server-Timing header
+    'server_timing': os.getenv('SERVER_TIMING_ENABLED', 'false').lower() == 'true',
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauge_callbacks = {}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=None):
+    items = list(label_key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    parts = []
+    for key, value in items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, one series per label set"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with _lock:
+            snapshot = [(key, dict(s, counts=list(s['counts']))) for key, s in self.series.items()]
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per label set"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with _lock:
+            snapshot = list(self.series.items())
+        for key, value in snapshot:
+            lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """Get or create a histogram registered under the metrics prefix"""
+    full_name = f"{METRICS_CONFIG['prefix']}_{name}"
+    with _lock:
+        if full_name not in _histograms:
+            _histograms[full_name] = Histogram(full_name, help_text, buckets)
+        return _histograms[full_name]
+
+
+def counter(name, help_text):
+    """Get or create a counter registered under the metrics prefix"""
+    full_name = f"{METRICS_CONFIG['prefix']}_{name}"
+    with _lock:
+        if full_name not in _counters:
+            _counters[full_name] = Counter(full_name, help_text)
+        return _counters[full_name]
+
+
+def register_gauge(name, help_text, callback):
+    """
+    Register a gauge whose value is read from callback() at scrape time.
+    The callback returns a number or a list of (labels_dict, value) pairs.
+    """
+    full_name = f"{METRICS_CONFIG['prefix']}_{name}"
+    with _lock:
+        _gauge_callbacks[full_name] = (help_text, callback)
+
+
+STAGE_SECONDS = histogram('stage_duration_seconds', 'Time spent in each pipeline stage')
+STAGE_ERRORS = counter('stage_errors_total', 'Pipeline stages that raised an exception')
+REQUEST_SECONDS = histogram('http_request_duration_seconds', 'HTTP request latency by endpoint')
+
+
+def record_stage(stage, duration):
+    """Record a stage duration and add it to the current request's Server-Timing"""
+    STAGE_SECONDS.observe(duration, stage=stage)
+    if METRICS_CONFIG['server_timing'] and has_request_context():
+        timings = g.setdefault('server_timings', {})
+        timings[stage] = timings.get(stage, 0.0) + duration
+
+
+@contextmanager
+def timed(stage):
+    """Time the enclosed block as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def server_timing_header():
+    """Build a Server-Timing header value for the current request, or None"""
+    if not METRICS_CONFIG['server_timing'] or not has_request_context():
+        return None
+    timings = g.get('server_timings')
+    if not timings:
+        return None
+    parts = []
+    for stage, duration in timings.items():
+        token = stage.replace('.', '-').replace(' ', '_')
+        parts.append(f'{token};dur={duration * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def render_prometheus():
+    """Render every registered metric in Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        histograms = list(_histograms.values())
+        counters = list(_counters.values())
+        gauges = list(_gauge_callbacks.items())
+    for metric in histograms + counters:
+        lines.extend(metric.render())
+    for name, (help_text, callback) in gauges:
+        try:
+            value = callback()
+        except Exception:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        if isinstance(value, list):
+            for labels, series_value in value:
+                lines.append(f'{name}{_format_labels(_label_key(labels))} {series_value}')
+        else:
+            lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
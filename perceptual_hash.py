@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from logging_config import get_logger
+
+logger = get_logger('creative_api.perceptual_hash')
+
+# Near-duplicate detection configuration
+PHASH_CONFIG = {
+    'enabled': os.getenv('PHASH_ENABLED', 'true').lower() == 'true',
+    # Default radius (differing bits out of 64) for /creatives/similar
+    'max_distance': int(os.getenv('PHASH_MAX_DISTANCE', 10)),
+    # Ingest reuses the renditions of a creative at most this far away (recompression is ~0-2)
+    'reuse_max_distance': int(os.getenv('PHASH_REUSE_MAX_DISTANCE', 3)),
+    'reuse_renditions': os.getenv('PHASH_REUSE_RENDITIONS', 'true').lower() == 'true',
+    # Pick up creatives inserted by other workers this often (by id watermark)
+    'refresh_seconds': float(os.getenv('PHASH_REFRESH_SECONDS', 5)),
+    # Full reload, drops deleted creatives and any rows the watermark skipped
+    'rebuild_seconds': float(os.getenv('PHASH_REBUILD_SECONDS', 900)),
+}
+
+PHASH_SCHEMA_SQL = [
+    "ALTER TABLE creative_new ADD COLUMN IF NOT EXISTS phash BIGINT",
+    "CREATE INDEX IF NOT EXISTS creative_new_phash_idx ON creative_new (phash)",
+]
+
+HASHES_QUERY = "SELECT creative_id, phash FROM creative_new WHERE phash IS NOT NULL AND creative_id > %s"
+
+
+def _dct_matrix(size):
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(32)
+
+
+def phash(image):
+    """
+    64-bit perceptual hash: low-frequency 8x8 DCT coefficients of a 32x32 grayscale thumbnail,
+    thresholded at their median. Robust to rescaling and recompression; thresholding at the
+    median keeps mostly-flat images (product on a white background) from collapsing to ~0.
+    """
+    small = image.convert('L').resize((32, 32), Image.Resampling.BOX, reducing_gap=2.0)
+    coefficients = (_DCT @ np.asarray(small, dtype=np.float32) @ _DCT.T)[:8, :8].flatten()
+    bits = np.packbits(coefficients > np.median(coefficients[1:]))
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def to_signed(value):
+    """Unsigned 64-bit hash -> BIGINT"""
+    return value - (1 << 64) if value is not None and value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    """BIGINT -> unsigned 64-bit hash"""
+    return value + (1 << 64) if value is not None and value < 0 else value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    BK-tree over 64-bit hashes under Hamming distance. A node is [hash, creative ids, {distance: child}];
+    radius searches only descend into children whose edge distance can still be within range.
+    """
+
+    def __init__(self, items=()):
+        self.root = None
+        self.size = 0
+        for creative_id, value in items:
+            self.add(value, creative_id)
+
+    def add(self, value, creative_id):
+        if self.root is None:
+            self.root = [value, [creative_id], {}]
+            self.size += 1
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                if creative_id not in node[1]:
+                    node[1].append(creative_id)
+                    self.size += 1
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [creative_id], {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value, radius):
+        """[(distance, creative_id)] within radius, closest first"""
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                results.extend((distance, creative_id) for creative_id in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        results.sort()
+        return results
+
+
+_tree = None
+_connect = None
+_lock = threading.Lock()
+_state = {'watermark': 0, 'built_at': 0.0, 'refreshed_at': 0.0, 'error_logged': False}
+
+
+def ensure_phash_schema(cursor):
+    """Add the indexed phash column to creative_new"""
+    for statement in PHASH_SCHEMA_SQL:
+        cursor.execute(statement)
+
+
+def init_phash_index(connect):
+    """Set the connection factory; the index loads lazily on first use"""
+    global _connect
+    _connect = connect
+
+
+def _load(since):
+    conn = _connect() if _connect else None
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(HASHES_QUERY, (since,))
+            return [(creative_id, to_unsigned(value)) for creative_id, value in cursor]
+    finally:
+        conn.close()
+
+
+def _refresh():
+    """Full rebuild when stale, else fetch hashes above the id watermark; the query and build run unlocked"""
+    global _tree
+    now = time.time()
+    with _lock:
+        rebuild = _tree is None or now - _state['built_at'] > PHASH_CONFIG['rebuild_seconds']
+        if now - _state['refreshed_at'] < PHASH_CONFIG['refresh_seconds']:
+            return
+        # Claim this refresh so concurrent callers keep using the current tree
+        _state['refreshed_at'] = now
+        since = 0 if rebuild else _state['watermark']
+    try:
+        rows = _load(since)
+    except Exception as e:
+        # Most likely the column has not been migrated yet; log once and keep serving what we have
+        if not _state['error_logged']:
+            logger.warning(f"Could not load perceptual hashes: {e}")
+            _state['error_logged'] = True
+        return
+    if rows is None:
+        return
+    tree = BKTree(rows) if rebuild else None
+    with _lock:
+        if rebuild:
+            _tree = tree
+            _state['built_at'] = now
+        else:
+            for creative_id, value in rows:
+                _tree.add(value, creative_id)
+        if rows:
+            _state['watermark'] = max(_state['watermark'], max(creative_id for creative_id, _ in rows))
+
+
+def add(creative_id, value):
+    """Index a freshly inserted creative in this worker right away"""
+    if value is None:
+        return
+    with _lock:
+        if _tree is not None:
+            _tree.add(value, creative_id)
+
+
+def find_similar(value, max_distance, limit=10):
+    """[(distance, creative_id)] of indexed creatives within max_distance bits, closest first"""
+    _refresh()
+    with _lock:
+        if _tree is None:
+            return []
+        return _tree.search(value, max_distance)[:limit]
+
+
+def get_stats():
+    with _lock:
+        return {
+            'enabled': PHASH_CONFIG['enabled'],
+            'hashes': _tree.size if _tree is not None else 0,
+            'built_at': _state['built_at'],
+            'watermark': _state['watermark'],
+        }
@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from logging_config import get_logger
+
+logger = get_logger('creative_api.platforms')
+
+# Platform registry configuration
+PLATFORM_CONFIG = {
+    # LISTEN on this channel for platform table changes
+    'channel': os.getenv('PLATFORM_NOTIFY_CHANNEL', 'platform_changed'),
+    'listen': os.getenv('PLATFORM_LISTEN', 'true').lower() == 'true',
+    # Fallback poll of the version counter when notifications are missed
+    'poll_seconds': float(os.getenv('PLATFORM_POLL_SECONDS', 60)),
+}
+
+# Used until the platform table has been read (or when it is empty/unreachable)
+DEFAULT_PLATFORMS = [
+    ("Facebook", "1080x1080"),
+    ("Facebook", "1080x1920"),
+    ("Facebook", "1200x628"),
+    ("Instagram", "1080x1080"),
+    ("Instagram", "1080x1920"),
+    ("Google", "125x125"),
+    ("Snapchat", "1080x1920"),
+    ("Snapchat", "1080x1080"),
+]
+
+# Platform changes bump a version row and notify listeners. INSERT/UPDATE/DELETE
+# triggers see their transition tables and skip statements that changed no rows.
+PLATFORM_SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS platform_registry_version (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT INTO platform_registry_version (id, version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING",
+    """
+    CREATE OR REPLACE FUNCTION platform_registry_bump() RETURNS trigger AS $$
+    DECLARE
+        new_version BIGINT;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            IF NOT EXISTS (SELECT 1 FROM new_rows) THEN
+                RETURN NULL;
+            END IF;
+        ELSIF TG_OP = 'DELETE' THEN
+            IF NOT EXISTS (SELECT 1 FROM old_rows) THEN
+                RETURN NULL;
+            END IF;
+        ELSIF TG_OP = 'UPDATE' THEN
+            IF NOT EXISTS (SELECT * FROM new_rows EXCEPT SELECT * FROM old_rows) THEN
+                RETURN NULL;
+            END IF;
+        END IF;
+        UPDATE platform_registry_version SET version = version + 1 RETURNING version INTO new_version;
+        PERFORM pg_notify('{channel}', new_version::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS platform_registry_changed ON platform",
+    "DROP TRIGGER IF EXISTS platform_registry_inserted ON platform",
+    "DROP TRIGGER IF EXISTS platform_registry_updated ON platform",
+    "DROP TRIGGER IF EXISTS platform_registry_deleted ON platform",
+    "DROP TRIGGER IF EXISTS platform_registry_truncated ON platform",
+    """
+    CREATE TRIGGER platform_registry_inserted
+    AFTER INSERT ON platform REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION platform_registry_bump()
+    """,
+    """
+    CREATE TRIGGER platform_registry_updated
+    AFTER UPDATE ON platform REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION platform_registry_bump()
+    """,
+    """
+    CREATE TRIGGER platform_registry_deleted
+    AFTER DELETE ON platform REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION platform_registry_bump()
+    """,
+    """
+    CREATE TRIGGER platform_registry_truncated
+    AFTER TRUNCATE ON platform
+    FOR EACH STATEMENT EXECUTE FUNCTION platform_registry_bump()
+    """,
+]
+
+
+def parse_dimension(dimension):
+    """'1080x1920' -> (1080, 1920); None if malformed"""
+    try:
+        width, height = dimension.lower().replace('*', 'x').split('x')
+        width, height = int(width), int(height)
+    except (AttributeError, ValueError):
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    return width, height
+
+
+class PlatformIndex:
+    """Immutable, case-insensitive map of platform name -> dimensions"""
+
+    def __init__(self, rows, version=0, source='defaults'):
+        names = {}
+        dimensions = {}
+        for platform_name, dimension in rows:
+            if not platform_name or parse_dimension(dimension) is None:
+                continue
+            key = platform_name.strip().lower()
+            dimension = 'x'.join(str(value) for value in parse_dimension(dimension))
+            names.setdefault(key, platform_name.strip())
+            entries = dimensions.setdefault(key, [])
+            if dimension not in entries:
+                entries.append(dimension)
+        self._names = MappingProxyType(names)
+        self._dimensions = MappingProxyType({key: tuple(value) for key, value in dimensions.items()})
+        self.version = version
+        self.source = source
+        self.loaded_at = time.time()
+
+    def dimensions(self, platform_name):
+        """Dimensions for a platform (any case), or None if unknown"""
+        if not isinstance(platform_name, str):
+            return None
+        return self._dimensions.get(platform_name.strip().lower())
+
+    def canonical_name(self, platform_name):
+        if not isinstance(platform_name, str):
+            return None
+        return self._names.get(platform_name.strip().lower())
+
+    def unknown(self, platform_names):
+        """Names from the list that are not registered"""
+        return [name for name in platform_names if self.dimensions(name) is None]
+
+    def all_dimensions(self):
+        """Every distinct dimension across all platforms"""
+        seen = []
+        for entries in self._dimensions.values():
+            for dimension in entries:
+                if dimension not in seen:
+                    seen.append(dimension)
+        return seen
+
+    def to_dict(self):
+        return {self._names[key]: list(value) for key, value in self._dimensions.items()}
+
+    def __len__(self):
+        return sum(len(value) for value in self._dimensions.values())
+
+
+_index = PlatformIndex(DEFAULT_PLATFORMS)
+_connect = None
+_listener_thread = None
+_reload_lock = threading.Lock()
+
+
+def get_registry():
+    """Current platform index; never touches the database"""
+    return _index
+
+
+def ensure_platform_schema(cursor):
+    """Create the version table and change trigger for the platform table"""
+    for statement in PLATFORM_SCHEMA_SQL:
+        cursor.execute(statement.replace('{channel}', PLATFORM_CONFIG['channel']))
+
+
+def _read_version(cursor):
+    try:
+        cursor.execute("SELECT version FROM platform_registry_version")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    except Exception:
+        cursor.connection.rollback()
+        return 0
+
+
+def reload_registry():
+    """Load the platform table into a new index and swap it in"""
+    global _index
+    if _connect is None:
+        return _index
+    with _reload_lock:
+        conn = _connect()
+        if not conn:
+            return _index
+        try:
+            with conn.cursor() as cursor:
+                version = _read_version(cursor)
+                cursor.execute("SELECT platform_name, dimension FROM platform ORDER BY platform_id")
+                rows = cursor.fetchall()
+            conn.rollback()
+        except Exception as e:
+            logger.error(f"Error loading platform registry: {e}")
+            return _index
+        finally:
+            conn.close()
+        if rows:
+            _index = PlatformIndex(rows, version=version, source='database')
+            logger.info(f"Loaded platform registry version {version} ({len(_index)} dimensions)")
+        else:
+            logger.warning("Platform table is empty, keeping built-in platform defaults")
+        return _index
+
+
+def _listen_forever():
+    """Reload on NOTIFY; poll the version counter as a fallback"""
+    backoff = 1
+    while True:
+        conn = _connect()
+        if not conn:
+            time.sleep(min(backoff, 60))
+            backoff *= 2
+            continue
+        backoff = 1
+        try:
+            conn.autocommit = True
+            conn.execute(f"LISTEN {PLATFORM_CONFIG['channel']}")
+            reload_registry()
+            while True:
+                notified = False
+                for _ in conn.notifies(timeout=PLATFORM_CONFIG['poll_seconds'], stop_after=1):
+                    notified = True
+                if notified:
+                    reload_registry()
+                    continue
+                with conn.cursor() as cursor:
+                    version = _read_version(cursor)
+                if version != _index.version:
+                    reload_registry()
+        except Exception as e:
+            logger.warning(f"Platform registry listener reconnecting: {e}")
+            time.sleep(1)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def init_registry(connect):
+    """Load the registry once and start the change listener"""
+    global _connect, _listener_thread
+    _connect = connect
+    reload_registry()
+    if PLATFORM_CONFIG['listen'] and _listener_thread is None:
+        _listener_thread = threading.Thread(target=_listen_forever, name='platform-registry', daemon=True)
+        _listener_thread.start()
+    return _index
@@ -0,0 +1,143 @@
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Profiling configuration
+PROFILE_CONFIG = {
+    'dir': os.getenv('PROFILE_DIR', './profiles'),
+    # Header that asks for a profile of a single request
+    'header': os.getenv('PROFILE_HEADER', 'X-Profile'),
+    # Required value of the header / admin token; empty disables header-triggered profiling
+    'token': os.getenv('PROFILE_TOKEN', ''),
+    # Sampling interval of the stack sampler
+    'interval': float(os.getenv('PROFILE_INTERVAL_MS', 5)) / 1000,
+    # Never profile more than this fraction of requests
+    'max_fraction': float(os.getenv('PROFILE_MAX_FRACTION', 0.05)),
+    # Keep at most this many profile files on disk
+    'max_files': int(os.getenv('PROFILE_MAX_FILES', 200)),
+}
+
+# Runtime state, changed through the admin toggle
+PROFILE_STATE = {
+    'enabled': False,       # profile requests without the header
+    'sample_rate': 0.01,    # fraction of requests to profile while enabled
+    'endpoints': None,      # optional list of endpoint names to restrict to
+}
+
+_lock = threading.Lock()
+_request_counter = itertools.count(1)
+_counts = {'seen': 0, 'profiled': 0}
+
+
+class StackSampler:
+    """Periodically samples one thread's stack and counts collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+
+def should_profile(headers, endpoint):
+    """Decide whether this request gets profiled; cheap when profiling is off"""
+    seen = next(_request_counter)
+    header_value = headers.get(PROFILE_CONFIG['header'])
+    requested_by_header = bool(header_value) and bool(PROFILE_CONFIG['token']) and header_value == PROFILE_CONFIG['token']
+    if not requested_by_header and not PROFILE_STATE['enabled']:
+        return False
+
+    with _lock:
+        _counts['seen'] = seen
+        if _counts['profiled'] + 1 > max(1, PROFILE_CONFIG['max_fraction'] * seen):
+            return False
+        if not requested_by_header:
+            endpoints = PROFILE_STATE['endpoints']
+            if endpoints and endpoint not in endpoints:
+                return False
+            if random.random() >= PROFILE_STATE['sample_rate']:
+                return False
+        _counts['profiled'] += 1
+    return True
+
+
+def start_profile():
+    """Start sampling the calling thread"""
+    sampler = StackSampler(threading.get_ident(), PROFILE_CONFIG['interval'])
+    sampler.start()
+    return sampler
+
+
+def finish_profile(sampler, endpoint, duration):
+    """Stop the sampler and write collapsed stacks to disk; returns the file path"""
+    stacks = sampler.stop()
+    if not stacks:
+        return None
+    os.makedirs(PROFILE_CONFIG['dir'], exist_ok=True)
+    filename = f"{int(time.time() * 1000)}_{endpoint or 'unknown'}_{int(duration * 1000)}ms_{uuid.uuid4().hex[:8]}.collapsed"
+    path = os.path.join(PROFILE_CONFIG['dir'], filename)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    os.replace(tmp_path, path)
+    rotate_profiles()
+    return path
+
+
+def rotate_profiles():
+    """Delete the oldest profile files beyond the configured maximum"""
+    try:
+        files = sorted(
+            (entry for entry in os.scandir(PROFILE_CONFIG['dir']) if entry.name.endswith('.collapsed')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+    except FileNotFoundError:
+        return
+    for entry in files[:max(0, len(files) - PROFILE_CONFIG['max_files'])]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """Return recent profile files, newest first"""
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_CONFIG['dir']) if entry.name.endswith('.collapsed')]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [{'file': entry.name, 'bytes': entry.stat().st_size} for entry in entries]
+
+
+def get_profile_stats():
+    """Counters for requests considered and profiled"""
+    with _lock:
+        return dict(_counts)
@@ -0,0 +1,396 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg.rows import dict_row
+
+import admission
+import image_encoding
+import platform_registry
+from logging_config import get_logger
+from metrics import counter
+
+logger = get_logger('creative_api.rendition_backfill')
+
+# Rendition backfill configuration
+BACKFILL_CONFIG = {
+    # Run the backfill loop in this worker (one worker at a time holds the advisory lock)
+    'enabled': os.getenv('BACKFILL_ENABLED', 'true').lower() == 'true',
+    # Queue a job whenever the platform registry version moves past the last backfilled one
+    'on_registry_change': os.getenv('BACKFILL_ON_REGISTRY_CHANGE', 'true').lower() == 'true',
+    # Creatives scanned per checkpoint
+    'batch_size': int(os.getenv('BACKFILL_BATCH_SIZE', 20)),
+    # Creatives rendered concurrently; kept apart from the ingest rendition pool
+    'workers': int(os.getenv('BACKFILL_WORKERS', 2)),
+    # Renditions started per second across the worker (0 = unthrottled)
+    'rate_per_second': float(os.getenv('BACKFILL_RATE_PER_SECOND', 2)),
+    # Idle poll for queued jobs and registry changes
+    'poll_seconds': float(os.getenv('BACKFILL_POLL_SECONDS', 30)),
+    # Wait this long between checks while live traffic is queueing or over budget
+    'busy_backoff_seconds': float(os.getenv('BACKFILL_BUSY_BACKOFF_SECONDS', 5)),
+    'lock_key': int(os.getenv('BACKFILL_LOCK_KEY', 727001)),
+}
+
+JOB_STATUSES = ('pending', 'running', 'done', 'cancelled')
+
+BACKFILL_SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS rendition_backfill (
+        job_id BIGSERIAL PRIMARY KEY,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        registry_version BIGINT,
+        platforms JSONB,
+        last_creative_id BIGINT NOT NULL DEFAULT 0,
+        creatives_scanned BIGINT NOT NULL DEFAULT 0,
+        renditions_done BIGINT NOT NULL DEFAULT 0,
+        renditions_failed BIGINT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    """,
+]
+
+# Renditions already stored per creative as {platform: {dimension: format}}, without the blobs;
+# only entries that reached S3 count
+STORED_RENDITIONS_SQL = """
+SELECT creative_id, created_at, creative_s3_url, selected_platforms, focal_point,
+       COALESCE((
+           SELECT jsonb_object_agg(p.key, (
+               SELECT COALESCE(jsonb_object_agg(d.key, d.value ->> 'format'), '{}'::jsonb)
+               FROM jsonb_each(p.value) d
+               WHERE jsonb_typeof(d.value) = 'object' AND d.value ? 's3_url'
+           ))
+           FROM jsonb_each(CASE WHEN jsonb_typeof(image_data) = 'object' THEN image_data ELSE '{}'::jsonb END) p
+           WHERE jsonb_typeof(p.value) = 'object'
+       ), '{}'::jsonb) AS renditions
+FROM creative_new
+WHERE creative_id > %s AND creative_s3_url IS NOT NULL AND creative_s3_url <> ''
+ORDER BY creative_id
+LIMIT %s
+"""
+
+# Merge new renditions into image_data in place, so concurrent edits to other platforms survive
+MERGE_RENDITIONS_SQL = """
+UPDATE creative_new AS c
+SET image_data = CASE WHEN jsonb_typeof(c.image_data) = 'object' THEN c.image_data ELSE '{}'::jsonb END || (
+    SELECT jsonb_object_agg(p.key, CASE WHEN jsonb_typeof(c.image_data -> p.key) = 'object'
+                                        THEN c.image_data -> p.key ELSE '{}'::jsonb END || p.value)
+    FROM jsonb_each(%s::jsonb) p
+)
+WHERE creative_id = %s
+"""
+
+# created_at pins the update to the creative's partition (it is only NULL on an unpartitioned table)
+MERGE_RENDITIONS_PINNED_SQL = MERGE_RENDITIONS_SQL.rstrip() + " AND created_at = %s\n"
+
+CHECKPOINT_SQL = """
+UPDATE rendition_backfill
+SET last_creative_id = %s,
+    creatives_scanned = creatives_scanned + %s,
+    renditions_done = renditions_done + %s,
+    renditions_failed = renditions_failed + %s,
+    updated_at = CURRENT_TIMESTAMP
+WHERE job_id = %s AND status = 'running'
+RETURNING job_id
+"""
+
+JOB_COLUMNS = """
+job_id, status, registry_version, platforms, last_creative_id, creatives_scanned,
+renditions_done, renditions_failed, created_at, updated_at, finished_at
+"""
+
+BACKFILL_RENDITIONS = counter('backfill_renditions_total', 'Renditions produced by the backfill by result')
+
+BACKFILL_POOL = ThreadPoolExecutor(max_workers=BACKFILL_CONFIG['workers'], thread_name_prefix='backfill')
+
+
+class RateLimiter:
+    """Token bucket: acquire(n) blocks until n tokens are available; rate 0 never blocks"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Go into debt for large requests and sleep it off, so a creative needing more
+            # renditions than the bucket holds still gets through
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+_connect = None
+_render = None
+_runner_thread = None
+_limiter = RateLimiter(BACKFILL_CONFIG['rate_per_second'])
+_wake = threading.Event()
+_state = {'job_id': None, 'last_creative_id': None, 'paused': False, 'last_error': None, 'auto_queue': True}
+
+
+def ensure_backfill_schema(cursor):
+    """Create the job/checkpoint table"""
+    for statement in BACKFILL_SCHEMA_SQL:
+        cursor.execute(statement)
+
+
+def missing_renditions(creative, registry, platforms=None):
+    """
+    {platform: [dimension]} registered for the creative's selected platforms but not stored
+    with an S3 URL in the platform's current output format
+    """
+    selected = creative.get('selected_platforms')
+    if isinstance(selected, str):
+        try:
+            selected = json.loads(selected)
+        except ValueError:
+            selected = None
+    if not isinstance(selected, list):
+        return {}
+    if platforms:
+        wanted = {name.strip().lower() for name in platforms}
+        selected = [name for name in selected if isinstance(name, str) and name.strip().lower() in wanted]
+    stored = creative.get('renditions') or {}
+    missing = {}
+    for platform in selected:
+        dimensions = registry.dimensions(platform)
+        if not dimensions:
+            continue
+        output_format = image_encoding.OUTPUT_FORMATS[image_encoding.platform_format(platform)][0]
+        have = stored.get(platform) or {}
+        needed = [dimension for dimension in dimensions if have.get(dimension) != output_format]
+        if needed:
+            missing[platform] = needed
+    return missing
+
+
+def queue_job(conn, platforms=None, registry_version=None):
+    """Insert a pending job; returns its row"""
+    with conn.cursor(row_factory=dict_row) as cursor:
+        cursor.execute(
+            f"INSERT INTO rendition_backfill (registry_version, platforms) VALUES (%s, %s) RETURNING {JOB_COLUMNS}",
+            (registry_version, json.dumps(platforms) if platforms else None)
+        )
+        job = cursor.fetchone()
+    conn.commit()
+    _wake.set()
+    return job
+
+
+def cancel_job(conn, job_id):
+    """Cancel a pending or running job; the runner stops at its next checkpoint. Returns True if changed"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE rendition_backfill SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP, "
+            "updated_at = CURRENT_TIMESTAMP WHERE job_id = %s AND status IN ('pending', 'running')",
+            (job_id,)
+        )
+        changed = cursor.rowcount > 0
+    conn.commit()
+    return changed
+
+
+def list_jobs(conn, limit=20):
+    with conn.cursor(row_factory=dict_row) as cursor:
+        cursor.execute(f"SELECT {JOB_COLUMNS} FROM rendition_backfill ORDER BY job_id DESC LIMIT %s", (limit,))
+        jobs = cursor.fetchall()
+    conn.rollback()
+    return jobs
+
+
+def _queue_for_registry(conn):
+    """Queue a job when the loaded registry is newer than anything already backfilled"""
+    registry = platform_registry.get_registry()
+    if registry.source != 'database':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(registry_version), -1) FROM rendition_backfill")
+        latest = cursor.fetchone()[0]
+    conn.commit()
+    if registry.version > latest:
+        job = queue_job(conn, registry_version=registry.version)
+        logger.info(f"Queued rendition backfill job {job['job_id']} for platform registry version {registry.version}")
+
+
+def _next_job(conn):
+    """Oldest unfinished job, marked running; an interrupted 'running' job resumes from its checkpoint"""
+    with conn.cursor(row_factory=dict_row) as cursor:
+        cursor.execute(
+            f"UPDATE rendition_backfill SET status = 'running', updated_at = CURRENT_TIMESTAMP "
+            f"WHERE job_id = (SELECT job_id FROM rendition_backfill WHERE status IN ('pending', 'running') "
+            f"ORDER BY job_id LIMIT 1) RETURNING {JOB_COLUMNS}"
+        )
+        job = cursor.fetchone()
+    conn.commit()
+    return job
+
+
+def _live_traffic_busy():
+    """True while the process is over its resource budget or live requests are queueing for a slot"""
+    if admission.over_budget():
+        return True
+    return any(gate.waiting > 0 for gate in admission.GATES.values())
+
+
+def _render_one(creative, missing):
+    try:
+        return _render(creative, missing), None
+    except Exception as e:
+        return {}, e
+
+
+def _run_batch(conn, job, creatives, registry):
+    """Render the batch's missing renditions in parallel, then store them and the checkpoint in one transaction"""
+    futures = []
+    for creative in creatives:
+        missing = missing_renditions(creative, registry, job['platforms'])
+        if not missing:
+            continue
+        _limiter.acquire(sum(len(dimensions) for dimensions in missing.values()))
+        futures.append((creative, missing, BACKFILL_POOL.submit(_render_one, creative, missing)))
+
+    updates = []
+    done = failed = 0
+    for creative, missing, future in futures:
+        renditions, error = future.result()
+        wanted = sum(len(dimensions) for dimensions in missing.values())
+        produced = sum(len(dimensions) for dimensions in renditions.values())
+        if error is not None:
+            logger.warning(f"Backfill of creative {creative['creative_id']} failed: {error}")
+        done += produced
+        failed += wanted - produced
+        if renditions:
+            updates.append((json.dumps(renditions), creative['creative_id'], creative['created_at']))
+    BACKFILL_RENDITIONS.inc(done, result='rendered')
+    BACKFILL_RENDITIONS.inc(failed, result='failed')
+
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            pinned = [update for update in updates if update[2] is not None]
+            if pinned:
+                cursor.executemany(MERGE_RENDITIONS_PINNED_SQL, pinned)
+            unpinned = [update[:2] for update in updates if update[2] is None]
+            if unpinned:
+                cursor.executemany(MERGE_RENDITIONS_SQL, unpinned)
+            cursor.execute(CHECKPOINT_SQL, (creatives[-1]['creative_id'], len(creatives), done, failed, job['job_id']))
+            still_running = cursor.fetchone() is not None
+    return still_running
+
+
+def run_job(conn, job):
+    """Work through creatives above the job's checkpoint until none are left or the job is cancelled"""
+    _state['job_id'] = job['job_id']
+    last_creative_id = job['last_creative_id']
+    logger.info(f"Rendition backfill job {job['job_id']} starting after creative {last_creative_id}")
+    try:
+        while True:
+            while _live_traffic_busy():
+                _state['paused'] = True
+                time.sleep(BACKFILL_CONFIG['busy_backoff_seconds'])
+            _state['paused'] = False
+
+            with conn.cursor(row_factory=dict_row) as cursor:
+                cursor.execute(STORED_RENDITIONS_SQL, (last_creative_id, BACKFILL_CONFIG['batch_size']))
+                creatives = cursor.fetchall()
+            conn.commit()
+            if not creatives:
+                break
+            # Registry read per batch so spec changes mid-run apply to the rest of the scan
+            if not _run_batch(conn, job, creatives, platform_registry.get_registry()):
+                logger.info(f"Rendition backfill job {job['job_id']} was cancelled")
+                return
+            last_creative_id = creatives[-1]['creative_id']
+            _state['last_creative_id'] = last_creative_id
+
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE rendition_backfill SET status = 'done', finished_at = CURRENT_TIMESTAMP, "
+                "updated_at = CURRENT_TIMESTAMP WHERE job_id = %s AND status = 'running'",
+                (job['job_id'],)
+            )
+        conn.commit()
+        logger.info(f"Rendition backfill job {job['job_id']} finished at creative {last_creative_id}")
+    finally:
+        _state['job_id'] = None
+
+
+def run_pending(conn):
+    """
+    Run queued jobs to completion if this session wins the backfill advisory lock.
+    Returns False when another worker holds it.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (BACKFILL_CONFIG['lock_key'],))
+        locked = cursor.fetchone()[0]
+    conn.commit()
+    if not locked:
+        return False
+    try:
+        if BACKFILL_CONFIG['on_registry_change'] and _state['auto_queue']:
+            _queue_for_registry(conn)
+        while True:
+            job = _next_job(conn)
+            if job is None:
+                return True
+            run_job(conn, job)
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (BACKFILL_CONFIG['lock_key'],))
+        conn.commit()
+
+
+def _run_forever():
+    while True:
+        conn = _connect()
+        if conn:
+            try:
+                run_pending(conn)
+                _state['last_error'] = None
+            except Exception as e:
+                _state['last_error'] = str(e)
+                logger.error(f"Rendition backfill error: {e}")
+            finally:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        _wake.wait(BACKFILL_CONFIG['poll_seconds'])
+        _wake.clear()
+
+
+def init_backfill(connect, render, auto_queue=True):
+    """
+    Set the connection factory and the render step, and start the backfill loop.
+    render(creative, missing) downloads creative['creative_s3_url'] and returns
+    {platform: {dimension: image_object}} for the renditions it uploaded.
+    auto_queue=False only runs jobs queued explicitly (e.g. when renditions are not prerendered).
+    """
+    global _connect, _render, _runner_thread
+    _connect = connect
+    _render = render
+    _state['auto_queue'] = auto_queue
+    if BACKFILL_CONFIG['enabled'] and _runner_thread is None:
+        _runner_thread = threading.Thread(target=_run_forever, name='rendition-backfill', daemon=True)
+        _runner_thread.start()
+
+
+def get_stats():
+    return {
+        'enabled': BACKFILL_CONFIG['enabled'],
+        'running_job_id': _state['job_id'],
+        'last_creative_id': _state['last_creative_id'],
+        'paused_for_traffic': _state['paused'],
+        'last_error': _state['last_error'],
+    }
@@ -0,0 +1,204 @@
+import os
+import zlib
+
+from logging_config import get_logger
+from metrics import counter
+
+logger = get_logger('creative_api.response_pipeline')
+
+# Optional encoders beyond gzip
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+# Response compression configuration
+RESPONSE_CONFIG = {
+    'compression_enabled': os.getenv('RESPONSE_COMPRESSION_ENABLED', 'true').lower() == 'true',
+    # Server preference among the encodings the client accepts
+    'encodings': [e.strip() for e in os.getenv('RESPONSE_COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',') if e.strip()],
+    # Buffered bodies smaller than this go out uncompressed
+    'min_bytes': int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', 1024)),
+    'gzip_level': int(os.getenv('RESPONSE_GZIP_LEVEL', 6)),
+    # Low brotli/zstd levels: dynamic responses are compressed on every request
+    'brotli_quality': int(os.getenv('RESPONSE_BROTLI_QUALITY', 4)),
+    'zstd_level': int(os.getenv('RESPONSE_ZSTD_LEVEL', 3)),
+}
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'application/javascript', 'text/csv',
+    'text/plain', 'text/html', 'text/css', 'image/svg+xml',
+}
+
+RESPONSE_BYTES = counter('response_bytes_total', 'Response body bytes before and after compression by encoding')
+
+
+def available_encodings():
+    available = {'gzip'}
+    if BROTLI_AVAILABLE:
+        available.add('br')
+    if ZSTD_AVAILABLE:
+        available.add('zstd')
+    return [encoding for encoding in RESPONSE_CONFIG['encodings'] if encoding in available]
+
+
+def negotiate(accept_encoding):
+    """Best encoding the client accepts (q > 0), in server preference order, or None"""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+class Compressor:
+    """Incremental compressor with a common compress/flush/finish interface"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._gzip = zlib.compressobj(RESPONSE_CONFIG['gzip_level'], zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self._brotli = brotli.Compressor(quality=RESPONSE_CONFIG['brotli_quality'])
+        elif encoding == 'zstd':
+            self._zstd = zstandard.ZstdCompressor(level=RESPONSE_CONFIG['zstd_level']).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def compress(self, data):
+        if self.encoding == 'gzip':
+            return self._gzip.compress(data)
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zstd.compress(data)
+
+    def flush(self):
+        """Emit everything buffered so far without ending the stream"""
+        if self.encoding == 'gzip':
+            return self._gzip.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self._brotli.flush()
+        return self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == 'gzip':
+            return self._gzip.flush()
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zstd.flush()
+
+
+def compress_bytes(data, encoding):
+    compressor = Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compress an iterable of byte chunks as they come. The first chunk is flushed straight away
+    so the client sees the start of the body without waiting for the compressor's buffer to fill.
+    """
+    compressor = Compressor(encoding)
+    raw = sent = 0
+    first = True
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            raw += len(chunk)
+            output = compressor.compress(chunk)
+            if first:
+                output += compressor.flush()
+                first = False
+            if output:
+                sent += len(output)
+                yield output
+        output = compressor.finish()
+        sent += len(output)
+        yield output
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        RESPONSE_BYTES.inc(raw, encoding=encoding, stage='raw')
+        RESPONSE_BYTES.inc(sent, encoding=encoding, stage='sent')
+
+
+def exempt(response):
+    """Leave this response uncompressed (e.g. the client asked for raw bytes)"""
+    response.skip_compression = True
+    return response
+
+
+def _vary(response):
+    vary = response.headers.get('Vary', '')
+    if 'accept-encoding' not in vary.lower():
+        response.headers['Vary'] = f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'
+
+
+def compress_response(response, accept_encoding):
+    """after_request step: compress eligible bodies with the negotiated encoding"""
+    if not RESPONSE_CONFIG['compression_enabled'] or getattr(response, 'skip_compression', False):
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    _vary(response)
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+    try:
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < RESPONSE_CONFIG['min_bytes']:
+                return response
+            compressed = compress_bytes(data, encoding)
+            RESPONSE_BYTES.inc(len(data), encoding=encoding, stage='raw')
+            RESPONSE_BYTES.inc(len(compressed), encoding=encoding, stage='sent')
+            response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+    except Exception as e:
+        logger.error(f"Response compression failed, sending uncompressed: {e}")
+    return response
+
+
+def json_stream(head, list_key, items, dumps):
+    """
+    Serialize {**head, list_key: items} one item at a time so the first bytes leave before the
+    last item is encoded. Items are dropped from the list as they are written.
+    """
+    prefix = dumps(head)
+    prefix = prefix[:-1] + (',' if head else '') + f'"{list_key}":['
+    yield prefix.encode('utf-8')
+    for index in range(len(items)):
+        item, items[index] = items[index], None
+        yield ((',' if index else '') + dumps(item)).encode('utf-8')
+    yield b']}'
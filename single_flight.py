@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from logging_config import get_logger
+from metrics import counter
+
+logger = get_logger('creative_api.single_flight')
+
+# Optional Redis for de-duplication across worker processes
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis = None
+    REDIS_AVAILABLE = False
+
+# Single-flight configuration
+SINGLE_FLIGHT_CONFIG = {
+    'enabled': os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true',
+    # Unset: duplicates are only collapsed within this process
+    'redis_url': os.getenv('SINGLE_FLIGHT_REDIS_URL') or os.getenv('REDIS_URL'),
+    # Upper bound on one leader's work; the lock expires after this if the worker dies
+    'lock_seconds': float(os.getenv('SINGLE_FLIGHT_LOCK_SECONDS', 180)),
+    # How long a finished result stays readable for waiters in other workers
+    'result_seconds': float(os.getenv('SINGLE_FLIGHT_RESULT_SECONDS', 15)),
+    'poll_seconds': float(os.getenv('SINGLE_FLIGHT_POLL_SECONDS', 0.1)),
+    'key_prefix': os.getenv('SINGLE_FLIGHT_KEY_PREFIX', 'single_flight'),
+}
+
+SINGLE_FLIGHT_CALLS = counter('single_flight_calls_total', 'Single-flight calls by operation and role')
+
+# Compare-and-delete so a leader never releases a lock it no longer owns
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def request_key(operation, payload):
+    """Stable key for a normalized request payload"""
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return f"{operation}:{hashlib.sha256(body.encode('utf-8')).hexdigest()}"
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls: the first caller runs fn, duplicates wait for its result.
+    Within a process duplicates wait on an Event; across processes the leader holds a Redis lock
+    and publishes its (JSON-serializable) result for a short time.
+    """
+
+    def __init__(self, config=SINGLE_FLIGHT_CONFIG):
+        self.config = config
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        if config['redis_url'] and REDIS_AVAILABLE:
+            try:
+                self._redis = redis.Redis.from_url(config['redis_url'], socket_timeout=2)
+                self._redis.ping()
+                self._release = self._redis.register_script(RELEASE_SCRIPT)
+            except Exception as e:
+                logger.warning(f"Single-flight Redis unavailable, de-duplicating per process only: {e}")
+                self._redis = None
+        elif config['redis_url']:
+            logger.warning("redis package not installed, de-duplicating per process only")
+
+    def do(self, key, fn):
+        """
+        Run fn() once for all concurrent callers with the same key.
+        Returns (result, shared) where shared is True when the result came from another caller.
+        """
+        if not self.config['enabled']:
+            return fn(), False
+        operation = key.split(':', 1)[0]
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            SINGLE_FLIGHT_CALLS.inc(operation=operation, role='follower')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_across_workers(key, operation, fn)
+            return call.result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run_across_workers(self, key, operation, fn):
+        if self._redis is None:
+            SINGLE_FLIGHT_CALLS.inc(operation=operation, role='leader')
+            return fn(), False
+
+        lock_key = f"{self.config['key_prefix']}:lock:{key}"
+        result_key = f"{self.config['key_prefix']}:result:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.config['lock_seconds']
+        waited = False
+        try:
+            while True:
+                # Once we have waited on another worker, its published result wins over re-running
+                if waited:
+                    cached = self._redis.get(result_key)
+                    if cached is not None:
+                        SINGLE_FLIGHT_CALLS.inc(operation=operation, role='remote_follower')
+                        return json.loads(cached), True
+                if self._redis.set(lock_key, token, nx=True, px=int(self.config['lock_seconds'] * 1000)):
+                    break
+                # Another worker is leading: poll for its result until its lock goes away
+                waited = True
+                if time.monotonic() > deadline:
+                    logger.warning(f"Single-flight wait timed out for {operation}, running locally")
+                    SINGLE_FLIGHT_CALLS.inc(operation=operation, role='timeout')
+                    return fn(), False
+                time.sleep(self.config['poll_seconds'])
+        except redis.RedisError as e:
+            logger.warning(f"Single-flight Redis error, running without cross-worker lock: {e}")
+            SINGLE_FLIGHT_CALLS.inc(operation=operation, role='leader')
+            return fn(), False
+
+        SINGLE_FLIGHT_CALLS.inc(operation=operation, role='leader')
+        try:
+            result = fn()
+            try:
+                self._redis.set(result_key, json.dumps(result), px=int(self.config['result_seconds'] * 1000))
+            except (redis.RedisError, TypeError, ValueError) as e:
+                logger.warning(f"Could not publish single-flight result for {operation}: {e}")
+            return result, False
+        finally:
+            try:
+                self._release(keys=[lock_key], args=[token])
+            except redis.RedisError:
+                pass
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+_single_flight = SingleFlight()
+
+
+def do(key, fn):
+    """Run fn() once per key across concurrent callers; see SingleFlight.do"""
+    return _single_flight.do(key, fn)
+
+
+def in_flight():
+    return _single_flight.in_flight()
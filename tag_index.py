@@ -0,0 +1,324 @@
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+
+from logging_config import get_logger
+
+logger = get_logger('creative_api.tag_index')
+
+# Ad-serving snapshot configuration
+TAG_INDEX_CONFIG = {
+    # Serve /creative from the in-memory index instead of querying Postgres
+    'enabled': os.getenv('TAG_INDEX_ENABLED', 'false').lower() == 'true',
+    'channel': os.getenv('TAG_INDEX_NOTIFY_CHANNEL', 'creative_changed'),
+    'case_sensitive': os.getenv('TAG_INDEX_CASE_SENSITIVE', 'false').lower() == 'true',
+    # Full rebuild interval, heals any notifications missed while disconnected
+    'rebuild_seconds': float(os.getenv('TAG_INDEX_REBUILD_SECONDS', 900)),
+    # Notifications are applied in batches of up to this many ids
+    'batch_size': int(os.getenv('TAG_INDEX_BATCH_SIZE', 500)),
+}
+
+# Row-level trigger: notify the creative id and operation on every change that affects serving
+TAG_INDEX_SCHEMA_SQL = [
+    """
+    CREATE OR REPLACE FUNCTION creative_changed_notify() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('{channel}', 'D' || OLD.creative_id::text);
+        ELSE
+            PERFORM pg_notify('{channel}', 'U' || NEW.creative_id::text);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS creative_changed ON creative_new",
+    """
+    CREATE TRIGGER creative_changed
+    AFTER INSERT OR DELETE OR UPDATE OF tags, creative_s3_url ON creative_new
+    FOR EACH ROW EXECUTE FUNCTION creative_changed_notify()
+    """,
+]
+
+SNAPSHOT_QUERY = "SELECT creative_id, creative_s3_url, tags FROM creative_new"
+
+
+def normalize_tag(tag):
+    tag = str(tag).strip()
+    return tag if TAG_INDEX_CONFIG['case_sensitive'] else tag.lower()
+
+
+def parse_tags(value):
+    """Tags column (JSONB list, JSON text or plain string) -> tuple of normalized tags"""
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = [value]
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        return ()
+    return tuple(dict.fromkeys(normalize_tag(tag) for tag in value if isinstance(tag, (str, int)) and str(tag).strip()))
+
+
+class TagIndex:
+    """
+    Inverted index tag -> sorted array of creative ids, plus id -> url and id -> tags tables.
+    Posting arrays are replaced, never mutated in place, so readers need no lock.
+    """
+
+    def __init__(self, rows=()):
+        postings = {}
+        self.urls = {}
+        self.tags_by_id = {}
+        for creative_id, url, tags in rows:
+            tags = parse_tags(tags)
+            self.urls[creative_id] = url or ''
+            self.tags_by_id[creative_id] = tags
+            for tag in tags:
+                postings.setdefault(tag, []).append(creative_id)
+        self.postings = {tag: array('q', sorted(ids)) for tag, ids in postings.items()}
+        self.built_at = time.time()
+        self.updated_at = self.built_at
+
+    def lookup(self, tags, limit=10):
+        """[(creative_id, url)] for creatives carrying every tag, lowest ids first"""
+        lists = []
+        for tag in tags:
+            ids = self.postings.get(normalize_tag(tag))
+            if not ids:
+                return []
+            lists.append(ids)
+        if not lists:
+            return []
+        lists.sort(key=len)
+        smallest, others = lists[0], lists[1:]
+        results = []
+        for creative_id in smallest:
+            if all(_contains(ids, creative_id) for ids in others):
+                url = self.urls.get(creative_id)
+                if url is not None:
+                    results.append((creative_id, url))
+                    if len(results) >= limit:
+                        break
+        return results
+
+    def _remove_posting(self, tag, creative_id):
+        ids = self.postings.get(tag)
+        if ids is None:
+            return
+        position = bisect.bisect_left(ids, creative_id)
+        if position < len(ids) and ids[position] == creative_id:
+            updated = ids[:position] + ids[position + 1:]
+            if updated:
+                self.postings[tag] = updated
+            else:
+                del self.postings[tag]
+
+    def _add_posting(self, tag, creative_id):
+        ids = self.postings.get(tag)
+        if ids is None:
+            self.postings[tag] = array('q', [creative_id])
+            return
+        position = bisect.bisect_left(ids, creative_id)
+        if position < len(ids) and ids[position] == creative_id:
+            return
+        updated = array('q', ids)
+        updated.insert(position, creative_id)
+        self.postings[tag] = updated
+
+    def upsert(self, creative_id, url, tags):
+        tags = parse_tags(tags)
+        old_tags = self.tags_by_id.get(creative_id, ())
+        for tag in old_tags:
+            if tag not in tags:
+                self._remove_posting(tag, creative_id)
+        for tag in tags:
+            if tag not in old_tags:
+                self._add_posting(tag, creative_id)
+        self.tags_by_id[creative_id] = tags
+        self.urls[creative_id] = url or ''
+        self.updated_at = time.time()
+
+    def delete(self, creative_id):
+        for tag in self.tags_by_id.pop(creative_id, ()):
+            self._remove_posting(tag, creative_id)
+        self.urls.pop(creative_id, None)
+        self.updated_at = time.time()
+
+    def memory_bytes(self):
+        """Approximate memory held by the index structures"""
+        total = sys.getsizeof(self.postings) + sys.getsizeof(self.urls) + sys.getsizeof(self.tags_by_id)
+        for tag, ids in self.postings.items():
+            total += sys.getsizeof(tag) + sys.getsizeof(ids)
+        for url in self.urls.values():
+            total += sys.getsizeof(url)
+        for tags in self.tags_by_id.values():
+            total += sys.getsizeof(tags)
+        return total
+
+    def stats(self):
+        return {
+            'creatives': len(self.urls),
+            'tags': len(self.postings),
+            'postings': sum(len(ids) for ids in self.postings.values()),
+            'built_at': self.built_at,
+            'updated_at': self.updated_at,
+        }
+
+
+def _contains(ids, creative_id):
+    position = bisect.bisect_left(ids, creative_id)
+    return position < len(ids) and ids[position] == creative_id
+
+
+_index = None
+_connect = None
+_listener_thread = None
+_write_lock = threading.Lock()
+_memory = {'bytes': 0, 'measured_at': 0.0}
+
+
+def get_index():
+    """Current snapshot, or None before the first build"""
+    return _index
+
+
+def ensure_tag_index_schema(cursor):
+    """Create the NOTIFY trigger on creative_new"""
+    for statement in TAG_INDEX_SCHEMA_SQL:
+        cursor.execute(statement.replace('{channel}', TAG_INDEX_CONFIG['channel']))
+
+
+def rebuild_index():
+    """Load creative_new into a fresh index and swap it in"""
+    global _index
+    conn = _connect()
+    if not conn:
+        return _index
+    try:
+        start = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute(SNAPSHOT_QUERY)
+            index = TagIndex(cursor)
+        conn.rollback()
+    except Exception as e:
+        logger.error(f"Error building tag index: {e}")
+        return _index
+    finally:
+        conn.close()
+    with _write_lock:
+        _index = index
+    _memory['bytes'] = index.memory_bytes()
+    _memory['measured_at'] = time.time()
+    stats = index.stats()
+    logger.info(f"Built tag index: {stats['creatives']} creatives, {stats['tags']} tags, "
+                f"{_memory['bytes'] / 1024:.0f} KiB in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return index
+
+
+def apply_changes(cursor, changes):
+    """Apply {creative_id: 'U'|'D'} to the current index with one query for the upserts"""
+    index = _index
+    if index is None:
+        return
+    upserts = [creative_id for creative_id, op in changes.items() if op == 'U']
+    rows = []
+    if upserts:
+        cursor.execute(SNAPSHOT_QUERY + " WHERE creative_id = ANY(%s)", (upserts,))
+        rows = cursor.fetchall()
+    found = set()
+    with _write_lock:
+        for creative_id, url, tags in rows:
+            index.upsert(creative_id, url, tags)
+            found.add(creative_id)
+        for creative_id, op in changes.items():
+            # Updated rows that are gone by now were deleted in the meantime
+            if op == 'D' or creative_id not in found:
+                index.delete(creative_id)
+
+
+def request_rebuild(cursor):
+    """Ask every worker's listener to rebuild (after bulk removals such as archiving partitions)"""
+    cursor.execute("SELECT pg_notify(%s, 'R')", (TAG_INDEX_CONFIG['channel'],))
+
+
+def _collect(changes, payload):
+    if payload == 'R':
+        changes['rebuild'] = True
+        return
+    op, creative_id = payload[:1], payload[1:]
+    if op in ('U', 'D') and creative_id.isdigit():
+        changes[int(creative_id)] = op
+
+
+def _listen_forever():
+    """Apply NOTIFY batches; rebuild on (re)connect and periodically"""
+    backoff = 1
+    while True:
+        conn = _connect()
+        if not conn:
+            time.sleep(min(backoff, 60))
+            backoff *= 2
+            continue
+        backoff = 1
+        try:
+            conn.autocommit = True
+            conn.execute(f"LISTEN {TAG_INDEX_CONFIG['channel']}")
+            # Anything committed before LISTEN took effect is picked up by the rebuild
+            rebuild_index()
+            next_rebuild = time.monotonic() + TAG_INDEX_CONFIG['rebuild_seconds']
+            while True:
+                changes = {}
+                # Block for the first notification, then drain whatever else is already queued
+                timeout = max(0.1, next_rebuild - time.monotonic())
+                for notify in conn.notifies(timeout=timeout, stop_after=1):
+                    _collect(changes, notify.payload)
+                if changes:
+                    for notify in conn.notifies(timeout=0.05, stop_after=TAG_INDEX_CONFIG['batch_size']):
+                        _collect(changes, notify.payload)
+                    if changes.pop('rebuild', False):
+                        next_rebuild = time.monotonic()
+                    elif changes:
+                        with conn.cursor() as cursor:
+                            apply_changes(cursor, changes)
+                if time.monotonic() >= next_rebuild:
+                    rebuild_index()
+                    next_rebuild = time.monotonic() + TAG_INDEX_CONFIG['rebuild_seconds']
+        except Exception as e:
+            logger.warning(f"Tag index listener reconnecting: {e}")
+            time.sleep(1)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def init_tag_index(connect):
+    """Build the index and start the change listener (only in snapshot mode)"""
+    global _connect, _listener_thread
+    _connect = connect
+    if not TAG_INDEX_CONFIG['enabled'] or _listener_thread is not None:
+        return _index
+    _listener_thread = threading.Thread(target=_listen_forever, name='tag-index', daemon=True)
+    _listener_thread.start()
+    return _index
+
+
+def get_stats():
+    index = _index
+    if index is None:
+        return {'enabled': TAG_INDEX_CONFIG['enabled'], 'ready': False}
+    # Re-measure memory at most once a minute; it walks every entry
+    if time.time() - _memory['measured_at'] > 60:
+        _memory['bytes'] = index.memory_bytes()
+        _memory['measured_at'] = time.time()
+    return dict(index.stats(), enabled=TAG_INDEX_CONFIG['enabled'], ready=True, memory_bytes=_memory['bytes'])
@@ -1,7 +1,14 @@
-import psycopg
+import argparse
+import csv
+import json
 import os
+import time
+
+import psycopg
 from dotenv import load_dotenv
 
+from platform_registry import DEFAULT_PLATFORMS, parse_dimension
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -26,50 +33,164 @@ def get_db_connection():
         print(f"Database connection error: {e}")
         return None
 
-def upload_platforms():
+def load_platform_spec(path):
+    """
+    Load (platform_name, dimension) pairs from a spec file.
+    JSON: [{"platform_name": "Facebook", "dimension": "1080x1080"}, ...] or {"Facebook": ["1080x1080", ...]}
+    CSV: header row with platform_name,dimension
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, newline='') as f:
+            return [(row['platform_name'], row['dimension']) for row in csv.DictReader(f)]
+
+    with open(path) as f:
+        spec = json.load(f)
+    if isinstance(spec, dict):
+        return [(name, dimension) for name, dimensions in spec.items() for dimension in dimensions]
+    return [(item['platform_name'], item['dimension']) for item in spec]
+
+def normalize_spec(rows):
+    """Trim names, normalize dimensions to WxH and drop duplicates; raises on malformed rows"""
+    normalized = []
+    seen = set()
+    for platform_name, dimension in rows:
+        parsed = parse_dimension(dimension)
+        if not platform_name or not platform_name.strip() or parsed is None:
+            raise ValueError(f"Invalid platform spec row: {platform_name!r}, {dimension!r}")
+        row = (platform_name.strip(), f"{parsed[0]}x{parsed[1]}")
+        if row not in seen:
+            seen.add(row)
+            normalized.append(row)
+    return normalized
+
+def ensure_platform_key(cursor):
+    """Remove duplicate rows and add the unique (platform_name, dimension) key used for upserts"""
+    cursor.execute("SELECT to_regclass('platform_name_dimension_key') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        # The key already rules out duplicates; don't touch the table
+        return
+    cursor.execute("""
+        DELETE FROM platform a
+        USING platform b
+        WHERE a.platform_name = b.platform_name
+          AND a.dimension IS NOT DISTINCT FROM b.dimension
+          AND a.platform_id > b.platform_id
+    """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS platform_name_dimension_key
+        ON platform (platform_name, dimension)
+    """)
+
+def sync_platforms(rows, prune=False, dry_run=False):
+    """
+    Bring the platform table in line with the spec in one transaction.
+    Rows are streamed with COPY into a temp table and upserted with ON CONFLICT,
+    so readers never see an empty table. With prune, rows missing from the spec are deleted.
+    Only the diff is written, so re-syncing an unchanged spec leaves the registry version alone.
+    Returns {"added": [...], "removed": [...], "unchanged": n}
+    """
+    rows = normalize_spec(rows)
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+
+    try:
+        with conn.transaction():
+            cursor = conn.cursor()
+            ensure_platform_key(cursor)
+
+            cursor.execute("""
+                CREATE TEMP TABLE platform_spec (
+                    platform_name VARCHAR(255) NOT NULL,
+                    dimension VARCHAR(100) NOT NULL
+                ) ON COMMIT DROP
+            """)
+            with cursor.copy("COPY platform_spec (platform_name, dimension) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+
+            cursor.execute("""
+                SELECT s.platform_name, s.dimension
+                FROM platform_spec s
+                LEFT JOIN platform p USING (platform_name, dimension)
+                WHERE p.platform_id IS NULL
+                ORDER BY 1, 2
+            """)
+            added = cursor.fetchall()
+
+            cursor.execute("""
+                SELECT p.platform_name, p.dimension
+                FROM platform p
+                LEFT JOIN platform_spec s USING (platform_name, dimension)
+                WHERE s.platform_name IS NULL
+                ORDER BY 1, 2
+            """)
+            missing = cursor.fetchall()
+            removed = missing if prune else []
+
+            if not dry_run:
+                if added:
+                    cursor.execute("""
+                        INSERT INTO platform (platform_name, dimension)
+                        SELECT s.platform_name, s.dimension
+                        FROM platform_spec s
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM platform p
+                            WHERE p.platform_name = s.platform_name AND p.dimension = s.dimension
+                        )
+                        ON CONFLICT (platform_name, dimension) DO NOTHING
+                    """)
+                if removed:
+                    cursor.execute("""
+                        DELETE FROM platform p
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM platform_spec s
+                            WHERE s.platform_name = p.platform_name AND s.dimension = p.dimension
+                        )
+                    """)
+            else:
+                # Leave the table (and the new key) exactly as it was
+                raise psycopg.Rollback()
+    finally:
+        conn.close()
+
+    return {
+        'added': [list(row) for row in added],
+        'removed': [list(row) for row in removed],
+        'kept_not_in_spec': [] if prune else [list(row) for row in missing],
+        'unchanged': len(rows) - len(added)
+    }
+
+def upload_platforms(spec_path=None, prune=False, dry_run=False):
     """Upload platform data to the platform table"""
-    
+
     # Platform data with dimensions
-    platforms_data = [
-        ("Facebook", "1080x1080"),
-        ("Facebook", "1080x1920"),
-        ("Facebook", "1200x628"),
-        ("Instagram", "1080x1080"),
-        ("Instagram", "1080x1920"),  # Fixed the asterisk to x
-        ("Google", "125x125")        # Fixed the asterisk to x
-    ]
-    
+    platforms_data = load_platform_spec(spec_path) if spec_path else DEFAULT_PLATFORMS
+
     try:
-        # Connect to database
-        conn = get_db_connection()
-        if not conn:
-            print("Database connection failed")
-            return
-        
-        cursor = conn.cursor()
-        
-        # Clear existing data (optional - remove if you want to keep existing data)
-        cursor.execute("DELETE FROM platform")
-        print("Cleared existing platform data")
-        
-        # Insert platform data
-        query = """
-        INSERT INTO platform (platform_name, dimension)
-        VALUES (%s, %s)
-        """
-        
-        for platform_name, dimension in platforms_data:
-            cursor.execute(query, (platform_name, dimension))
-            print(f"Inserted: {platform_name} - {dimension}")
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        print(f"Successfully uploaded {len(platforms_data)} platform entries")
-        
+        start = time.perf_counter()
+        diff = sync_platforms(platforms_data, prune=prune, dry_run=dry_run)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        prefix = "[dry run] " if dry_run else ""
+        for platform_name, dimension in diff['added']:
+            print(f"{prefix}+ {platform_name} {dimension}")
+        for platform_name, dimension in diff['removed']:
+            print(f"{prefix}- {platform_name} {dimension}")
+        for platform_name, dimension in diff['kept_not_in_spec']:
+            print(f"{prefix}  kept (not in spec, use --prune): {platform_name} {dimension}")
+        print(f"{prefix}Synced {len(platforms_data)} spec rows in {elapsed:.1f}ms: "
+              f"{len(diff['added'])} added, {len(diff['removed'])} removed, {diff['unchanged']} unchanged")
+        return diff
+
     except Exception as e:
         print(f"Error uploading platforms: {e}")
+        return None
 
 if __name__ == '__main__':
-    upload_platforms()
+    parser = argparse.ArgumentParser(description='Sync the platform table from a spec file')
+    parser.add_argument('--spec', help='JSON or CSV platform spec (defaults to the built-in platforms)')
+    parser.add_argument('--prune', action='store_true', help='delete platform rows that are not in the spec')
+    parser.add_argument('--dry-run', action='store_true', help='report the diff without changing anything')
+    args = parser.parse_args()
+    upload_platforms(args.spec, prune=args.prune, dry_run=args.dry_run)